@@ -2,25 +2,34 @@
 from flask import Flask, request, jsonify
 from config import Config
 from extensions import db, ma
-from models import Customer, customer_schema, customers_schema
-import bcrypt
-import logging
-from logging.handlers import RotatingFileHandler
+from models import Customer, IdempotencyKey, customer_schema, customers_schema
+from sqlalchemy import delete, func, insert, select, update
+from sqlalchemy.exc import IntegrityError
+from datetime import datetime, timedelta
+import hashlib
+import json
+from audit_logging import init_audit_logging
+from tracing import init_tracing
+from metrics import init_metrics
+from passwords import PasswordHasher
+from tokens import issue_token
 
 app = Flask(__name__)
 app.config.from_object(Config)
 db.init_app(app)
 ma.init_app(app)
 
+# Audit log written as JSON lines by a background thread
+logger = init_audit_logging(app)
+init_metrics(app)
+init_tracing(app)
 
-log_file = "audit.log"  # Ensure this path is writable
-handler = RotatingFileHandler(log_file, maxBytes=100000, backupCount=5)
-formatter = logging.Formatter('%(asctime)s - %(levelname)s - %(message)s')
-handler.setFormatter(formatter)
-
-logger = logging.getLogger('audit_logger')
-logger.addHandler(handler)
-logger.setLevel(logging.INFO)
+# bcrypt runs in worker processes so slow hashing never blocks request threads
+password_hasher = PasswordHasher(
+    app.config['PASSWORD_HASH_WORKERS'],
+    rounds=app.config['BCRYPT_ROUNDS'],
+    timeout=app.config['PASSWORD_HASH_TIMEOUT']
+)
 
 # Routes
 @app.route('/customers', methods=['POST'])
@@ -70,16 +79,222 @@ def register_customer():
             balance=balance,
             marital_status=marital_status
         )
-        new_customer.set_password(password)
+        new_customer.password_hash = password_hasher.hash(password)
         db.session.add(new_customer)
         db.session.commit()
 
-        logger.info(f"Customer registered successfully: {username}")
+        logger.info("Customer registered successfully: %s", username)
         return jsonify({'message': 'Customer registered successfully'}), 201
     except Exception as e:
-        logger.exception(f"Error registering customer: {e}")
+        logger.exception("Error registering customer: %s", e)
         return jsonify({'message': 'Internal server error'}), 500
 
+# Columns accepted per row by POST /customers/import, with the JSON types each may hold
+IMPORT_FIELDS = {
+    'first_name': (str,),
+    'last_name': (str,),
+    'age': (int,),
+    'address': (str,),
+    'gender': (str,),
+    'marital_status': (bool,),
+    'balance': (int, float),
+}
+
+def parse_import_row(row):
+    """
+    Validate one row of a customer import.
+
+    Returns:
+        - tuple: The column values (without the password hash) and the password, or None and an error message.
+    """
+    if not isinstance(row, dict):
+        return None, 'Row must be a JSON object'
+    username, password = row.get('username'), row.get('password')
+    if not isinstance(username, str) or not username or len(username) > 50:
+        return None, 'A username of 1 to 50 characters is required'
+    if not isinstance(password, str) or not password:
+        return None, 'A password is required'
+    values = {'username': username}
+    for field, types in IMPORT_FIELDS.items():
+        value = row.get(field)
+        if value is not None and (not isinstance(value, types) or (bool not in types and isinstance(value, bool))):
+            return None, f'Invalid {field}'
+        values[field] = value
+    values['balance'] = values['balance'] or 0.0
+    values['marital_status'] = bool(values['marital_status'])
+    return (values, password), None
+
+def iter_import_rows():
+    """
+    Yield the rows of an import request: a JSON array, or JSON Lines read from the request stream.
+
+    Lines that are not valid JSON are yielded as exceptions so they are reported per row.
+    """
+    if request.mimetype in ('application/x-ndjson', 'application/jsonl', 'application/x-jsonlines'):
+        for line in request.stream:
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                yield json.loads(line)
+            except ValueError as e:
+                yield e
+    else:
+        rows = request.get_json(silent=True)
+        if not isinstance(rows, list):
+            raise ValueError('Body must be a JSON array of customers or JSON Lines')
+        yield from rows
+
+def import_customer_chunk(chunk, seen, errors):
+    """
+    Validate, hash and insert one chunk of import rows in a single transaction.
+
+    Usernames are checked against the database with one query per chunk and
+    passwords are hashed in parallel in the hashing pool; the rows are then
+    inserted with a single executemany.
+
+    Parameters:
+        - chunk (list): (row number, row) pairs.
+        - seen (set): Usernames already accepted earlier in this import; updated in place.
+        - errors (list): Per-row errors; appended to in place.
+
+    Returns:
+        - int: The number of customers inserted.
+    """
+    candidates = []
+    for number, row in chunk:
+        parsed, error = (None, 'Invalid JSON') if isinstance(row, Exception) else parse_import_row(row)
+        if error:
+            errors.append({'row': number, 'error': error})
+        elif parsed[0]['username'] in seen:
+            errors.append({'row': number, 'username': parsed[0]['username'], 'error': 'Duplicate username in import'})
+        else:
+            seen.add(parsed[0]['username'])
+            candidates.append((number, *parsed))
+
+    existing = set(db.session.execute(
+        select(Customer.username).where(Customer.username.in_([values['username'] for _, values, _ in candidates]))
+    ).scalars()) if candidates else set()
+    rows = []
+    for number, values, password in candidates:
+        if values['username'] in existing:
+            errors.append({'row': number, 'username': values['username'], 'error': 'Username already exists'})
+        else:
+            rows.append((number, values, password))
+    if not rows:
+        return 0
+
+    hashes = password_hasher.hash_many([password for _, _, password in rows])
+    records = [dict(values, password_hash=password_hash) for (_, values, _), password_hash in zip(rows, hashes)]
+    try:
+        db.session.execute(insert(Customer), records)
+        db.session.commit()
+    except IntegrityError:
+        # A concurrent registration took one of the usernames; report the whole chunk
+        db.session.rollback()
+        logger.warning("Customer import chunk rolled back after a uniqueness conflict.")
+        errors.extend(
+            {'row': number, 'username': values['username'], 'error': 'Username conflict; chunk not imported'}
+            for number, values, _ in rows
+        )
+        return 0
+    return len(records)
+
+@app.route('/customers/import', methods=['POST'])
+def import_customers():
+    """
+    Register many customers in bulk.
+
+    The body is either a JSON array of customers or JSON Lines (one customer
+    per line, with a `application/x-ndjson` or `application/jsonl` content
+    type), which is read as a stream. Rows are processed in chunks of
+    `CUSTOMER_IMPORT_CHUNK_SIZE`, each committed in its own transaction, so
+    valid rows are imported even when others fail.
+
+    Parameters:
+        - Body: Customers with the fields of POST /customers; `username` and `password` are required.
+
+    Returns:
+        - 200 OK: The number of imported and failed rows, and per-row errors
+          (1-based row numbers, at most `CUSTOMER_IMPORT_MAX_ERRORS`).
+        - 400 Bad Request: If the body is neither a JSON array nor JSON Lines.
+    """
+    chunk_size = app.config['CUSTOMER_IMPORT_CHUNK_SIZE']
+    imported, seen, errors, chunk = 0, set(), [], []
+    try:
+        for number, row in enumerate(iter_import_rows(), start=1):
+            chunk.append((number, row))
+            if len(chunk) >= chunk_size:
+                imported += import_customer_chunk(chunk, seen, errors)
+                chunk = []
+        if chunk:
+            imported += import_customer_chunk(chunk, seen, errors)
+    except ValueError as e:
+        logger.warning("Customer import rejected: %s", e)
+        return jsonify({'message': str(e)}), 400
+
+    logger.info("Customer import finished: %d imported, %d failed.", imported, len(errors))
+    errors.sort(key=lambda error: error['row'])
+    max_errors = app.config['CUSTOMER_IMPORT_MAX_ERRORS']
+    return jsonify({
+        'imported': imported,
+        'failed': len(errors),
+        'errors': errors[:max_errors],
+        'errors_truncated': len(errors) > max_errors
+    }), 200
+
+_dummy_password_hash = None
+
+def dummy_password_hash():
+    global _dummy_password_hash
+    if _dummy_password_hash is None:
+        _dummy_password_hash = password_hasher.hash('not-a-password')
+    return _dummy_password_hash
+
+@app.route('/customers/login', methods=['POST'])
+def login():
+    """
+    Log a customer in and issue an access token.
+
+    The password is verified with bcrypt in the hashing process pool. The
+    token is HMAC-signed with `SECRET_KEY` and expires after `TOKEN_TTL`
+    seconds, so other services holding the key can verify it without
+    calling this service.
+
+    Parameters:
+        - JSON body:
+            - username (str): The username of the customer.
+            - password (str): The customer's password.
+
+    Returns:
+        - 200 OK: The token, its type (`Bearer`) and lifetime in seconds.
+        - 400 Bad Request: If the username or password is missing.
+        - 401 Unauthorized: If the credentials are invalid.
+    """
+    data = request.get_json(silent=True) or {}
+    username = data.get('username')
+    password = data.get('password')
+    if not isinstance(username, str) or not isinstance(password, str) or not username or not password:
+        logger.warning("Login failed: Missing username or password.")
+        return jsonify({'message': 'Username and password are required'}), 400
+
+    password_hash = db.session.execute(
+        select(Customer.password_hash).where(Customer.username == username)
+    ).scalar_one_or_none()
+    # Unknown usernames are checked against a dummy hash so both cases take as long
+    if not password_hasher.verify(password, password_hash or dummy_password_hash()) or password_hash is None:
+        logger.warning("Login failed for username: %s", username)
+        return jsonify({'message': 'Invalid username or password'}), 401
+
+    token, expires_at = issue_token(username, app.config['SECRET_KEY'], app.config['TOKEN_TTL'])
+    logger.info("Customer logged in: %s", username)
+    return jsonify({
+        'token': token,
+        'token_type': 'Bearer',
+        'expires_in': app.config['TOKEN_TTL'],
+        'expires_at': expires_at
+    }), 200
+
 @app.route('/customers/<string:username>', methods=['GET'])
 def get_customer(username):
     """
@@ -89,43 +304,118 @@ def get_customer(username):
     
     Parameters:
         - username (str): The unique username of the customer.
+        - Query string:
+            - fields (str, optional): Comma-separated fields to return; only those columns are selected.
 
     Returns:
         - 200 OK: Customer details in JSON format.
+        - 400 Bad Request: If `fields` names an unknown field.
         - 404 Not Found: If no customer exists with the given username.
     """
     try:
-        customer = Customer.query.filter_by(username=username).first()
+        fields = parse_customer_fields(request.args.get('fields'))
+    except ValueError as e:
+        logger.warning("Invalid fields for customer %s: %s", username, e)
+        return jsonify({'message': str(e)}), 400
+
+    try:
+        customer = db.session.execute(
+            select(*[getattr(Customer, field) for field in fields]).where(Customer.username == username)
+        ).first()
         if not customer:
-            logger.warning(f"Customer not found: {username}")
+            logger.warning("Customer not found: %s", username)
             return jsonify({'message': 'Customer not found'}), 404
 
-        logger.info(f"Customer details retrieved: {username}")
+        logger.info("Customer details retrieved: %s", username)
+        return jsonify(customer_details(customer, fields)), 200
+    except Exception as e:
+        logger.exception("Error retrieving customer: %s", e)
+        return jsonify({'message': 'Internal server error'}), 500
+
+@app.route('/customers', methods=['GET'])
+def get_customers():
+    """
+    Get the details of many customers in one request.
+
+    All customers are fetched with a single `IN` query over the unique
+    username index.
+
+    Parameters:
+        - Query string:
+            - usernames (str): Comma-separated usernames (at most `CUSTOMER_BATCH_LIMIT`).
+            - fields (str, optional): Comma-separated fields to return; only those columns are selected.
+
+    Returns:
+        - 200 OK: Customer details keyed by username; unknown usernames map to null.
+        - 400 Bad Request: If usernames are missing, there are too many, or `fields` is invalid.
+    """
+    try:
+        fields = parse_customer_fields(request.args.get('fields'))
+    except ValueError as e:
+        logger.warning("Invalid fields for batch customer lookup: %s", e)
+        return jsonify({'message': str(e)}), 400
+
+    usernames = list(dict.fromkeys(
+        username.strip() for username in request.args.get('usernames', '').split(',') if username.strip()
+    ))
+    if not usernames:
+        logger.warning("Batch customer lookup missing usernames.")
+        return jsonify({'message': 'usernames is required'}), 400
+    if len(usernames) > app.config['CUSTOMER_BATCH_LIMIT']:
+        logger.warning("Batch customer lookup has too many usernames: %d", len(usernames))
+        return jsonify({'message': f"At most {app.config['CUSTOMER_BATCH_LIMIT']} usernames are allowed"}), 400
+
+    try:
+        columns = [getattr(Customer, field) for field in dict.fromkeys(('username', *fields))]
+        found = {
+            customer.username: customer
+            for customer in db.session.execute(select(*columns).where(Customer.username.in_(usernames)))
+        }
+        logger.info("Batch customer lookup: %d of %d found.", len(found), len(usernames))
         return jsonify({
-            'username': customer.username,
-            'first_name': customer.first_name,
-            'last_name': customer.last_name,
-            'age': customer.age,
-            'address': customer.address,
-            'gender': customer.gender,
-            'marital_status': customer.marital_status,
-            'balance': customer.balance
+            username: customer_details(found[username], fields) if username in found else None
+            for username in usernames
         }), 200
     except Exception as e:
-        logger.exception(f"Error retrieving customer: {e}")
+        logger.exception("Error retrieving customers: %s", e)
         return jsonify({'message': 'Internal server error'}), 500
 
+# Fields returned by the customer read endpoints, in order
+CUSTOMER_DETAIL_FIELDS = (
+    'username', 'first_name', 'last_name', 'age', 'address', 'gender', 'marital_status', 'balance'
+)
+
+def parse_customer_fields(value):
+    """
+    Parse a `fields` query parameter into a sparse fieldset (every detail field if absent).
+
+    Raises:
+        - ValueError: If a field is unknown or none is given.
+    """
+    if value is None:
+        return CUSTOMER_DETAIL_FIELDS
+    fields = tuple(dict.fromkeys(field.strip() for field in value.split(',') if field.strip()))
+    unknown = [field for field in fields if field not in CUSTOMER_DETAIL_FIELDS]
+    if unknown:
+        raise ValueError(f"Unknown field: {', '.join(unknown)}")
+    if not fields:
+        raise ValueError('fields must not be empty')
+    return fields
+
+def customer_details(customer, fields=CUSTOMER_DETAIL_FIELDS):
+    return {field: getattr(customer, field) for field in fields}
+
 @app.route('/customers/<string:username>', methods=['PUT'])
 def update_customer(username):
     """
     Update customer information with detailed logging.
     """
-    logger.info(f"Attempting to update customer information for username: {username}")
+    logger.info("Attempting to update customer information for username: %s", username)
 
     # Fetch the customer from the database
     customer = Customer.query.filter_by(username=username).first()
     if not customer:
-        logger.warning(f"Customer not found for username: {username}")
+        logger.warning("Customer not found for username: %s", username)
         return jsonify({'message': 'Customer not found'}), 404
 
     # Parse the request data
@@ -134,7 +424,7 @@ def update_customer(username):
         logger.warning("No data provided in the update request.")
         return jsonify({'message': 'No data provided'}), 400
 
-    logger.info(f"Update data received for username: {username} - Data: {data}")
+    logger.info("Update data received for username: %s - Data: %s", username, data)
 
     try:
         # Update fields with new values or keep existing ones
@@ -149,11 +439,11 @@ def update_customer(username):
         # Save changes to the database
         db.session.commit()
 
-        logger.info(f"Customer information updated successfully for username: {username}")
+        logger.info("Customer information updated successfully for username: %s", username)
         return customer_schema.jsonify(customer), 200
 
     except Exception as e:
-        logger.exception(f"Error updating customer for username: {username}")
+        logger.exception("Error updating customer for username: %s", username)
         return jsonify({'message': 'Internal server error'}), 500
 
 @app.route('/customers/<string:username>', methods=['DELETE'])
@@ -161,90 +451,319 @@ def delete_customer(username):
     """
     Delete a customer with detailed logging.
     """
-    logger.info(f"Attempting to delete customer with username: {username}")
+    logger.info("Attempting to delete customer with username: %s", username)
 
     # Fetch the customer from the database
     customer = Customer.query.filter_by(username=username).first()
     if not customer:
-        logger.warning(f"Customer not found for username: {username}")
+        logger.warning("Customer not found for username: %s", username)
         return jsonify({'message': 'Customer not found'}), 404
 
     # Delete customer
     try:
         db.session.delete(customer)
         db.session.commit()
-        logger.info(f"Customer deleted successfully for username: {username}")
+        logger.info("Customer deleted successfully for username: %s", username)
         return jsonify({'message': 'Customer deleted successfully'}), 200
     except Exception as e:
-        logger.exception(f"Error deleting customer for username: {username}")
+        logger.exception("Error deleting customer for username: %s", username)
         return jsonify({'message': 'Internal server error'}), 500
 
+# Longest Idempotency-Key that fits the idempotency_keys.key column
+IDEMPOTENCY_KEY_MAX_LENGTH = IdempotencyKey.__table__.c.key.type.length
+
+def request_fingerprint(data):
+    """
+    Hash a request body so a reused Idempotency-Key with a different request can be detected.
+    """
+    return hashlib.sha256(json.dumps(data, sort_keys=True).encode('utf-8')).hexdigest()
+
+def replay_idempotent_response(key, endpoint, fingerprint):
+    """
+    Look up the stored response for an Idempotency-Key.
+
+    Parameters:
+        - key (str): The Idempotency-Key header value.
+        - endpoint (str): The operation and target the key is scoped to.
+        - fingerprint (str): Hash of the current request body.
+
+    Returns:
+        - A (response, status_code) tuple to replay, or None if the key has not been used.
+    """
+    record = db.session.get(IdempotencyKey, key)
+    if record is None:
+        return None
+
+    if record.created_at < datetime.utcnow() - timedelta(seconds=app.config['IDEMPOTENCY_KEY_TTL']):
+        db.session.delete(record)
+        db.session.commit()
+        return None
+
+    if record.endpoint != endpoint or record.request_hash != fingerprint:
+        logger.warning("Idempotency-Key reused with a different request: %s", key)
+        return jsonify({'message': 'Idempotency-Key was already used for a different request'}), 422
+
+    logger.info("Replaying stored response for Idempotency-Key: %s", key)
+    response = jsonify(json.loads(record.response_body))
+    response.headers['Idempotent-Replayed'] = 'true'
+    return response, record.status_code
+
+def store_idempotent_response(key, endpoint, fingerprint, body, status_code):
+    """
+    Add the response for an Idempotency-Key to the current transaction.
+
+    The record is committed together with the balance change it describes,
+    so a change is never applied without its key being recorded.
+    """
+    db.session.add(IdempotencyKey(
+        key=key,
+        endpoint=endpoint,
+        request_hash=fingerprint,
+        status_code=status_code,
+        response_body=json.dumps(body)
+    ))
+
+def purge_expired_idempotency_keys():
+    """
+    Delete stored Idempotency-Key responses older than `IDEMPOTENCY_KEY_TTL`.
+    """
+    cutoff = datetime.utcnow() - timedelta(seconds=app.config['IDEMPOTENCY_KEY_TTL'])
+    db.session.execute(delete(IdempotencyKey).where(IdempotencyKey.created_at < cutoff))
+    db.session.commit()
+
+def apply_wallet_change(username, operation, statement, success_message):
+    """
+    Apply a single-statement balance update, honouring an optional Idempotency-Key header.
+
+    Parameters:
+        - username (str): The customer whose balance changes.
+        - operation (str): 'charge' or 'deduct', used to scope the Idempotency-Key.
+        - statement: The UPDATE to execute; it must match no row if the change is not allowed.
+        - success_message (str): Message prefix for the response, followed by the new balance.
+
+    Returns:
+        - A (response, status_code) tuple, or None if the statement matched no row.
+    """
+    data = request.get_json()
+    key = request.headers.get('Idempotency-Key')
+    endpoint = f'{operation}:{username}'
+    fingerprint = request_fingerprint(data)
+
+    if key and len(key) > IDEMPOTENCY_KEY_MAX_LENGTH:
+        logger.warning("Idempotency-Key too long for %s: %s characters", endpoint, len(key))
+        return jsonify({'message': f'Idempotency-Key must be at most {IDEMPOTENCY_KEY_MAX_LENGTH} characters'}), 400
+
+    if key:
+        replay = replay_idempotent_response(key, endpoint, fingerprint)
+        if replay:
+            return replay
+
+    if db.session.execute(statement).rowcount != 1:
+        db.session.rollback()
+        return None
+
+    new_balance = db.session.execute(
+        select(Customer.balance).where(Customer.username == username)
+    ).scalar_one()
+    body = {'message': f'{success_message}. New balance: {new_balance}'}
+
+    if key:
+        store_idempotent_response(key, endpoint, fingerprint, body, 200)
+    try:
+        db.session.commit()
+    except IntegrityError:
+        # A concurrent request with the same key won; replay its response instead
+        db.session.rollback()
+        return replay_idempotent_response(key, endpoint, fingerprint)
+
+    logger.info("Wallet %s applied for username: %s. New balance: %s", operation, username, new_balance)
+    return jsonify(body), 200
+
 @app.route('/customers/<string:username>/charge', methods=['POST'])
 def charge_wallet(username):
     """
     Charge customer's wallet (increase balance) with detailed logging.
-    """
-    logger.info(f"Attempting to charge wallet for customer with username: {username}")
 
-    # Fetch the customer from the database
-    customer = Customer.query.filter_by(username=username).first()
-    if not customer:
-        logger.warning(f"Customer not found for username: {username}")
-        return jsonify({'message': 'Customer not found'}), 404
+    The balance is increased with a single UPDATE. A request carrying an
+    `Idempotency-Key` header is applied at most once; retries with the same
+    key replay the original response.
+    """
+    logger.info("Attempting to charge wallet for customer with username: %s", username)
 
     # Parse the request data
     data = request.get_json()
     amount = data.get('amount')
 
     if amount is None or amount <= 0:
-        logger.warning(f"Invalid amount provided for charging wallet: {amount}")
+        logger.warning("Invalid amount provided for charging wallet: %s", amount)
         return jsonify({'message': 'Invalid amount'}), 400
 
     # Charge the wallet
     try:
-        customer.balance += amount
-        db.session.commit()
-        logger.info(f"Wallet charged successfully for username: {username}. New balance: {customer.balance}")
-        return jsonify({'message': f'Wallet charged successfully. New balance: {customer.balance}'}), 200
+        result = apply_wallet_change(
+            username,
+            'charge',
+            update(Customer)
+            .where(Customer.username == username)
+            .values(balance=func.coalesce(Customer.balance, 0) + amount)
+            .execution_options(synchronize_session=False),
+            'Wallet charged successfully'
+        )
+        if result is None:
+            logger.warning("Customer not found for username: %s", username)
+            return jsonify({'message': 'Customer not found'}), 404
+        return result
     except Exception as e:
-        logger.exception(f"Error charging wallet for username: {username}")
+        logger.exception("Error charging wallet for username: %s", username)
         return jsonify({'message': 'Internal server error'}), 500
 
 @app.route('/customers/<string:username>/deduct', methods=['POST'])
 def deduct_wallet(username):
     """
     Deduct amount from customer's wallet (decrease balance) with detailed logging.
-    """
-    logger.info(f"Attempting to deduct from wallet for customer with username: {username}")
 
-    # Fetch the customer from the database
-    customer = Customer.query.filter_by(username=username).first()
-    if not customer:
-        logger.warning(f"Customer not found for username: {username}")
-        return jsonify({'message': 'Customer not found'}), 404
+    The deduction is a single conditional ``UPDATE ... WHERE balance >= amount``,
+    so concurrent deductions can never overdraw the wallet. A request carrying
+    an `Idempotency-Key` header is applied at most once; retries with the same
+    key replay the original response.
+    """
+    logger.info("Attempting to deduct from wallet for customer with username: %s", username)
 
     # Parse the request data
     data = request.get_json()
     amount = data.get('amount')
 
     if amount is None or amount <= 0:
-        logger.warning(f"Invalid amount provided for deduction: {amount}")
+        logger.warning("Invalid amount provided for deduction: %s", amount)
         return jsonify({'message': 'Invalid amount'}), 400
 
-    if customer.balance < amount:
-        logger.warning(f"Insufficient balance for customer with username: {username}. Current balance: {customer.balance}, Requested amount: {amount}")
+    # Deduct the wallet
+    try:
+        result = apply_wallet_change(
+            username,
+            'deduct',
+            update(Customer)
+            .where(Customer.username == username, Customer.balance >= amount)
+            .values(balance=Customer.balance - amount)
+            .execution_options(synchronize_session=False),
+            'Amount deducted successfully'
+        )
+        if result is not None:
+            return result
+
+        balance = db.session.execute(
+            select(Customer.balance).where(Customer.username == username)
+        ).first()
+        if balance is None:
+            logger.warning("Customer not found for username: %s", username)
+            return jsonify({'message': 'Customer not found'}), 404
+
+        logger.warning("Insufficient balance for customer with username: %s. Current balance: %s, Requested amount: %s", username, balance[0], amount)
         return jsonify({'message': 'Insufficient balance'}), 400
+    except Exception as e:
+        logger.exception("Error deducting from wallet for username: %s", username)
+        return jsonify({'message': 'Internal server error'}), 500
 
-    # Deduct the wallet
+@app.route('/customers/<string:username>/refund', methods=['POST'])
+def refund_deduction(username):
+    """
+    Give back a deduction, identified by the Idempotency-Key it was sent with.
+
+    Meant for callers that cannot tell whether their deduction went through,
+    e.g. because the request timed out. The deduction's stored response is
+    replaced by the refund's in the same transaction as the balance change,
+    so a deduction is refunded at most once. Refunding a deduction that was
+    never applied changes no balance, and the key is recorded so that the
+    deduction is rejected if it arrives later.
+
+    Parameters:
+        - JSON body: amount (float), which must match the deduction's amount.
+        - Idempotency-Key header: The key the deduction was sent with.
+    """
+    logger.info("Attempting to refund a deduction for customer with username: %s", username)
+
+    data = request.get_json()
+    amount = data.get('amount')
+    key = request.headers.get('Idempotency-Key')
+
+    if amount is None or amount <= 0:
+        logger.warning("Invalid amount provided for refund: %s", amount)
+        return jsonify({'message': 'Invalid amount'}), 400
+    if not key:
+        logger.warning("Refund requested without an Idempotency-Key for username: %s", username)
+        return jsonify({'message': 'Idempotency-Key is required'}), 400
+    if len(key) > IDEMPOTENCY_KEY_MAX_LENGTH:
+        logger.warning("Idempotency-Key too long for refund: %s characters", len(key))
+        return jsonify({'message': f'Idempotency-Key must be at most {IDEMPOTENCY_KEY_MAX_LENGTH} characters'}), 400
+
+    deduct_endpoint, refund_endpoint = f'deduct:{username}', f'refund:{username}'
+    fingerprint = request_fingerprint(data)
     try:
-        customer.balance -= amount
-        db.session.commit()
-        logger.info(f"Amount deducted successfully for username: {username}. New balance: {customer.balance}")
-        return jsonify({'message': f'Amount deducted successfully. New balance: {customer.balance}'}), 200
+        # Another pass runs if a concurrent deduction or refund with the same key committed first
+        for _ in range(3):
+            record = db.session.get(IdempotencyKey, key)
+            if record is not None and record.endpoint != deduct_endpoint:
+                replay = replay_idempotent_response(key, refund_endpoint, fingerprint)
+                if replay:
+                    return replay
+                continue
+            if record is not None and record.request_hash != fingerprint:
+                logger.warning("Refund amount does not match the deduction for Idempotency-Key: %s", key)
+                return jsonify({'message': 'Idempotency-Key was already used for a different request'}), 422
+
+            if record is None:
+                body = {'message': 'Nothing to refund'}
+                store_idempotent_response(key, refund_endpoint, fingerprint, body, 200)
+            else:
+                claimed = db.session.execute(
+                    update(IdempotencyKey)
+                    .where(IdempotencyKey.key == key, IdempotencyKey.endpoint == deduct_endpoint)
+                    .values(endpoint=refund_endpoint, created_at=datetime.utcnow())
+                    .execution_options(synchronize_session=False)
+                ).rowcount
+                if claimed != 1:
+                    db.session.rollback()
+                    continue
+                db.session.execute(
+                    update(Customer)
+                    .where(Customer.username == username)
+                    .values(balance=Customer.balance + amount)
+                    .execution_options(synchronize_session=False)
+                )
+                new_balance = db.session.execute(
+                    select(Customer.balance).where(Customer.username == username)
+                ).scalar_one()
+                body = {'message': f'Deduction refunded successfully. New balance: {new_balance}'}
+                db.session.execute(
+                    update(IdempotencyKey)
+                    .where(IdempotencyKey.key == key)
+                    .values(status_code=200, response_body=json.dumps(body))
+                    .execution_options(synchronize_session=False)
+                )
+
+            try:
+                db.session.commit()
+            except IntegrityError:
+                db.session.rollback()
+                continue
+            logger.info("Refund for Idempotency-Key %s applied for username: %s. %s", key, username, body['message'])
+            return jsonify(body), 200
+
+        logger.warning("Refund for Idempotency-Key %s kept conflicting with concurrent requests.", key)
+        return jsonify({'message': 'Conflicting request with the same Idempotency-Key, please retry'}), 409
     except Exception as e:
-        logger.exception(f"Error deducting from wallet for username: {username}")
+        logger.exception("Error refunding a deduction for username: %s", username)
         return jsonify({'message': 'Internal server error'}), 500
 
+@app.route('/customers/idempotency-keys/purge', methods=['POST'])
+def purge_idempotency_keys():
+    """
+    Delete expired Idempotency-Key records. Intended to be called periodically.
+    """
+    purge_expired_idempotency_keys()
+    logger.info("Expired idempotency keys purged.")
+    return jsonify({'message': 'Expired idempotency keys purged'}), 200
+
 
 @app.route('/')
 def index():
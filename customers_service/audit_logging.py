@@ -0,0 +1,162 @@
+# audit_logging.py
+
+import atexit
+import copy
+import json
+import logging
+import queue
+import re
+import threading
+import time
+import uuid
+from datetime import datetime, timezone
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
+
+from flask import g, has_request_context, request
+
+# Client-supplied request IDs are forwarded downstream and logged, so only short plain tokens are kept
+REQUEST_ID_PATTERN = re.compile(r'[A-Za-z0-9._-]{1,128}')
+
+
+class JsonFormatter(logging.Formatter):
+    """
+    Format records as single-line JSON objects.
+
+    Request fields (``request_id``, ``method``, ``route``, ``status`` and
+    ``latency_ms``) are included when the record carries them.
+    """
+
+    REQUEST_FIELDS = ('request_id', 'method', 'route', 'status', 'latency_ms')
+
+    def format(self, record):
+        entry = {
+            'time': datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec='milliseconds'),
+            'level': record.levelname,
+            'message': record.getMessage(),
+        }
+        for field in self.REQUEST_FIELDS:
+            value = getattr(record, field, None)
+            if value is not None:
+                entry[field] = value
+        if record.exc_text:
+            entry['exception'] = record.exc_text
+        return json.dumps(entry, default=str)
+
+
+class RequestContextFilter(logging.Filter):
+    """
+    Stamp records with the current request's ID, method and route.
+
+    It runs on the calling thread, before the record is queued, while the
+    Flask request context is still available.
+    """
+
+    def filter(self, record):
+        if has_request_context():
+            record.request_id = getattr(g, 'request_id', None)
+            record.method = request.method
+            record.route = request.url_rule.rule if request.url_rule else request.path
+        return True
+
+
+class BoundedQueueHandler(QueueHandler):
+    """
+    Queue records for a background listener without ever blocking the caller.
+
+    When the queue is full the record is dropped and counted; the number of
+    dropped records is reported in a warning once the queue has room again.
+    """
+
+    def __init__(self, log_queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+        self._dropped_lock = threading.Lock()
+
+    def prepare(self, record):
+        # Resolve the message and traceback on the calling thread; the
+        # listener thread only serializes and writes the record
+        record = copy.copy(record)
+        record.msg, record.args = record.getMessage(), None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+    def enqueue(self, record):
+        with self._dropped_lock:
+            dropped, self.dropped = self.dropped, 0
+        try:
+            if dropped:
+                self.queue.put_nowait(logging.LogRecord(
+                    record.name, logging.WARNING, __file__, 0,
+                    'Audit log queue full; dropped %d records', (dropped,), None
+                ))
+            self.queue.put_nowait(record)
+        except queue.Full:
+            with self._dropped_lock:
+                self.dropped += dropped + 1
+
+
+def init_audit_logging(app, logger_name='audit_logger'):
+    """
+    Configure the audit logger to write JSON lines from a background thread.
+
+    Request threads only format the message and put the record on a bounded
+    queue; a ``QueueListener`` thread performs the file writes and rotations.
+    Every request gets an ID (taken from ``X-Request-ID`` when it matches
+    `REQUEST_ID_PATTERN`, otherwise generated), which is echoed in the
+    response and logged with the route, status and latency.
+
+    Settings (from ``app.config``):
+        - AUDIT_LOG_FILE (str): Path of the log file.
+        - AUDIT_LOG_MAX_BYTES (int): Size at which the file is rotated.
+        - AUDIT_LOG_BACKUP_COUNT (int): Number of rotated files kept.
+        - AUDIT_LOG_LEVEL (str): Minimum level logged, e.g. ``INFO``.
+        - AUDIT_LOG_QUEUE_SIZE (int): Records buffered before new ones are dropped.
+
+    Returns:
+        - logging.Logger: The configured audit logger.
+    """
+    logger = logging.getLogger(logger_name)
+    if 'audit_logging' in app.extensions:
+        return logger
+
+    file_handler = RotatingFileHandler(
+        app.config['AUDIT_LOG_FILE'],
+        maxBytes=app.config['AUDIT_LOG_MAX_BYTES'],
+        backupCount=app.config['AUDIT_LOG_BACKUP_COUNT'],
+        delay=True
+    )
+    file_handler.setFormatter(JsonFormatter())
+
+    queue_handler = BoundedQueueHandler(queue.Queue(maxsize=app.config['AUDIT_LOG_QUEUE_SIZE']))
+    queue_handler.addFilter(RequestContextFilter())
+    listener = QueueListener(queue_handler.queue, file_handler)
+    listener.start()
+    atexit.register(listener.stop)
+
+    logger.addHandler(queue_handler)
+    logger.setLevel(app.config['AUDIT_LOG_LEVEL'])
+
+    @app.before_request
+    def start_request_log():
+        request_id = request.headers.get('X-Request-ID')
+        g.request_id = request_id if request_id and REQUEST_ID_PATTERN.fullmatch(request_id) else uuid.uuid4().hex
+        g.request_started = time.perf_counter()
+
+    @app.after_request
+    def finish_request_log(response):
+        if 'request_id' not in g:
+            return response
+        response.headers['X-Request-ID'] = g.request_id
+        logger.info(
+            '%s %s %s', request.method, request.path, response.status_code,
+            extra={
+                'status': response.status_code,
+                'latency_ms': round((time.perf_counter() - g.request_started) * 1000, 2)
+            }
+        )
+        return response
+
+    app.extensions['audit_logging'] = listener
+    return logger
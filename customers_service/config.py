@@ -9,3 +9,33 @@ class Config:
     SQLALCHEMY_DATABASE_URI = 'sqlite:///' + os.path.join(basedir, 'customers.db')
     SQLALCHEMY_TRACK_MODIFICATIONS = False
     SECRET_KEY = 'your_secret_key'  # Replace with an actual secret key in production
+
+    # Seconds a stored Idempotency-Key response is replayed before the key may be reused
+    IDEMPOTENCY_KEY_TTL = 86400
+
+    # Password hashing: bcrypt cost factor, hashing processes (0 hashes on the
+    # request thread) and seconds to wait for a hash
+    BCRYPT_ROUNDS = int(os.environ.get('BCRYPT_ROUNDS', 12))
+    PASSWORD_HASH_WORKERS = int(os.environ.get('PASSWORD_HASH_WORKERS', os.cpu_count() or 1))
+    PASSWORD_HASH_TIMEOUT = 30.0
+
+    # POST /customers/import: rows per transaction, and per-row errors returned
+    CUSTOMER_IMPORT_CHUNK_SIZE = 1000
+    CUSTOMER_IMPORT_MAX_ERRORS = 1000
+
+    # Maximum number of usernames accepted by GET /customers?usernames=
+    CUSTOMER_BATCH_LIMIT = 100
+
+    # Seconds an access token issued by POST /customers/login stays valid
+    TOKEN_TTL = 3600
+
+    # Return a Server-Timing header breaking down DB, downstream call and serialization time
+    SERVER_TIMING = True
+
+    # Audit log: file, rotation size (bytes), rotated files kept, level, and
+    # records buffered for the background writer before new ones are dropped
+    AUDIT_LOG_FILE = os.environ.get('AUDIT_LOG_FILE', 'audit.log')
+    AUDIT_LOG_MAX_BYTES = int(os.environ.get('AUDIT_LOG_MAX_BYTES', 10 * 1024 * 1024))
+    AUDIT_LOG_BACKUP_COUNT = int(os.environ.get('AUDIT_LOG_BACKUP_COUNT', 5))
+    AUDIT_LOG_LEVEL = os.environ.get('AUDIT_LOG_LEVEL', 'INFO')
+    AUDIT_LOG_QUEUE_SIZE = int(os.environ.get('AUDIT_LOG_QUEUE_SIZE', 10000))
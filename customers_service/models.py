@@ -2,7 +2,9 @@
 
 from extensions import db, ma
 from marshmallow import validates, ValidationError
-import bcrypt
+from datetime import datetime
+from flask import current_app
+from passwords import hash_password, verify_password
 
 class Customer(db.Model):
     __tablename__ = 'customers'
@@ -21,11 +23,25 @@ class Customer(db.Model):
     def __repr__(self):
         return f'<Customer {self.username}>'
 
-    def set_password(self, password):
-        self.password_hash = bcrypt.hashpw(password.encode('utf-8'), bcrypt.gensalt()).decode('utf-8')
+    # Hash inline; request handlers use the process pool in `app.password_hasher` instead
+    def set_password(self, password, rounds=None):
+        self.password_hash = hash_password(password, rounds or current_app.config['BCRYPT_ROUNDS'])
 
     def check_password(self, password):
-        return bcrypt.checkpw(password.encode('utf-8'), self.password_hash.encode('utf-8'))
+        return verify_password(password, self.password_hash)
+
+class IdempotencyKey(db.Model):
+    __tablename__ = 'idempotency_keys'
+
+    key = db.Column(db.String(64), primary_key=True)
+    endpoint = db.Column(db.String(100), nullable=False)  # Operation and target, e.g. 'deduct:john_doe'
+    request_hash = db.Column(db.String(64), nullable=False)  # SHA-256 of the request body
+    status_code = db.Column(db.Integer, nullable=False)
+    response_body = db.Column(db.Text, nullable=False)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False, index=True)
+
+    def __repr__(self):
+        return f'<IdempotencyKey {self.key}>'
 
 class CustomerSchema(ma.SQLAlchemyAutoSchema):
     class Meta:
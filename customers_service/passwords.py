@@ -0,0 +1,85 @@
+# passwords.py
+
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from itertools import repeat
+
+import bcrypt
+
+
+def hash_password(password, rounds):
+    return bcrypt.hashpw(password.encode('utf-8'), bcrypt.gensalt(rounds)).decode('utf-8')
+
+
+def verify_password(password, password_hash):
+    return bcrypt.checkpw(password.encode('utf-8'), password_hash.encode('utf-8'))
+
+
+class PasswordHasher:
+    """
+    Run bcrypt hashing and verification in a pool of worker processes.
+
+    bcrypt is deliberately slow; running it in separate processes keeps a
+    burst of sign-ups or logins from holding the request threads (and the
+    GIL) of the service, so other endpoints stay responsive. With
+    ``max_workers=0`` the work is done inline on the calling thread.
+
+    The pool is created lazily and recreated after a fork, so every worker
+    process gets its own. Its processes are started with ``spawn`` rather
+    than forked, since forking a multithreaded server can copy locks held by
+    other threads into the child.
+
+    Parameters:
+        - max_workers (int): Number of hashing processes; 0 hashes inline.
+        - rounds (int): bcrypt cost factor for new hashes.
+        - timeout (float): Seconds to wait for a result before giving up.
+    """
+
+    def __init__(self, max_workers, rounds=12, timeout=30.0):
+        self.max_workers = max_workers
+        self.rounds = rounds
+        self.timeout = timeout
+        self._executor = None
+        self._pid = None
+        self._lock = threading.Lock()
+
+    @property
+    def executor(self):
+        with self._lock:
+            if self._executor is None or self._pid != os.getpid():
+                self._executor = ProcessPoolExecutor(
+                    max_workers=self.max_workers,
+                    mp_context=multiprocessing.get_context('spawn')
+                )
+                self._pid = os.getpid()
+            return self._executor
+
+    def _run(self, fn, *args):
+        if not self.max_workers:
+            return fn(*args)
+        return self.executor.submit(fn, *args).result(timeout=self.timeout)
+
+    def hash(self, password):
+        return self._run(hash_password, password, self.rounds)
+
+    def verify(self, password, password_hash):
+        return self._run(verify_password, password, password_hash)
+
+    def hash_many(self, passwords):
+        """
+        Hash many passwords across all worker processes, returning the hashes in order.
+        """
+        if not self.max_workers:
+            return [hash_password(password, self.rounds) for password in passwords]
+        chunksize = max(1, len(passwords) // (self.max_workers * 4))
+        return list(self.executor.map(
+            hash_password, passwords, repeat(self.rounds),
+            timeout=self.timeout * max(1, len(passwords) // self.max_workers), chunksize=chunksize
+        ))
+
+    def shutdown(self):
+        if self._executor is not None and self._pid == os.getpid():
+            self._executor.shutdown(wait=False, cancel_futures=True)
+        self._executor = None
@@ -5,7 +5,8 @@ current_dir = os.path.dirname(os.path.abspath(__file__))
 parent_dir = os.path.abspath(os.path.join(current_dir, '..'))
 sys.path.insert(0, parent_dir)
 import pytest
-from app import app
+from app import app, password_hasher
+from tokens import InvalidToken, verify_token
 from extensions import db
 from models import Customer
 import json
@@ -18,6 +19,7 @@ def client():
     app.config['TESTING'] = True
     app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///:memory:'
     app.config['SECRET_KEY'] = 'test_secret_key'
+    password_hasher.rounds = 4  # Cheap hashes keep the suite fast
     
     with app.test_client() as client:
         with app.app_context():
@@ -217,4 +219,237 @@ def test_insufficient_balance(client):
     assert response.status_code == 400
     data = response.get_json()
     assert data['message'] == 'Insufficient balance'
-    
\ No newline at end of file
+    
+
+def test_deduct_wallet_idempotency_key(client):
+    """
+    Test that a retried deduction with the same Idempotency-Key is applied once.
+    """
+    client.post('/customers', json={
+        'username': 'testuser1',
+        'password': 'password123',
+        'first_name': 'John',
+        'last_name': 'Doe',
+        'age': 30,
+        'address': '123 Elm St',
+        'gender': 'Male',
+        'marital_status': False
+    })
+    client.post('/customers/testuser1/charge', json={
+        'amount': 50.0
+    })
+
+    headers = {'Idempotency-Key': 'sale-123'}
+    first = client.post('/customers/testuser1/deduct', json={'amount': 20.0}, headers=headers)
+    second = client.post('/customers/testuser1/deduct', json={'amount': 20.0}, headers=headers)
+    assert first.status_code == 200
+    assert second.status_code == 200
+    assert second.get_json() == first.get_json()
+    assert second.headers['Idempotent-Replayed'] == 'true'
+
+    response = client.get('/customers/testuser1')
+    assert response.get_json()['balance'] == 30.0
+
+    # Reusing the key for a different request is rejected
+    response = client.post('/customers/testuser1/deduct', json={'amount': 5.0}, headers=headers)
+    assert response.status_code == 422
+
+    # Keys longer than the stored column are rejected before anything is applied
+    response = client.post('/customers/testuser1/deduct', json={'amount': 5.0}, headers={'Idempotency-Key': 'k' * 65})
+    assert response.status_code == 400
+    assert client.get('/customers/testuser1').get_json()['balance'] == 30.0
+
+
+def test_refund_deduction(client):
+    """
+    Test that a deduction is refunded once by its Idempotency-Key, and that a
+    refund sent before its deduction blocks the late deduction.
+    """
+    client.post('/customers', json={
+        'username': 'testuser1',
+        'password': 'password123',
+        'first_name': 'John',
+        'last_name': 'Doe',
+        'age': 30,
+        'address': '123 Elm St',
+        'gender': 'Male',
+        'marital_status': False
+    })
+    client.post('/customers/testuser1/charge', json={
+        'amount': 50.0
+    })
+
+    headers = {'Idempotency-Key': 'sale-123-deduct'}
+    client.post('/customers/testuser1/deduct', json={'amount': 20.0}, headers=headers)
+    first = client.post('/customers/testuser1/refund', json={'amount': 20.0}, headers=headers)
+    second = client.post('/customers/testuser1/refund', json={'amount': 20.0}, headers=headers)
+    assert first.status_code == second.status_code == 200
+    assert second.headers['Idempotent-Replayed'] == 'true'
+    assert client.get('/customers/testuser1').get_json()['balance'] == 50.0
+
+    # The refund must match the deduction
+    client.post('/customers/testuser1/deduct', json={'amount': 5.0}, headers={'Idempotency-Key': 'sale-456-deduct'})
+    response = client.post('/customers/testuser1/refund', json={'amount': 50.0},
+                           headers={'Idempotency-Key': 'sale-456-deduct'})
+    assert response.status_code == 422
+
+    # Refunding a deduction that never arrived changes nothing and rejects it later
+    headers = {'Idempotency-Key': 'sale-789-deduct'}
+    response = client.post('/customers/testuser1/refund', json={'amount': 10.0}, headers=headers)
+    assert response.status_code == 200
+    assert response.get_json()['message'] == 'Nothing to refund'
+    response = client.post('/customers/testuser1/deduct', json={'amount': 10.0}, headers=headers)
+    assert response.status_code == 422
+    assert client.get('/customers/testuser1').get_json()['balance'] == 45.0
+
+
+def test_deduct_wallet_unknown_customer(client):
+    """
+    Test deducting from a customer that does not exist.
+    """
+    response = client.post('/customers/ghost/deduct', json={
+        'amount': 10.0
+    })
+    assert response.status_code == 404
+    assert response.get_json()['message'] == 'Customer not found'
+
+
+def test_login(client):
+    """
+    Test logging in with valid and invalid credentials, and verifying the issued token.
+    """
+    with app.app_context():
+        customer = Customer(username='testuser1', first_name='John')
+        customer.password_hash = password_hasher.hash('password123')
+        db.session.add(customer)
+        db.session.commit()
+
+    response = client.post('/customers/login', json={'username': 'testuser1', 'password': 'password123'})
+    assert response.status_code == 200
+    data = response.get_json()
+    assert data['token_type'] == 'Bearer'
+    assert verify_token(data['token'], 'test_secret_key')['sub'] == 'testuser1'
+    with pytest.raises(InvalidToken):
+        verify_token(data['token'], 'another_secret')
+    with pytest.raises(InvalidToken):
+        verify_token(data['token'][:-2], 'test_secret_key')
+
+    response = client.post('/customers/login', json={'username': 'testuser1', 'password': 'wrong'})
+    assert response.status_code == 401
+    response = client.post('/customers/login', json={'username': 'nobody', 'password': 'password123'})
+    assert response.status_code == 401
+    response = client.post('/customers/login', json={'username': 'testuser1'})
+    assert response.status_code == 400
+
+
+def test_import_customers(client):
+    """
+    Test bulk import from a JSON array and from JSON Lines, with per-row errors.
+    """
+    with app.app_context():
+        existing = Customer(username='taken')
+        existing.password_hash = password_hasher.hash('password123')
+        db.session.add(existing)
+        db.session.commit()
+
+    response = client.post('/customers/import', json=[
+        {'username': 'alice', 'password': 'secret1', 'age': 30, 'balance': 10},
+        {'username': 'taken', 'password': 'secret2'},
+        {'username': 'alice', 'password': 'secret3'},
+        {'username': 'bob'},
+        {'username': 'carol', 'password': 'secret4', 'age': 'old'}
+    ])
+    assert response.status_code == 200
+    data = response.get_json()
+    assert data['imported'] == 1
+    assert [(e['row'], e['error']) for e in data['errors']] == [
+        (2, 'Username already exists'),
+        (3, 'Duplicate username in import'),
+        (4, 'A password is required'),
+        (5, 'Invalid age')
+    ]
+
+    app.config['CUSTOMER_IMPORT_CHUNK_SIZE'] = 2
+    try:
+        lines = '\n'.join(json.dumps({'username': f'user{i}', 'password': 'pw'}) for i in range(5))
+        response = client.post('/customers/import', data=lines + '\n{not json}\n',
+                               content_type='application/x-ndjson')
+    finally:
+        app.config['CUSTOMER_IMPORT_CHUNK_SIZE'] = 1000
+    data = response.get_json()
+    assert data['imported'] == 5
+    assert data['errors'] == [{'row': 6, 'error': 'Invalid JSON'}]
+
+    response = client.post('/customers/login', json={'username': 'user3', 'password': 'pw'})
+    assert response.status_code == 200
+    assert client.get('/customers/alice').get_json()['balance'] == 10
+    assert client.post('/customers/import', json={'username': 'dave'}).status_code == 400
+
+
+def test_get_customers_batch(client):
+    """
+    Test looking up several customers at once, including unknown usernames.
+    """
+    with app.app_context():
+        for username in ('alice', 'bob'):
+            customer = Customer(username=username, balance=5.0)
+            customer.password_hash = 'x'
+            db.session.add(customer)
+        db.session.commit()
+
+    response = client.get('/customers?usernames=alice,ghost,bob,alice')
+    assert response.status_code == 200
+    data = response.get_json()
+    assert set(data) == {'alice', 'ghost', 'bob'}
+    assert data['alice']['balance'] == 5.0
+    assert data['ghost'] is None
+
+    assert client.get('/customers').status_code == 400
+    usernames = ','.join(f'user{i}' for i in range(app.config['CUSTOMER_BATCH_LIMIT'] + 1))
+    assert client.get(f'/customers?usernames={usernames}').status_code == 400
+
+
+def test_get_customer_fields(client):
+    """
+    Test that `fields` limits the returned customer details.
+    """
+    with app.app_context():
+        customer = Customer(username='alice', first_name='Alice', balance=7.5)
+        customer.password_hash = 'x'
+        db.session.add(customer)
+        db.session.commit()
+
+    response = client.get('/customers/alice?fields=first_name,balance')
+    assert response.get_json() == {'first_name': 'Alice', 'balance': 7.5}
+    response = client.get('/customers?usernames=alice,bob&fields=balance')
+    assert response.get_json() == {'alice': {'balance': 7.5}, 'bob': None}
+    assert client.get('/customers/alice?fields=password_hash').status_code == 400
+
+
+def test_set_password_uses_configured_rounds(client):
+    """
+    Test that hashing on the model uses BCRYPT_ROUNDS like the hashing pool.
+    """
+    rounds = app.config['BCRYPT_ROUNDS']
+    app.config['BCRYPT_ROUNDS'] = 5
+    try:
+        with app.app_context():
+            customer = Customer(username='rounds_user')
+            customer.set_password('secret')
+        assert customer.password_hash.startswith('$2b$05$')
+        assert customer.check_password('secret')
+    finally:
+        app.config['BCRYPT_ROUNDS'] = rounds
+
+
+def test_password_hasher_spawns_workers():
+    """
+    Test that the hashing pool starts its processes with spawn rather than fork.
+    """
+    from passwords import PasswordHasher
+    hasher = PasswordHasher(1, rounds=4)
+    try:
+        assert hasher.executor._mp_context.get_start_method() == 'spawn'
+        assert hasher.verify('password123', hasher.hash('password123'))
+    finally:
+        hasher.shutdown()
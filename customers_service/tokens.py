@@ -0,0 +1,71 @@
+# tokens.py
+
+import base64
+import hashlib
+import hmac
+import json
+import time
+
+
+class InvalidToken(ValueError):
+    """
+    Raised when a token is malformed, has a bad signature or has expired.
+    """
+
+
+def _b64encode(raw):
+    return base64.urlsafe_b64encode(raw).decode('ascii').rstrip('=')
+
+
+def _b64decode(value):
+    return base64.urlsafe_b64decode(value + '=' * (-len(value) % 4))
+
+
+def _sign(payload, secret):
+    return hmac.new(secret.encode('utf-8'), payload.encode('ascii'), hashlib.sha256).digest()
+
+
+def issue_token(username, secret, ttl):
+    """
+    Issue a signed, expiring access token for ``username``.
+
+    The token is ``<payload>.<signature>``: a base64url JSON payload with the
+    subject and expiry, signed with HMAC-SHA256 over ``secret``. Any service
+    sharing the secret can verify it locally with `verify_token`; this module
+    only uses the standard library so it can be copied alongside.
+
+    Parameters:
+        - username (str): The token's subject.
+        - secret (str): The signing key (``Config.SECRET_KEY``).
+        - ttl (int): Seconds until the token expires.
+
+    Returns:
+        - tuple: The token string and its expiry as a Unix timestamp.
+    """
+    now = int(time.time())
+    claims = {'sub': username, 'iat': now, 'exp': now + ttl}
+    payload = _b64encode(json.dumps(claims, separators=(',', ':')).encode('utf-8'))
+    return f'{payload}.{_b64encode(_sign(payload, secret))}', claims['exp']
+
+
+def verify_token(token, secret):
+    """
+    Verify a token issued by `issue_token`.
+
+    Returns:
+        - dict: The token's claims (``sub``, ``iat``, ``exp``).
+
+    Raises:
+        - InvalidToken: If the token is malformed, forged or expired.
+    """
+    try:
+        payload, signature = token.split('.')
+        valid = hmac.compare_digest(_b64decode(signature), _sign(payload, secret))
+        claims = json.loads(_b64decode(payload)) if valid else None
+    except (ValueError, TypeError, UnicodeError, AttributeError) as e:
+        raise InvalidToken('Malformed token') from e
+    if claims is None:
+        raise InvalidToken('Invalid token signature')
+    if not isinstance(claims, dict) or claims.get('exp', 0) <= time.time():
+        raise InvalidToken('Token has expired')
+    return claims
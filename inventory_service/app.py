@@ -1,11 +1,19 @@
 # app.py
 
-import logging
-from logging.handlers import RotatingFileHandler
 from flask import Flask, request, jsonify
 from config import Config
 from functools import wraps
+import hashlib
+import time
+import uuid
+import zlib
+from datetime import datetime, timedelta, timezone
+from sqlalchemy import delete, select, tuple_, update
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
 from extensions import db, ma
+from audit_logging import init_audit_logging
+from tracing import init_tracing
+from metrics import init_metrics
 
 # Initialize Flask app
 app = Flask(__name__)
@@ -15,27 +23,24 @@ app.config.from_object(Config)
 db.init_app(app)
 ma.init_app(app)
 
-# Logger Configuration
-LOG_FILE = "audit.log"  # Path for the log file; ensure the directory is writable
-MAX_LOG_SIZE = 100000  # Maximum size of a log file in bytes
-BACKUP_COUNT = 5  # Number of backup files to keep
-
-# Create a rotating file handler
-handler = RotatingFileHandler(LOG_FILE, maxBytes=MAX_LOG_SIZE, backupCount=BACKUP_COUNT)
-
-# Set the log message format
-formatter = logging.Formatter('%(asctime)s - %(levelname)s - %(message)s')
-handler.setFormatter(formatter)
-
-# Configure the logger
-logger = logging.getLogger('audit_logger')
-logger.addHandler(handler)
-logger.setLevel(logging.INFO)
+# Logger Configuration: JSON lines written by a background thread (see AUDIT_LOG_* settings)
+logger = init_audit_logging(app)
+init_metrics(app)
+init_tracing(app)
 
 logger.info("Logger initialized successfully.")
 
 # Import models after initializing db and ma
-from models import Item, ItemSchema, item_schema, items_schema
+from models import CatalogueVersion, CommittedReservation, Item, ItemSchema, Reservation, item_schema, items_schema
+from pagination import coerce_cursor, decode_cursor, encode_cursor, parse_limit
+from search import create_search_index, register_search_index, search_items
+from serializers import RowSerializer, json_response
+
+# Keep the full-text search table in step with the items table
+register_search_index(Item.__table__)
+
+# Column-level equivalent of items_schema for list endpoints (see FAST_SERIALIZERS)
+item_serializer = RowSerializer(items_schema, Item.__table__)
 
 def require_api_key(f):
     @wraps(f)
@@ -47,6 +52,86 @@ def require_api_key(f):
         #     return jsonify({'message': 'Unauthorized'}), 401
     return decorated
 
+def bump_versions(item_ids):
+    """
+    Increment the catalogue version and the versions of the given items.
+
+    Every call invalidates all catalogue ETags, so callers only make it when
+    at least one item changed.
+
+    Must be called in the same transaction as the change it describes; the
+    versions back the ETag and Last-Modified headers of the GET endpoints.
+
+    Parameters:
+        - item_ids (iterable): IDs of the items that changed.
+    """
+    now = datetime.utcnow()
+    stmt = sqlite_insert(CatalogueVersion).values([
+        {'item_id': key, 'version': 1, 'updated_at': now} for key in {0, *item_ids}
+    ])
+    db.session.execute(stmt.on_conflict_do_update(
+        index_elements=['item_id'],
+        set_={'version': CatalogueVersion.version + 1, 'updated_at': now}
+    ))
+
+def current_version(key):
+    """
+    Read a version without loading any ORM instance.
+
+    Parameters:
+        - key (int): An item ID, or 0 for the whole catalogue.
+
+    Returns:
+        - tuple: The version (0 if never changed) and its last modification time (or None).
+    """
+    row = db.session.execute(
+        select(CatalogueVersion.version, CatalogueVersion.updated_at).where(CatalogueVersion.item_id == key)
+    ).first()
+    return (row.version, row.updated_at) if row else (0, None)
+
+def existing_item_version(item_id):
+    """
+    Read an item's version in the same query that checks the item exists.
+
+    Returns:
+        - tuple: As `current_version`, or None if there is no such item.
+    """
+    row = db.session.execute(
+        select(CatalogueVersion.version, CatalogueVersion.updated_at)
+        .select_from(Item)
+        .outerjoin(CatalogueVersion, CatalogueVersion.item_id == Item.id)
+        .where(Item.id == item_id)
+    ).first()
+    if row is None:
+        return None
+    return (row.version, row.updated_at) if row.version is not None else (0, None)
+
+def check_not_modified(etag, last_modified):
+    """
+    Answer a conditional GET from its validators.
+
+    `If-None-Match` takes precedence over `If-Modified-Since`.
+
+    Returns:
+        - A 304 response if the client's copy is current, otherwise None.
+    """
+    if request.if_none_match:
+        unchanged = request.if_none_match.contains(etag)
+    elif request.if_modified_since and last_modified:
+        unchanged = last_modified.replace(microsecond=0, tzinfo=timezone.utc) <= request.if_modified_since
+    else:
+        unchanged = False
+
+    if not unchanged:
+        return None
+    return set_validators(app.response_class(status=304), etag, last_modified)
+
+def set_validators(response, etag, last_modified):
+    response.set_etag(etag)
+    if last_modified:
+        response.last_modified = last_modified.replace(tzinfo=timezone.utc)
+    return response
+
 @app.route('/items', methods=['POST'])
 @require_api_key
 def add_item():
@@ -99,42 +184,291 @@ def add_item():
         stock_count=stock_count
     )
     db.session.add(new_item)
+    db.session.flush()
+    bump_versions([new_item.id])
     db.session.commit()
 
-    logger.info(f"Item added successfully: {new_item}")
+    logger.info("Item added successfully: %s", new_item)
     return item_schema.jsonify(new_item), 201
 
+# Sort keys accepted by GET /items: column to order by (None for the ID alone) and direction
+ITEM_SORTS = {
+    'id': (None, False),
+    'price': (Item.price, False),
+    '-price': (Item.price, True),
+    'name': (Item.name, False),
+    '-name': (Item.name, True),
+}
+
+def parse_bool(value):
+    if value.lower() in ('1', 'true', 'yes'):
+        return True
+    if value.lower() in ('0', 'false', 'no'):
+        return False
+    raise ValueError(f'Invalid boolean: {value}')
+
+def build_items_query(args, limit):
+    """
+    Translate the filter, sort and cursor parameters of GET /items into a query.
+
+    Pages are fetched with keyset pagination: the cursor holds the sort key of
+    the last row returned, and the next page starts strictly after it, so every
+    page is an index range scan regardless of how deep it is.
+
+    Parameters:
+        - args: The request's query parameters.
+        - limit (int): Page size; one extra row is fetched to detect a next page.
+
+    Returns:
+        - tuple: The query and the list of sort key columns.
+
+    Raises:
+        - ValueError: If any parameter is invalid.
+    """
+    query = Item.query
+
+    category = args.get('category')
+    if category is not None:
+        if category not in Item.__table__.c.category.type.enums:
+            raise ValueError('Invalid category')
+        query = query.filter(Item.category == category)
+    if args.get('min_price') is not None:
+        query = query.filter(Item.price >= float(args['min_price']))
+    if args.get('max_price') is not None:
+        query = query.filter(Item.price <= float(args['max_price']))
+    if args.get('in_stock') is not None:
+        in_stock = parse_bool(args['in_stock'])
+        query = query.filter(Item.stock_count > 0 if in_stock else Item.stock_count <= 0)
+
+    sort = args.get('sort', 'id')
+    if sort not in ITEM_SORTS:
+        raise ValueError('Invalid sort')
+    column, descending = ITEM_SORTS[sort]
+    key = [Item.id] if column is None else [column, Item.id]
+
+    cursor = args.get('cursor')
+    if cursor:
+        values = coerce_cursor(decode_cursor(cursor), key)
+        position, after = tuple_(*key), tuple_(*values)
+        query = query.filter(position < after if descending else position > after)
+
+    order = [c.desc() for c in key] if descending else key
+    return query.order_by(*order).limit(limit + 1), key
+
 @app.route('/items', methods=['GET'])
 def get_items():
     """
-    Get details of a specific item.
+    Get items in the inventory, optionally filtered, sorted and paginated.
 
-    This endpoint retrieves the details of an item using its unique ID.
+    The response carries a strong ETag derived from the catalogue version and
+    the query string, and a Last-Modified header. A matching `If-None-Match`
+    (or an `If-Modified-Since` not older than the last change) is answered
+    with 304 Not Modified without loading or serializing any item.
 
     Parameters:
-        - item_id (int): The unique ID of the item.
+        - Query string (all optional):
+            - category (str): Only items in this category.
+            - min_price, max_price (float): Inclusive price range.
+            - in_stock (bool): Only items with (true) or without (false) stock.
+            - sort (str): One of `id` (default), `price`, `-price`, `name`, `-name`.
+            - limit (int): Page size (default `ITEMS_PAGE_SIZE`, at most `ITEMS_MAX_PAGE_SIZE`).
+            - cursor (str): The `X-Next-Cursor` value of the previous page.
+            - ids (str): Comma-separated item IDs (at most `ITEMS_BATCH_LIMIT`) to look
+              up instead of listing; other parameters except `fields` are then ignored.
+            - fields (str): Comma-separated fields to return (sparse fieldset); only
+              those columns are selected.
+          Without `limit` or `cursor` the full listing is returned, capped at
+          `ITEMS_UNPAGINATED_LIMIT` items (with `X-Next-Cursor` set for the rest).
 
     Returns:
-        - 200 OK: Item details in JSON format.
-        - 404 Not Found: If no item exists with the given ID.
+        - 200 OK: List of items in JSON format; an `X-Next-Cursor` header is set when more items follow.
+          With `ids`, items keyed by ID, with null for IDs that do not exist.
+        - 304 Not Modified: If the client's copy is current.
+        - 400 Bad Request: If any query parameter is invalid.
+    """
+    version, last_modified = current_version(0)
+    etag = f'c{version}-{zlib.crc32(request.query_string):08x}'
+    not_modified = check_not_modified(etag, last_modified)
+    if not_modified:
+        logger.info("Items not modified since the client's copy.")
+        return not_modified
+
+    try:
+        serializer = item_serializer.only(request.args.get('fields'))
+    except ValueError as e:
+        logger.error("Failed to fetch items: %s.", e)
+        return jsonify({'message': str(e)}), 400
+
+    if 'ids' in request.args:
+        return get_items_by_id(request.args['ids'], serializer, etag, last_modified)
+
+    try:
+        if 'limit' in request.args or 'cursor' in request.args:
+            limit = parse_limit(request.args.get('limit'), app.config['ITEMS_PAGE_SIZE'], app.config['ITEMS_MAX_PAGE_SIZE'])
+        else:
+            limit = app.config['ITEMS_UNPAGINATED_LIMIT']
+        query, key = build_items_query(request.args, limit)
+    except ValueError as e:
+        logger.error("Failed to fetch items: %s.", e)
+        return jsonify({'message': str(e)}), 400
+
+    # A sparse fieldset can only be pushed into the SELECT on the column path
+    fast = app.config['FAST_SERIALIZERS'] or serializer is not item_serializer
+    items = (query.with_entities(*serializer.columns_with(*key)) if fast else query).all()
+    next_cursor = None
+    if len(items) > limit:
+        items = items[:limit]
+        next_cursor = encode_cursor([getattr(items[-1], column.key) for column in key])
+
+    if fast:
+        result = serializer.dump_many(items)
+        response = json_response(result)
+    else:
+        result = items_schema.dump(items)
+        response = jsonify(result)
+    logger.info("Fetched %s items from the inventory.", len(result))
+    response = set_validators(response, etag, last_modified)
+    if next_cursor:
+        response.headers['X-Next-Cursor'] = next_cursor
+    return response, 200
+
+def get_items_by_id(ids, serializer, etag, last_modified):
+    """
+    Look up many items with one primary-key `IN` query, keyed by ID with null for misses.
     """
-    all_items = Item.query.all()
-    result = items_schema.dump(all_items)
-    logger.info("Fetched all items from the inventory.")
-    return jsonify(result), 200
+    try:
+        item_ids = list(dict.fromkeys(int(value) for value in ids.split(',') if value.strip()))
+    except ValueError:
+        logger.error("Failed to fetch items: invalid ids.")
+        return jsonify({'message': 'ids must be a comma-separated list of integers'}), 400
+    if not item_ids:
+        logger.error("Failed to fetch items: empty ids.")
+        return jsonify({'message': 'ids is required'}), 400
+    if len(item_ids) > app.config['ITEMS_BATCH_LIMIT']:
+        logger.error("Failed to fetch items: %d ids requested.", len(item_ids))
+        return jsonify({'message': f"At most {app.config['ITEMS_BATCH_LIMIT']} ids are allowed"}), 400
+
+    if app.config['FAST_SERIALIZERS'] or serializer is not item_serializer:
+        rows = db.session.execute(select(*serializer.columns_with(Item.id)).where(Item.id.in_(item_ids)))
+        found = {row.id: serializer.dump(row) for row in rows}
+        respond = json_response
+    else:
+        found = {item.id: item_schema.dump(item) for item in Item.query.filter(Item.id.in_(item_ids))}
+        respond = jsonify
+    logger.info("Fetched %d of %d requested items.", len(found), len(item_ids))
+    result = {str(item_id): found.get(item_id) for item_id in item_ids}
+    return set_validators(respond(result), etag, last_modified), 200
+
+@app.route('/items/search', methods=['GET'])
+def search_catalogue():
+    """
+    Full-text search over item names and descriptions.
+
+    Matches come from an SQLite FTS5 index kept in sync with the items table
+    by triggers, and are ranked by BM25 with the name weighted above the
+    description. Every word of the query matches as a prefix.
+
+    Parameters:
+        - Query string:
+            - q (str): The search text.
+            - category (str, optional): Only items in this category.
+            - limit (int, optional): Page size (default `SEARCH_PAGE_SIZE`, at most `SEARCH_MAX_PAGE_SIZE`).
+            - cursor (str, optional): The `X-Next-Cursor` value of the previous page.
+
+    Returns:
+        - 200 OK: `items` in rank order; the first page (no cursor) also has the
+          `total` number of matching items (in `category`, if given) and
+          per-category `facets` counted without the category filter. An
+          `X-Next-Cursor` header is set when more items follow.
+        - 400 Bad Request: If any query parameter is invalid.
+    """
+    try:
+        category = request.args.get('category')
+        if category is not None and category not in Item.__table__.c.category.type.enums:
+            raise ValueError('Invalid category')
+        limit = parse_limit(request.args.get('limit'), app.config['SEARCH_PAGE_SIZE'], app.config['SEARCH_MAX_PAGE_SIZE'])
+        after = None
+        cursor = request.args.get('cursor')
+        if cursor:
+            rank, item_id = decode_cursor(cursor)
+            after = (float(rank), int(item_id))
+        rows, facets = search_items(
+            db.session, request.args.get('q'), category=category, limit=limit, after=after, with_facets=not cursor
+        )
+    except (TypeError, ValueError) as e:
+        logger.error("Search failed: %s.", e)
+        return jsonify({'message': str(e)}), 400
+
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = encode_cursor([rows[-1].rank, rows[-1].id])
+
+    found = {item.id: item for item in Item.query.filter(Item.id.in_([row.id for row in rows]))}
+    result = {'items': items_schema.dump([found[row.id] for row in rows if row.id in found])}
+    if facets is not None:
+        # Facets ignore the category filter; the total counts what the pages will return
+        result['total'] = facets.get(category, 0) if category else sum(facets.values())
+        result['facets'] = {'category': facets}
+
+    logger.info("Search returned %d items.", len(result['items']))
+    response = jsonify(result)
+    if next_cursor:
+        response.headers['X-Next-Cursor'] = next_cursor
+    return response, 200
 
 @app.route('/items/<int:item_id>', methods=['GET'])
 def get_item(item_id):
     """
     Get details of a specific item.
+
+    The response carries a strong ETag derived from the item's version, and
+    conditional requests are answered with 304 Not Modified without loading
+    or serializing the item.
+
+    Parameters:
+        - item_id (int): The unique ID of the item.
+        - Query string:
+            - fields (str, optional): Comma-separated fields to return; only those columns are selected.
+
+    Returns:
+        - 200 OK: Item details in JSON format.
+        - 304 Not Modified: If the client's copy is current.
+        - 400 Bad Request: If `fields` names an unknown field.
+        - 404 Not Found: If no item exists with the given ID.
     """
-    item = Item.query.get(item_id)
+    try:
+        serializer = item_serializer.only(request.args.get('fields'))
+    except ValueError as e:
+        logger.error("Failed to fetch item %s: %s.", item_id, e)
+        return jsonify({'message': str(e)}), 400
+
+    versioned = existing_item_version(item_id)
+    if versioned is None:
+        logger.warning("Item not found with ID: %s", item_id)
+        return jsonify({'message': 'Item not found'}), 404
+    version, last_modified = versioned
+    etag = f'i{item_id}-{version}'
+    if serializer is not item_serializer:
+        # Each fieldset is a different representation of the item
+        etag += f"-{zlib.crc32(request.args['fields'].encode('utf-8')):08x}"
+    not_modified = check_not_modified(etag, last_modified)
+    if not_modified:
+        logger.info("Item %s not modified since the client's copy.", item_id)
+        return not_modified
+
+    if serializer is not item_serializer:
+        row = db.session.execute(select(*serializer.columns).where(Item.id == item_id)).first()
+        item = serializer.dump(row) if row else None
+    else:
+        item = Item.query.get(item_id)
     if not item:
-        logger.warning(f"Item not found with ID: {item_id}")
+        logger.warning("Item not found with ID: %s", item_id)
         return jsonify({'message': 'Item not found'}), 404
 
-    logger.info(f"Item details fetched successfully for ID: {item_id}")
-    return item_schema.jsonify(item), 200
+    logger.info("Item details fetched successfully for ID: %s", item_id)
+    response = jsonify(item) if serializer is not item_serializer else item_schema.jsonify(item)
+    return set_validators(response, etag, last_modified), 200
 
 @app.route('/items/<int:item_id>', methods=['PUT'])
 @require_api_key
@@ -144,7 +478,7 @@ def update_item(item_id):
     """
     item = Item.query.get(item_id)
     if not item:
-        logger.warning(f"Failed to update: Item not found with ID: {item_id}")
+        logger.warning("Failed to update: Item not found with ID: %s", item_id)
         return jsonify({'message': 'Item not found'}), 404
 
     data = request.get_json()
@@ -171,9 +505,10 @@ def update_item(item_id):
     item.description = description
     item.stock_count = stock_count
 
+    bump_versions([item_id])
     db.session.commit()
 
-    logger.info(f"Item updated successfully: {item}")
+    logger.info("Item updated successfully: %s", item)
     return item_schema.jsonify(item), 200
 
 @app.route('/items/<int:item_id>', methods=['DELETE'])
@@ -184,15 +519,34 @@ def delete_item(item_id):
     """
     item = Item.query.get(item_id)
     if not item:
-        logger.warning(f"Failed to delete: Item not found with ID: {item_id}")
+        logger.warning("Failed to delete: Item not found with ID: %s", item_id)
         return jsonify({'message': 'Item not found'}), 404
 
     db.session.delete(item)
+    bump_versions([item_id])
     db.session.commit()
 
-    logger.info(f"Item deleted successfully: ID {item_id}")
+    logger.info("Item deleted successfully: ID %s", item_id)
     return jsonify({'message': 'Item deleted successfully'}), 200
 
+def deduct_stock(item_id, quantity):
+    """
+    Atomically deduct stock for an item within the current transaction.
+
+    The deduction is a single conditional ``UPDATE ... WHERE stock_count >= quantity``
+    so concurrent deductions can never drive the stock below zero.
+
+    Returns:
+        - bool: True if the stock was deducted, False if the item is missing or has insufficient stock.
+    """
+    result = db.session.execute(
+        update(Item)
+        .where(Item.id == item_id, Item.stock_count >= quantity)
+        .values(stock_count=Item.stock_count - quantity)
+        .execution_options(synchronize_session=False)
+    )
+    return result.rowcount == 1
+
 @app.route('/items/<int:item_id>/deduct', methods=['POST'])
 @require_api_key
 def deduct_item(item_id):
@@ -201,7 +555,7 @@ def deduct_item(item_id):
     """
     item = Item.query.get(item_id)
     if not item:
-        logger.warning(f"Failed to deduct: Item not found with ID: {item_id}")
+        logger.warning("Failed to deduct: Item not found with ID: %s", item_id)
         return jsonify({'message': 'Item not found'}), 404
 
     data = request.get_json()
@@ -217,16 +571,321 @@ def deduct_item(item_id):
         logger.error("Failed to deduct item: Quantity must be positive.")
         return jsonify({'message': 'Quantity must be positive'}), 400
 
-    if item.stock_count < quantity:
-        logger.warning(f"Failed to deduct: Insufficient stock for ID: {item_id}")
+    if not deduct_stock(item_id, quantity):
+        db.session.rollback()
+        logger.warning("Failed to deduct: Insufficient stock for ID: %s", item_id)
         return jsonify({'message': 'Insufficient stock'}), 400
 
-    item.stock_count -= quantity
+    bump_versions([item_id])
     db.session.commit()
 
-    logger.info(f"Stock deducted successfully for ID {item_id}: {quantity} items deducted.")
+    logger.info("Stock deducted successfully for ID %s: %s items deducted.", item_id, quantity)
     return item_schema.jsonify(item), 200
 
+def parse_stock_lines(data):
+    """
+    Parse the `items` list of a bulk stock request.
+
+    Returns:
+        - tuple: A list of (item_id, quantity) pairs and an error message, one of which is None.
+    """
+    lines = data.get('items') if data else None
+    if not lines or not isinstance(lines, list):
+        return None, 'Missing items'
+
+    parsed = []
+    for line in lines:
+        try:
+            item_id = int(line['item_id'])
+            quantity = int(line.get('quantity', 1))
+        except (KeyError, TypeError, ValueError, AttributeError):
+            return None, 'Each line requires a valid item_id and quantity'
+        if quantity <= 0:
+            return None, 'Quantity must be positive'
+        parsed.append((item_id, quantity))
+    return parsed, None
+
+def stock_line_results(parsed, applied, success_status):
+    """
+    Build per-line results for a bulk stock request after its transaction ended.
+
+    One query reports the resulting stock (or absence) of every requested item.
+    """
+    succeeded = all(applied)
+    stock_counts = dict(db.session.execute(
+        select(Item.id, Item.stock_count).where(Item.id.in_({item_id for item_id, _ in parsed}))
+    ).all())
+
+    results = []
+    for (item_id, quantity), ok in zip(parsed, applied):
+        if item_id not in stock_counts:
+            status = 'not_found'
+        elif not ok:
+            status = 'insufficient_stock'
+        else:
+            status = success_status if succeeded else 'rolled_back'
+        results.append({
+            'item_id': item_id,
+            'quantity': quantity,
+            'status': status,
+            'stock_count': stock_counts.get(item_id)
+        })
+    return results
+
+@app.route('/items/deduct', methods=['POST'])
+@require_api_key
+def deduct_items():
+    """
+    Deduct stock for many items in a single all-or-nothing transaction.
+
+    Each line is applied with a conditional update; if any line cannot be
+    deducted, the whole transaction is rolled back and no stock changes.
+
+    Parameters:
+        - JSON body:
+            - items (list): Lines with `item_id` (int) and `quantity` (int, defaults to 1).
+
+    Returns:
+        - 200 OK: All lines deducted, with per-line results including the new stock count.
+        - 400 Bad Request: If the body is invalid, or any item is missing or has insufficient stock
+          (per-line results report which lines failed).
+    """
+    parsed, error = parse_stock_lines(request.get_json())
+    if error:
+        logger.error("Failed to deduct items: %s.", error)
+        return jsonify({'message': error}), 400
+
+    applied = [deduct_stock(item_id, quantity) for item_id, quantity in parsed]
+    if all(applied):
+        bump_versions([item_id for item_id, _ in parsed])
+        db.session.commit()
+    else:
+        db.session.rollback()
+
+    results = stock_line_results(parsed, applied, 'deducted')
+    if not all(applied):
+        logger.warning("Failed to deduct items: %s", [r for r in results if r['status'] != 'rolled_back'])
+        return jsonify({'message': 'Stock deduction failed', 'results': results}), 400
+
+    logger.info("Stock deducted successfully for %s lines.", len(parsed))
+    return jsonify({'message': 'Stock deducted successfully', 'results': results}), 200
+
+def restore_stock(reserved_lines):
+    """
+    Return the stock held by deleted reservation rows to their items.
+
+    Parameters:
+        - reserved_lines (iterable): (item_id, quantity) pairs of the deleted reservations.
+    """
+    totals = {}
+    for item_id, quantity in reserved_lines:
+        totals[item_id] = totals.get(item_id, 0) + quantity
+    for item_id, quantity in totals.items():
+        db.session.execute(
+            update(Item)
+            .where(Item.id == item_id)
+            .values(stock_count=Item.stock_count + quantity)
+            .execution_options(synchronize_session=False)
+        )
+    return totals
+
+# Monotonic time of this process's last expiry sweep; reservations trigger a sweep when it is stale
+last_reservation_sweep = 0.0
+
+def release_expired_reservations():
+    """
+    Release every expired reservation and return its stock in one transaction.
+
+    Expired rows are found through the index on `expires_at` and removed with
+    ``DELETE ... RETURNING``, so a reservation committed concurrently can never
+    have its stock returned twice. Committed tokens older than
+    `RESERVATION_COMMIT_RETENTION` are forgotten in the same pass.
+
+    Returns:
+        - int: The number of reservation lines released.
+    """
+    global last_reservation_sweep
+    last_reservation_sweep = time.monotonic()
+    expired = db.session.execute(
+        delete(Reservation)
+        .where(Reservation.expires_at <= datetime.utcnow())
+        .returning(Reservation.item_id, Reservation.quantity)
+    ).all()
+    totals = restore_stock(expired)
+    if totals:
+        bump_versions(totals)
+    db.session.execute(
+        delete(CommittedReservation)
+        .where(CommittedReservation.committed_at
+               <= datetime.utcnow() - timedelta(seconds=app.config['RESERVATION_COMMIT_RETENTION']))
+    )
+    db.session.commit()
+    if expired:
+        logger.info("Released %s expired reservation lines.", len(expired))
+    return len(expired)
+
+@app.route('/items/reserve', methods=['POST'])
+@require_api_key
+def reserve_items():
+    """
+    Reserve stock for many items for a limited time.
+
+    Reserved stock is deducted immediately, all-or-nothing, and held under a
+    token until it is committed, released, or it expires and is swept back.
+
+    A reservation sent with a `key` is safe to retry: its token is derived
+    from the key, so while the reservation is held, or for
+    `RESERVATION_COMMIT_RETENTION` seconds after it was committed, the same
+    key returns the same token instead of reserving the stock again.
+
+    Parameters:
+        - JSON body:
+            - items (list): Lines with `item_id` (int) and `quantity` (int, defaults to 1).
+            - ttl (int, optional): Seconds to hold the stock, capped at `RESERVATION_MAX_TTL`.
+            - key (str, optional): Caller-chosen key identifying this reservation.
+
+    Returns:
+        - 201 Created: Stock reserved, now or by an earlier request with the same key, with the
+          reservation token, expiry time, whether it was already committed and per-line results.
+        - 400 Bad Request: If the body is invalid, or any item is missing or has insufficient stock.
+    """
+    data = request.get_json()
+    parsed, error = parse_stock_lines(data)
+    if error:
+        logger.error("Failed to reserve items: %s.", error)
+        return jsonify({'message': error}), 400
+
+    try:
+        ttl = int(data.get('ttl', app.config['RESERVATION_TTL']))
+    except (TypeError, ValueError):
+        logger.error("Failed to reserve items: Invalid ttl.")
+        return jsonify({'message': 'Invalid ttl'}), 400
+    ttl = max(1, min(ttl, app.config['RESERVATION_MAX_TTL']))
+
+    key = data.get('key')
+    if key is not None and (not isinstance(key, str) or not key):
+        logger.error("Failed to reserve items: Invalid key.")
+        return jsonify({'message': 'Invalid key'}), 400
+
+    if time.monotonic() - last_reservation_sweep >= app.config['RESERVATION_SWEEP_INTERVAL']:
+        release_expired_reservations()
+
+    if key is not None:
+        token = hashlib.sha256(key.encode('utf-8')).hexdigest()[:32]
+        held = db.session.execute(
+            select(Reservation.expires_at)
+            .where(Reservation.token == token, Reservation.expires_at > datetime.utcnow())
+        ).first()
+        committed = held is None and db.session.get(CommittedReservation, token) is not None
+        if held is not None or committed:
+            logger.info("Replaying stock reservation %s for a repeated key.", token)
+            response = jsonify({
+                'token': token,
+                'expires_at': held.expires_at.isoformat() if held is not None else None,
+                'committed': committed,
+                'results': stock_line_results(parsed, [True] * len(parsed), 'committed' if committed else 'reserved')
+            })
+            response.headers['Idempotent-Replayed'] = 'true'
+            return response, 201
+    else:
+        token = uuid.uuid4().hex
+
+    applied = [deduct_stock(item_id, quantity) for item_id, quantity in parsed]
+    if not all(applied):
+        db.session.rollback()
+        results = stock_line_results(parsed, applied, 'reserved')
+        logger.warning("Failed to reserve items: %s", [r for r in results if r['status'] != 'rolled_back'])
+        return jsonify({'message': 'Stock reservation failed', 'results': results}), 400
+
+    expires_at = datetime.utcnow() + timedelta(seconds=ttl)
+    db.session.add_all([
+        Reservation(token=token, item_id=item_id, quantity=quantity, expires_at=expires_at)
+        for item_id, quantity in parsed
+    ])
+    bump_versions([item_id for item_id, _ in parsed])
+    db.session.commit()
+
+    logger.info("Stock reserved successfully under token %s for %s lines.", token, len(parsed))
+    return jsonify({
+        'token': token,
+        'expires_at': expires_at.isoformat(),
+        'committed': False,
+        'results': stock_line_results(parsed, applied, 'reserved')
+    }), 201
+
+@app.route('/reservations/<string:token>/commit', methods=['POST'])
+@require_api_key
+def commit_reservation(token):
+    """
+    Commit a reservation, turning its held stock into a permanent deduction.
+
+    Committing is safe to repeat: the token is remembered for
+    `RESERVATION_COMMIT_RETENTION` seconds, and committing it again reports
+    success, so a caller whose commit timed out can simply retry it.
+
+    Returns:
+        - 200 OK: Reservation committed, now or by an earlier request.
+        - 404 Not Found: If the reservation does not exist, was released, or has expired.
+    """
+    now = datetime.utcnow()
+    committed = db.session.execute(
+        delete(Reservation)
+        .where(Reservation.token == token, Reservation.expires_at > now)
+        .returning(Reservation.id)
+    ).all()
+    if committed:
+        db.session.add(CommittedReservation(token=token, committed_at=now))
+        db.session.commit()
+        logger.info("Reservation committed successfully: %s", token)
+        return jsonify({'message': 'Reservation committed successfully'}), 200
+
+    db.session.rollback()
+    if db.session.get(CommittedReservation, token) is not None:
+        logger.info("Reservation already committed: %s", token)
+        return jsonify({'message': 'Reservation already committed'}), 200
+
+    logger.warning("Failed to commit: Reservation not found or expired: %s", token)
+    return jsonify({'message': 'Reservation not found or expired'}), 404
+
+@app.route('/reservations/<string:token>/release', methods=['POST'])
+@require_api_key
+def release_reservation(token):
+    """
+    Release a reservation, returning its held stock to the inventory.
+
+    Returns:
+        - 200 OK: Reservation released.
+        - 404 Not Found: If the reservation does not exist or was already finalized.
+    """
+    released = db.session.execute(
+        delete(Reservation)
+        .where(Reservation.token == token)
+        .returning(Reservation.item_id, Reservation.quantity)
+    ).all()
+    totals = restore_stock(released)
+    if totals:
+        bump_versions(totals)
+    db.session.commit()
+
+    if not released:
+        logger.warning("Failed to release: Reservation not found: %s", token)
+        return jsonify({'message': 'Reservation not found'}), 404
+
+    logger.info("Reservation released successfully: %s", token)
+    return jsonify({'message': 'Reservation released successfully'}), 200
+
+@app.route('/reservations/sweep', methods=['POST'])
+@require_api_key
+def sweep_reservations():
+    """
+    Release all expired reservations. Intended to be called periodically.
+
+    Returns:
+        - 200 OK: With the number of reservation lines released.
+    """
+    released = release_expired_reservations()
+    return jsonify({'message': 'Expired reservations released', 'released': released}), 200
+
 @app.route('/', methods=['GET'])
 def index():
     logger.info("Health check: Inventory Service is running.")
@@ -235,5 +894,10 @@ def index():
 if __name__ == '__main__':
     with app.app_context():
         db.create_all()
+        # create_all() skips existing tables, so add indexes introduced since the database was created
+        for index in Item.__table__.indexes:
+            index.create(db.engine, checkfirst=True)
+        with db.engine.begin() as connection:
+            create_search_index(connection)
     app.run(port=5001, debug=True)
 
@@ -10,3 +10,36 @@ class Config:
     SQLALCHEMY_TRACK_MODIFICATIONS = False
     # Secret key for security purposes
     SECRET_KEY = 'your_secret_key'  # Replace with an actual secret key in production
+
+    # Stock reservations: default and maximum hold time, and how often expired holds are swept (seconds)
+    RESERVATION_TTL = 60
+    RESERVATION_MAX_TTL = 900
+    RESERVATION_SWEEP_INTERVAL = 5
+    # Seconds a committed reservation token is remembered, so a repeated commit still succeeds
+    RESERVATION_COMMIT_RETENTION = 86400
+
+    # GET /items: default and maximum page size, and the cap on the legacy unpaginated listing
+    ITEMS_PAGE_SIZE = 50
+    ITEMS_MAX_PAGE_SIZE = 500
+    ITEMS_UNPAGINATED_LIMIT = 1000
+
+    # GET /items/search: default and maximum page size
+    SEARCH_PAGE_SIZE = 20
+    SEARCH_MAX_PAGE_SIZE = 100
+
+    # Serialize list endpoints with precompiled row serializers instead of marshmallow
+    FAST_SERIALIZERS = True
+
+    # Maximum number of IDs accepted by GET /items?ids=
+    ITEMS_BATCH_LIMIT = 100
+
+    # Return a Server-Timing header breaking down DB, downstream call and serialization time
+    SERVER_TIMING = True
+
+    # Audit log: file, rotation size (bytes), rotated files kept, level, and
+    # records buffered for the background writer before new ones are dropped
+    AUDIT_LOG_FILE = os.environ.get('AUDIT_LOG_FILE', 'audit.log')
+    AUDIT_LOG_MAX_BYTES = int(os.environ.get('AUDIT_LOG_MAX_BYTES', 10 * 1024 * 1024))
+    AUDIT_LOG_BACKUP_COUNT = int(os.environ.get('AUDIT_LOG_BACKUP_COUNT', 5))
+    AUDIT_LOG_LEVEL = os.environ.get('AUDIT_LOG_LEVEL', 'INFO')
+    AUDIT_LOG_QUEUE_SIZE = int(os.environ.get('AUDIT_LOG_QUEUE_SIZE', 10000))
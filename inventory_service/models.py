@@ -5,6 +5,12 @@ from marshmallow import validates, ValidationError
 
 class Item(db.Model):
     __tablename__ = 'items'
+    __table_args__ = (
+        # Keyset pagination and filtering for GET /items
+        db.Index('ix_items_category_price', 'category', 'price', 'id'),
+        db.Index('ix_items_price', 'price', 'id'),
+        db.Index('ix_items_name', 'name', 'id'),
+    )
 
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String(100), nullable=False)
@@ -34,3 +40,34 @@ class ItemSchema(ma.SQLAlchemyAutoSchema):
 
 item_schema = ItemSchema()
 items_schema = ItemSchema(many=True)
+
+class Reservation(db.Model):
+    __tablename__ = 'reservations'
+
+    id = db.Column(db.Integer, primary_key=True)
+    token = db.Column(db.String(32), nullable=False, index=True)
+    item_id = db.Column(db.Integer, nullable=False)
+    quantity = db.Column(db.Integer, nullable=False)
+    expires_at = db.Column(db.DateTime, nullable=False, index=True)  # Indexed for the expiry sweep
+
+    def __repr__(self):
+        return f'<Reservation {self.token} item={self.item_id} qty={self.quantity}>'
+
+class CommittedReservation(db.Model):
+    __tablename__ = 'committed_reservations'
+
+    token = db.Column(db.String(32), primary_key=True)
+    committed_at = db.Column(db.DateTime, nullable=False, index=True)  # Indexed for pruning
+
+    def __repr__(self):
+        return f'<CommittedReservation {self.token}>'
+
+class CatalogueVersion(db.Model):
+    __tablename__ = 'catalogue_versions'
+
+    item_id = db.Column(db.Integer, primary_key=True, autoincrement=False)  # 0 tracks the whole catalogue
+    version = db.Column(db.Integer, nullable=False, default=0)
+    updated_at = db.Column(db.DateTime, nullable=False)
+
+    def __repr__(self):
+        return f'<CatalogueVersion item={self.item_id} v{self.version}>'
@@ -0,0 +1,86 @@
+# pagination.py
+
+import base64
+import json
+from datetime import datetime
+
+
+def encode_cursor(values):
+    """
+    Encode the sort key of the last row of a page into an opaque cursor.
+
+    Parameters:
+        - values (list): The sort column values followed by the row's primary key.
+
+    Returns:
+        - str: A URL-safe cursor string.
+    """
+    raw = json.dumps(values, separators=(',', ':'), default=str).encode('utf-8')
+    return base64.urlsafe_b64encode(raw).decode('ascii').rstrip('=')
+
+
+def decode_cursor(cursor):
+    """
+    Decode a cursor produced by `encode_cursor`.
+
+    Raises:
+        - ValueError: If the cursor is malformed.
+    """
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        values = json.loads(base64.urlsafe_b64decode(padded.encode('ascii')))
+    except (ValueError, TypeError, UnicodeError) as e:
+        raise ValueError('Invalid cursor') from e
+    if not isinstance(values, list):
+        raise ValueError('Invalid cursor')
+    return values
+
+
+def coerce_cursor(values, columns):
+    """
+    Check decoded cursor values against the sort key columns and convert them to the columns' types.
+
+    Parameters:
+        - values (list): Values returned by `decode_cursor`.
+        - columns (list): The sort key columns, in the same order.
+
+    Raises:
+        - ValueError: If the number or the type of the values does not match the columns.
+    """
+    if len(values) != len(columns):
+        raise ValueError('Invalid cursor')
+    return [_coerce_cursor_value(value, column.type.python_type) for value, column in zip(values, columns)]
+
+
+def _coerce_cursor_value(value, python_type):
+    if python_type is datetime:
+        if isinstance(value, str):
+            try:
+                return datetime.fromisoformat(value)
+            except ValueError:
+                pass
+    elif python_type is str:
+        if isinstance(value, str):
+            return value
+    elif python_type is int:
+        if isinstance(value, int) and not isinstance(value, bool):
+            return value
+    elif python_type is float:
+        if isinstance(value, (int, float)) and not isinstance(value, bool):
+            return float(value)
+    raise ValueError('Invalid cursor')
+
+
+def parse_limit(value, default, maximum):
+    """
+    Parse a `limit` query parameter, clamped to ``maximum``.
+
+    Raises:
+        - ValueError: If the value is not a positive integer.
+    """
+    if value is None:
+        return default
+    limit = int(value)
+    if limit <= 0:
+        raise ValueError('limit must be positive')
+    return min(limit, maximum)
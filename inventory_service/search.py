@@ -0,0 +1,130 @@
+# search.py
+
+import re
+
+from sqlalchemy import event, text
+
+# Relative weights of the indexed columns in the BM25 ranking
+NAME_WEIGHT = 10.0
+DESCRIPTION_WEIGHT = 1.0
+
+# External-content FTS5 table over items(name, description). Triggers keep it in
+# sync; updates that do not touch the indexed columns (e.g. stock changes) skip it.
+SEARCH_INDEX_DDL = [
+    """
+    CREATE VIRTUAL TABLE IF NOT EXISTS items_fts USING fts5(
+        name, description,
+        content='items', content_rowid='id',
+        tokenize='unicode61 remove_diacritics 2', prefix='2 3'
+    )
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS items_fts_ai AFTER INSERT ON items BEGIN
+        INSERT INTO items_fts(rowid, name, description) VALUES (new.id, new.name, new.description);
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS items_fts_ad AFTER DELETE ON items BEGIN
+        INSERT INTO items_fts(items_fts, rowid, name, description) VALUES ('delete', old.id, old.name, old.description);
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS items_fts_au AFTER UPDATE OF name, description ON items BEGIN
+        INSERT INTO items_fts(items_fts, rowid, name, description) VALUES ('delete', old.id, old.name, old.description);
+        INSERT INTO items_fts(rowid, name, description) VALUES (new.id, new.name, new.description);
+    END
+    """,
+]
+
+MATCHES = """
+    SELECT items_fts.rowid AS id, bm25(items_fts, :name_weight, :description_weight) AS rank
+    FROM items_fts JOIN items ON items.id = items_fts.rowid
+    WHERE items_fts MATCH :query {category_filter}
+"""
+
+
+def create_search_index(connection):
+    """
+    Create the search table and its triggers if missing, indexing existing items when the table is new.
+    """
+    exists = connection.execute(
+        text("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'items_fts'")
+    ).first()
+    for statement in SEARCH_INDEX_DDL:
+        connection.execute(text(statement))
+    if not exists:
+        connection.execute(text("INSERT INTO items_fts(items_fts) VALUES ('rebuild')"))
+
+
+def drop_search_index(connection):
+    connection.execute(text('DROP TABLE IF EXISTS items_fts'))
+
+
+def register_search_index(items_table):
+    """
+    Create and drop the search table together with the items table (``create_all``/``drop_all``).
+    """
+    event.listen(items_table, 'after_create', lambda target, connection, **kw: create_search_index(connection))
+    event.listen(items_table, 'before_drop', lambda target, connection, **kw: drop_search_index(connection))
+
+
+def build_match_query(q):
+    """
+    Turn free text into an FTS5 query where every word must match as a prefix.
+
+    Words are quoted, so FTS5 operators and punctuation in the input are
+    treated as plain text.
+
+    Raises:
+        - ValueError: If the text contains no searchable words.
+    """
+    words = re.findall(r'\w+', q or '')
+    if not words:
+        raise ValueError('q must contain at least one word')
+    return ' '.join(f'"{word}"*' for word in words)
+
+
+def search_items(session, q, category=None, limit=20, after=None, with_facets=False):
+    """
+    Rank items matching ``q`` by BM25 (name weighted above description).
+
+    Pages are fetched with keyset pagination on (rank, id), so ``after`` is
+    the (rank, id) of the last result of the previous page.
+
+    Parameters:
+        - session: The database session.
+        - q (str): Free-text query; each word matches as a prefix.
+        - category (str): Only items in this category.
+        - limit (int): Page size; one extra row is fetched to detect a next page.
+        - after (tuple): The (rank, id) to continue after.
+        - with_facets (bool): Also count all matches per category (ignoring the category filter).
+
+    Returns:
+        - tuple: (id, rank) rows and the facet counts (None unless requested).
+
+    Raises:
+        - ValueError: If ``q`` has no searchable words.
+    """
+    params = {
+        'query': build_match_query(q),
+        'name_weight': NAME_WEIGHT,
+        'description_weight': DESCRIPTION_WEIGHT,
+        'limit': limit + 1,
+    }
+    matches = MATCHES.format(category_filter='AND items.category = :category' if category else '')
+    if category:
+        params['category'] = category
+
+    page = f'SELECT id, rank FROM ({matches})'
+    if after is not None:
+        page += ' WHERE rank > :after_rank OR (rank = :after_rank AND id > :after_id)'
+        params['after_rank'], params['after_id'] = after
+    rows = session.execute(text(page + ' ORDER BY rank, id LIMIT :limit'), params).all()
+
+    facets = None
+    if with_facets:
+        facets = dict(session.execute(text(
+            'SELECT items.category, count(*) FROM items_fts JOIN items ON items.id = items_fts.rowid '
+            'WHERE items_fts MATCH :query GROUP BY items.category'
+        ), {'query': params['query']}).all())
+    return rows, facets
@@ -10,6 +10,9 @@ from app import app
 from extensions import db
 from models import Item
 import json
+import logging
+import queue
+from audit_logging import BoundedQueueHandler, JsonFormatter
 
 API_KEY = 'your_api_key'  # Replace with the API key used in the service
 @pytest.fixture
@@ -198,3 +201,422 @@ def test_deduct_item_insufficient_stock(client):
     assert response.status_code == 400
     data = response.get_json()
     assert data['message'] == 'Insufficient stock'
+
+
+def test_deduct_items_batch(client):
+    """
+    Test deducting stock for several items in one request.
+    """
+    laptop_id = client.post('/items', json={
+        'name': 'Laptop', 'category': 'electronics', 'price': 1200.99, 'stock_count': 5
+    }, headers={'x-api-key': API_KEY}).get_json()['id']
+    shirt_id = client.post('/items', json={
+        'name': 'Shirt', 'category': 'clothes', 'price': 19.99, 'stock_count': 3
+    }, headers={'x-api-key': API_KEY}).get_json()['id']
+
+    response = client.post('/items/deduct', json={'items': [
+        {'item_id': laptop_id, 'quantity': 2},
+        {'item_id': shirt_id, 'quantity': 3}
+    ]}, headers={'x-api-key': API_KEY})
+    assert response.status_code == 200
+    results = response.get_json()['results']
+    assert [r['status'] for r in results] == ['deducted', 'deducted']
+    assert [r['stock_count'] for r in results] == [3, 0]
+
+
+def test_deduct_items_batch_is_all_or_nothing(client):
+    """
+    Test that a failing line rolls back every other line in the batch.
+    """
+    laptop_id = client.post('/items', json={
+        'name': 'Laptop', 'category': 'electronics', 'price': 1200.99, 'stock_count': 5
+    }, headers={'x-api-key': API_KEY}).get_json()['id']
+    shirt_id = client.post('/items', json={
+        'name': 'Shirt', 'category': 'clothes', 'price': 19.99, 'stock_count': 1
+    }, headers={'x-api-key': API_KEY}).get_json()['id']
+
+    response = client.post('/items/deduct', json={'items': [
+        {'item_id': laptop_id, 'quantity': 2},
+        {'item_id': shirt_id, 'quantity': 2},
+        {'item_id': 999, 'quantity': 1}
+    ]}, headers={'x-api-key': API_KEY})
+    assert response.status_code == 400
+    results = response.get_json()['results']
+    assert [r['status'] for r in results] == ['rolled_back', 'insufficient_stock', 'not_found']
+
+    assert client.get(f'/items/{laptop_id}').get_json()['stock_count'] == 5
+    assert client.get(f'/items/{shirt_id}').get_json()['stock_count'] == 1
+
+
+def test_reserve_and_commit_items(client):
+    """
+    Test that reserved stock is held immediately and stays deducted after commit.
+    """
+    item_id = client.post('/items', json={
+        'name': 'Laptop', 'category': 'electronics', 'price': 1200.99, 'stock_count': 5
+    }, headers={'x-api-key': API_KEY}).get_json()['id']
+
+    response = client.post('/items/reserve', json={
+        'items': [{'item_id': item_id, 'quantity': 2}]
+    }, headers={'x-api-key': API_KEY})
+    assert response.status_code == 201
+    token = response.get_json()['token']
+    assert client.get(f'/items/{item_id}').get_json()['stock_count'] == 3
+
+    response = client.post(f'/reservations/{token}/commit', headers={'x-api-key': API_KEY})
+    assert response.status_code == 200
+    assert client.get(f'/items/{item_id}').get_json()['stock_count'] == 3
+
+    # Committing again, e.g. after a timed-out commit, reports success without deducting again
+    response = client.post(f'/reservations/{token}/commit', headers={'x-api-key': API_KEY})
+    assert response.status_code == 200
+    assert response.get_json()['message'] == 'Reservation already committed'
+    assert client.get(f'/items/{item_id}').get_json()['stock_count'] == 3
+
+    # A committed reservation can no longer be released
+    response = client.post(f'/reservations/{token}/release', headers={'x-api-key': API_KEY})
+    assert response.status_code == 404
+
+
+def test_reserve_with_key_is_idempotent(client):
+    """
+    Test that repeating a keyed reservation holds and commits the stock only once.
+    """
+    item_id = client.post('/items', json={
+        'name': 'Laptop', 'category': 'electronics', 'price': 1200.99, 'stock_count': 5
+    }, headers={'x-api-key': API_KEY}).get_json()['id']
+    reservation = {'items': [{'item_id': item_id, 'quantity': 2}], 'key': 'checkout-1-reserve'}
+
+    first = client.post('/items/reserve', json=reservation, headers={'x-api-key': API_KEY})
+    second = client.post('/items/reserve', json=reservation, headers={'x-api-key': API_KEY})
+    assert first.status_code == second.status_code == 201
+    token = first.get_json()['token']
+    assert second.get_json()['token'] == token
+    assert second.headers['Idempotent-Replayed'] == 'true'
+    assert client.get(f'/items/{item_id}').get_json()['stock_count'] == 3
+
+    client.post(f'/reservations/{token}/commit', headers={'x-api-key': API_KEY})
+    third = client.post('/items/reserve', json=reservation, headers={'x-api-key': API_KEY})
+    assert third.status_code == 201
+    assert third.get_json()['token'] == token
+    assert third.get_json()['committed'] is True
+    assert client.post(f'/reservations/{token}/commit', headers={'x-api-key': API_KEY}).status_code == 200
+    assert client.get(f'/items/{item_id}').get_json()['stock_count'] == 3
+
+
+def test_reserve_and_release_items(client):
+    """
+    Test that releasing a reservation returns its stock.
+    """
+    item_id = client.post('/items', json={
+        'name': 'Laptop', 'category': 'electronics', 'price': 1200.99, 'stock_count': 5
+    }, headers={'x-api-key': API_KEY}).get_json()['id']
+
+    response = client.post('/items/reserve', json={
+        'items': [{'item_id': item_id, 'quantity': 5}]
+    }, headers={'x-api-key': API_KEY})
+    token = response.get_json()['token']
+
+    response = client.post('/items/reserve', json={
+        'items': [{'item_id': item_id, 'quantity': 1}]
+    }, headers={'x-api-key': API_KEY})
+    assert response.status_code == 400
+
+    response = client.post(f'/reservations/{token}/release', headers={'x-api-key': API_KEY})
+    assert response.status_code == 200
+    assert client.get(f'/items/{item_id}').get_json()['stock_count'] == 5
+
+
+def test_expired_reservations_are_swept(client):
+    """
+    Test that expired reservations return their stock and can no longer be committed.
+    """
+    from datetime import datetime, timedelta
+    from models import Reservation
+
+    item_id = client.post('/items', json={
+        'name': 'Laptop', 'category': 'electronics', 'price': 1200.99, 'stock_count': 5
+    }, headers={'x-api-key': API_KEY}).get_json()['id']
+    token = client.post('/items/reserve', json={
+        'items': [{'item_id': item_id, 'quantity': 4}]
+    }, headers={'x-api-key': API_KEY}).get_json()['token']
+
+    with app.app_context():
+        Reservation.query.filter_by(token=token).update(
+            {'expires_at': datetime.utcnow() - timedelta(seconds=1)}
+        )
+        db.session.commit()
+
+    response = client.post(f'/reservations/{token}/commit', headers={'x-api-key': API_KEY})
+    assert response.status_code == 404
+
+    response = client.post('/reservations/sweep', headers={'x-api-key': API_KEY})
+    assert response.get_json()['released'] == 1
+    assert client.get(f'/items/{item_id}').get_json()['stock_count'] == 5
+
+
+def test_get_items_etag(client):
+    """
+    Test that the item list is revalidated with its ETag and changes on writes.
+    """
+    client.post('/items', json={
+        'name': 'Laptop', 'category': 'electronics', 'price': 1200.99, 'stock_count': 5
+    }, headers={'x-api-key': API_KEY})
+
+    response = client.get('/items')
+    etag = response.headers['ETag']
+    assert response.headers['Last-Modified']
+
+    response = client.get('/items', headers={'If-None-Match': etag})
+    assert response.status_code == 304
+    assert response.data == b''
+    assert response.headers['ETag'] == etag
+
+    client.post('/items', json={
+        'name': 'Shirt', 'category': 'clothes', 'price': 19.99, 'stock_count': 3
+    }, headers={'x-api-key': API_KEY})
+    response = client.get('/items', headers={'If-None-Match': etag})
+    assert response.status_code == 200
+    assert response.headers['ETag'] != etag
+    assert len(response.get_json()) == 2
+
+
+def test_get_item_etag(client):
+    """
+    Test that an item's ETag changes only when that item changes.
+    """
+    laptop_id = client.post('/items', json={
+        'name': 'Laptop', 'category': 'electronics', 'price': 1200.99, 'stock_count': 5
+    }, headers={'x-api-key': API_KEY}).get_json()['id']
+    shirt_id = client.post('/items', json={
+        'name': 'Shirt', 'category': 'clothes', 'price': 19.99, 'stock_count': 3
+    }, headers={'x-api-key': API_KEY}).get_json()['id']
+
+    etag = client.get(f'/items/{laptop_id}').headers['ETag']
+
+    client.post(f'/items/{shirt_id}/deduct', json={'quantity': 1}, headers={'x-api-key': API_KEY})
+    response = client.get(f'/items/{laptop_id}', headers={'If-None-Match': etag})
+    assert response.status_code == 304
+
+    client.post(f'/items/{laptop_id}/deduct', json={'quantity': 1}, headers={'x-api-key': API_KEY})
+    response = client.get(f'/items/{laptop_id}', headers={'If-None-Match': etag})
+    assert response.status_code == 200
+    assert response.get_json()['stock_count'] == 4
+
+
+def test_noop_releases_keep_catalogue_etag(client):
+    """
+    Test that empty sweeps and unknown releases do not invalidate the catalogue ETag.
+    """
+    client.post('/items', json={
+        'name': 'Laptop', 'category': 'electronics', 'price': 1200.99, 'stock_count': 5
+    }, headers={'x-api-key': API_KEY})
+    etag = client.get('/items').headers['ETag']
+
+    assert client.post('/reservations/sweep', headers={'x-api-key': API_KEY}).get_json()['released'] == 0
+    assert client.post('/reservations/unknown/release', headers={'x-api-key': API_KEY}).status_code == 404
+    assert client.get('/items', headers={'If-None-Match': etag}).status_code == 304
+
+
+def test_get_missing_item_with_etag(client):
+    """
+    Test that a conditional GET of a missing item answers 404 rather than 304.
+    """
+    response = client.get('/items/42', headers={'If-None-Match': '"i42-0"'})
+    assert response.status_code == 404
+
+
+def test_get_items_rejects_mistyped_cursor(client):
+    """
+    Test that a well-formed cursor with values of the wrong type is a 400, not a database error.
+    """
+    from pagination import encode_cursor
+    response = client.get('/items', query_string={'sort': 'price', 'cursor': encode_cursor([[1], [2]])})
+    assert response.status_code == 400
+    response = client.get('/items', query_string={'sort': 'name', 'cursor': encode_cursor([3, 1])})
+    assert response.status_code == 400
+
+
+def test_get_items_keyset_pagination(client):
+    """
+    Test filtering, sorting and walking pages of items with a cursor.
+    """
+    for name, category, price in [('Apple', 'food', 1.5), ('Bread', 'food', 3.0), ('Cheese', 'food', 7.25),
+                                  ('Dates', 'food', 3.0), ('Laptop', 'electronics', 999.0)]:
+        client.post('/items', json={
+            'name': name, 'category': category, 'price': price, 'stock_count': 2
+        }, headers={'x-api-key': API_KEY})
+
+    response = client.get('/items?category=food&sort=-price&limit=2')
+    assert response.status_code == 200
+    assert [item['name'] for item in response.get_json()] == ['Cheese', 'Dates']
+    cursor = response.headers['X-Next-Cursor']
+
+    response = client.get(f'/items?category=food&sort=-price&limit=2&cursor={cursor}')
+    assert [item['name'] for item in response.get_json()] == ['Bread', 'Apple']
+    assert 'X-Next-Cursor' not in response.headers
+
+    response = client.get('/items?min_price=2&max_price=10&sort=price')
+    assert [item['name'] for item in response.get_json()] == ['Bread', 'Dates', 'Cheese']
+
+
+def test_get_items_unpaginated_cap(client):
+    """
+    Test that the legacy unpaginated listing is capped and points to the next page.
+    """
+    for name in ['Apple', 'Bread', 'Cheese']:
+        client.post('/items', json={
+            'name': name, 'category': 'food', 'price': 1.0, 'stock_count': 2
+        }, headers={'x-api-key': API_KEY})
+
+    app.config['ITEMS_UNPAGINATED_LIMIT'] = 2
+    try:
+        response = client.get('/items')
+    finally:
+        app.config['ITEMS_UNPAGINATED_LIMIT'] = 1000
+    assert len(response.get_json()) == 2
+    assert 'X-Next-Cursor' in response.headers
+
+
+def test_get_items_invalid_parameters(client):
+    """
+    Test that invalid query parameters are rejected.
+    """
+    assert client.get('/items?sort=stock').status_code == 400
+    assert client.get('/items?category=toys').status_code == 400
+    assert client.get('/items?cursor=not-a-cursor').status_code == 400
+    assert client.get('/items?limit=0').status_code == 400
+
+
+def test_request_id_and_bounded_audit_queue(client):
+    """
+    Test that requests are tagged with an ID and that a full audit log queue drops records instead of blocking.
+    """
+    response = client.get('/items', headers={'X-Request-ID': 'abc123'})
+    assert response.headers['X-Request-ID'] == 'abc123'
+    assert client.get('/items').headers['X-Request-ID']
+    # IDs that are too long or contain other characters are replaced
+    for unsafe in ['a' * 129, 'abc\tdef', 'abc def"']:
+        request_id = client.get('/items', headers={'X-Request-ID': unsafe}).headers['X-Request-ID']
+        assert request_id != unsafe and len(request_id) == 32
+
+    handler = BoundedQueueHandler(queue.Queue(maxsize=2))
+    record = logging.LogRecord('audit_logger', logging.INFO, __file__, 0, 'Item %s added', (7,), None)
+    for _ in range(3):
+        handler.handle(record)
+    assert handler.dropped == 1
+
+    # Once there is room again, the drop count is reported ahead of the next record
+    queued = handler.queue.get_nowait()
+    handler.queue.get_nowait()
+    handler.handle(record)
+    assert handler.dropped == 0
+    assert json.loads(JsonFormatter().format(queued))['message'] == 'Item 7 added'
+    assert 'dropped 1 records' in handler.queue.get_nowait().getMessage()
+
+
+def test_get_items_by_id(client):
+    """
+    Test looking up several items at once, including IDs that do not exist.
+    """
+    for name in ('Laptop', 'Mouse'):
+        client.post('/items', json={
+            'name': name, 'category': 'electronics', 'price': 10.0, 'stock_count': 3
+        }, headers={'x-api-key': API_KEY})
+
+    response = client.get('/items?ids=2,99,1')
+    assert response.status_code == 200
+    data = response.get_json()
+    assert set(data) == {'1', '2', '99'}
+    assert data['2'] == client.get('/items/2').get_json()
+    assert data['99'] is None
+    assert response.headers['ETag']
+
+    assert client.get('/items?ids=a').status_code == 400
+    assert client.get('/items?ids=').status_code == 400
+
+
+def test_search_items(client):
+    """
+    Test full-text search: prefix matching, ranking, facets, pagination and index sync.
+    """
+    for name, category, description in [
+        ('Gaming Laptop', 'electronics', 'Fast laptop for games'),
+        ('Laptop Sleeve', 'accessories', 'Protects a 15 inch laptop'),
+        ('Office Chair', 'accessories', 'Ergonomic chair'),
+    ]:
+        client.post('/items', json={
+            'name': name, 'category': category, 'price': 50.0, 'description': description, 'stock_count': 2
+        }, headers={'x-api-key': API_KEY})
+
+    response = client.get('/items/search?q=lapt')
+    assert response.status_code == 200
+    data = response.get_json()
+    assert data['total'] == 2
+    assert data['facets'] == {'category': {'electronics': 1, 'accessories': 1}}
+    # "laptop" appears in the name and description of the first item
+    assert [item['name'] for item in data['items']] == ['Gaming Laptop', 'Laptop Sleeve']
+
+    response = client.get('/items/search?q=laptop&limit=1')
+    assert len(response.get_json()['items']) == 1
+    response = client.get(f"/items/search?q=laptop&limit=1&cursor={response.headers['X-Next-Cursor']}")
+    assert [item['name'] for item in response.get_json()['items']] == ['Laptop Sleeve']
+    assert 'X-Next-Cursor' not in response.headers
+
+    response = client.get('/items/search?q=laptop&category=accessories')
+    assert [item['name'] for item in response.get_json()['items']] == ['Laptop Sleeve']
+    assert response.get_json()['total'] == 1
+    assert response.get_json()['facets'] == {'category': {'electronics': 1, 'accessories': 1}}
+
+    # Updates and deletes are reflected in the index
+    client.put('/items/3', json={'name': 'Laptop Stand'}, headers={'x-api-key': API_KEY})
+    client.delete('/items/1', headers={'x-api-key': API_KEY})
+    response = client.get('/items/search?q=laptop')
+    assert sorted(item['name'] for item in response.get_json()['items']) == ['Laptop Sleeve', 'Laptop Stand']
+
+    assert client.get('/items/search?q=%22').status_code == 400
+    assert client.get('/items/search?q=laptop&category=toys').status_code == 400
+
+
+def test_fast_serializers_match_marshmallow(client):
+    """
+    Test that the fast list serializers produce exactly the bytes of the marshmallow schemas.
+    """
+    for name, description in [('Laptop', 'Café edition'), ('Mouse', None)]:
+        client.post('/items', json={
+            'name': name, 'category': 'electronics', 'price': 12.5, 'description': description, 'stock_count': 0
+        }, headers={'x-api-key': API_KEY})
+
+    paths = ['/items', '/items?limit=1', '/items?sort=-price&in_stock=false', '/items?ids=2,1,5']
+    try:
+        app.config['FAST_SERIALIZERS'] = True
+        fast = [client.get(path) for path in paths]
+        app.config['FAST_SERIALIZERS'] = False
+        slow = [client.get(path) for path in paths]
+    finally:
+        app.config['FAST_SERIALIZERS'] = True
+    for fast_response, slow_response in zip(fast, slow):
+        assert fast_response.data == slow_response.data
+        assert fast_response.headers.get('X-Next-Cursor') == slow_response.headers.get('X-Next-Cursor')
+
+
+def test_sparse_fieldsets(client):
+    """
+    Test that `fields` limits the returned fields on the list, multi-get and detail endpoints.
+    """
+    client.post('/items', json={
+        'name': 'Laptop', 'category': 'electronics', 'price': 12.5, 'description': 'Long text', 'stock_count': 2
+    }, headers={'x-api-key': API_KEY})
+
+    assert client.get('/items?fields=id,name,price').get_json() == [{'id': 1, 'name': 'Laptop', 'price': 12.5}]
+    response = client.get('/items?fields=name&sort=-price&limit=1')
+    assert response.get_json() == [{'name': 'Laptop'}]
+    assert client.get('/items?ids=1,2&fields=price').get_json() == {'1': {'price': 12.5}, '2': None}
+
+    response = client.get('/items/1?fields=name,stock_count')
+    assert response.get_json() == {'name': 'Laptop', 'stock_count': 2}
+    assert response.headers['ETag'] != client.get('/items/1').headers['ETag']
+    assert client.get('/items/2?fields=name').status_code == 404
+
+    assert client.get('/items?fields=secret').status_code == 400
+    assert client.get('/items/1?fields=').status_code == 400
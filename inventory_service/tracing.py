@@ -0,0 +1,106 @@
+# tracing.py
+
+import contextvars
+import time
+from contextlib import contextmanager
+
+from flask import g
+from flask.json.provider import DefaultJSONProvider
+
+REQUEST_ID_HEADER = 'X-Request-ID'
+
+# Trace of the request being handled; executor tasks see it when submitted with `submit`
+_current_trace = contextvars.ContextVar('current_trace', default=None)
+
+
+class Trace:
+    """
+    Request ID and timings of one request.
+
+    Timings are (name, seconds) pairs; ``list.append`` is atomic, so tasks
+    running on executor threads can record into the same trace.
+    """
+
+    def __init__(self, request_id):
+        self.request_id = request_id
+        self.started = time.perf_counter()
+        self.timings = []
+
+    def server_timing(self):
+        """
+        Format the timings as a ``Server-Timing`` header, summing repeated names and ending with the total.
+        """
+        durations = {}
+        for name, seconds in self.timings:
+            durations[name] = durations.get(name, 0.0) + seconds
+        durations['total'] = time.perf_counter() - self.started
+        return ', '.join(f'{name};dur={seconds * 1000:.1f}' for name, seconds in durations.items())
+
+
+def current_request_id():
+    """
+    The ID of the request being handled, or None outside a request.
+    """
+    trace = _current_trace.get()
+    return trace.request_id if trace is not None else None
+
+
+def record_timing(name, seconds):
+    trace = _current_trace.get()
+    if trace is not None:
+        trace.timings.append((name, seconds))
+
+
+@contextmanager
+def timed(name):
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        record_timing(name, time.perf_counter() - started)
+
+
+def submit(executor, fn, *args, **kwargs):
+    """
+    Submit ``fn`` to ``executor`` in a copy of the caller's context, so it keeps the request's ID and trace.
+    """
+    return executor.submit(contextvars.copy_context().run, fn, *args, **kwargs)
+
+
+class TimedJSONProvider(DefaultJSONProvider):
+    """
+    The default JSON provider, recording the time spent encoding as ``serialize``.
+    """
+
+    def dumps(self, obj, **kwargs):
+        with timed('serialize'):
+            return super().dumps(obj, **kwargs)
+
+
+def init_tracing(app):
+    """
+    Trace every request and return a ``Server-Timing`` header.
+
+    The trace carries the request ID set by ``init_audit_logging`` (which
+    must be initialized first), so ``ServiceClient`` forwards it to other
+    services as ``X-Request-ID``. Database queries (``db``), calls to other
+    services (one entry per service) and JSON encoding (``serialize``) are
+    timed into it; the header reports each in milliseconds along with the
+    ``total``. The header is omitted when ``SERVER_TIMING`` is False.
+    """
+    app.json = TimedJSONProvider(app)
+
+    @app.before_request
+    def start_trace():
+        _current_trace.set(Trace(g.get('request_id')))
+
+    @app.after_request
+    def add_server_timing(response):
+        trace = _current_trace.get()
+        if trace is not None and app.config['SERVER_TIMING']:
+            response.headers['Server-Timing'] = trace.server_timing()
+        return response
+
+    @app.teardown_request
+    def end_trace(exc):
+        _current_trace.set(None)
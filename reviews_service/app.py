@@ -1,29 +1,17 @@
-import logging
-from logging.handlers import RotatingFileHandler
 from flask import Flask, request, jsonify
 from config import Config
 from extensions import db, ma
-from models import Review, review_schema, reviews_schema
-import requests
-
-# Logger Configuration
-LOG_FILE = "audit.log"  # Path for the log file; ensure the directory is writable
-MAX_LOG_SIZE = 100000  # Maximum size of a log file in bytes
-BACKUP_COUNT = 5  # Number of backup files to keep
-
-# Create a rotating file handler
-handler = RotatingFileHandler(LOG_FILE, maxBytes=MAX_LOG_SIZE, backupCount=BACKUP_COUNT)
-
-# Set the log message format
-formatter = logging.Formatter('%(asctime)s - %(levelname)s - %(message)s')
-handler.setFormatter(formatter)
-
-# Configure the logger
-logger = logging.getLogger('audit_logger')
-logger.addHandler(handler)
-logger.setLevel(logging.INFO)
-
-logger.info("Logger initialized successfully.")
+from models import Review, ReviewStats, review_schema, reviews_schema
+from pagination import coerce_cursor, decode_cursor, encode_cursor, parse_limit
+from sqlalchemy import case, delete, func, insert, select, tuple_, update
+from collections import Counter
+from functools import wraps
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from audit_logging import init_audit_logging
+from tracing import init_tracing
+from metrics import init_metrics
+from serializers import RowSerializer, json_response
+from tokens import InvalidToken, verify_token
 
 # Initialize Flask app
 app = Flask(__name__)
@@ -33,12 +21,143 @@ app.config.from_object(Config)
 db.init_app(app)
 ma.init_app(app)
 
+# Logger Configuration: JSON lines written by a background thread (see AUDIT_LOG_* settings)
+logger = init_audit_logging(app)
+init_metrics(app)
+init_tracing(app)
+logger.info("Logger initialized successfully.")
+
 # Constants for other services' URLs
 INVENTORY_SERVICE_URL = 'http://localhost:5001'
 CUSTOMERS_SERVICE_URL = 'http://localhost:5000'
 
+# Column-level equivalent of reviews_schema for list endpoints (see FAST_SERIALIZERS)
+review_serializer = RowSerializer(reviews_schema, Review.__table__)
+
+def approved_contribution(review):
+    """
+    The (item_id, rating) a review contributes to its item's rating summary, or None if it is not approved.
+    """
+    return (review.item_id, int(review.rating)) if review.status == 'approved' else None
+
+def update_review_stats(before, after):
+    """
+    Move a review's contribution in `review_stats` from `before` to `after`.
+
+    Each side is an (item_id, rating) pair from `approved_contribution`, or
+    None. Counts are adjusted inside the current transaction, so the summary
+    commits together with the review.
+    """
+    deltas = Counter()
+    record_stats_change(deltas, before, after)
+    apply_review_stats_deltas(deltas)
+
+def transition_review(review, deltas, **values):
+    """
+    Update a review only if its status and rating are still as read, recording its rating summary change.
+
+    Concurrent requests read a review without a lock, so the UPDATE is
+    conditional on the status and rating loaded with `review`: of two changes
+    made from the same read only one applies and moves its contribution in
+    `deltas`; the other must re-read the review.
+
+    Returns:
+    - True if the review was updated
+    """
+    before = approved_contribution(review)
+    status, rating = values.get('status', review.status), values.get('rating', review.rating)
+    updated = db.session.execute(
+        update(Review)
+        .where(Review.id == review.id, Review.status == review.status, Review.rating == review.rating)
+        .values(**values)
+    ).rowcount == 1
+    if updated:
+        record_stats_change(deltas, before, (review.item_id, int(rating)) if status == 'approved' else None)
+    return updated
+
+def record_stats_change(deltas, before, after):
+    if before != after:
+        if before is not None:
+            deltas[before] -= 1
+        if after is not None:
+            deltas[after] += 1
+
+def apply_review_stats_deltas(deltas):
+    """
+    Apply accumulated `{(item_id, rating): delta}` changes with one upsert per non-zero entry.
+    """
+    for (item_id, rating), delta in deltas.items():
+        if not delta:
+            continue
+        bucket = f'rating_{rating}'
+        stmt = sqlite_insert(ReviewStats).values(
+            item_id=item_id, review_count=delta, rating_sum=delta * rating, **{bucket: delta}
+        )
+        db.session.execute(stmt.on_conflict_do_update(
+            index_elements=['item_id'],
+            set_={
+                'review_count': ReviewStats.review_count + delta,
+                'rating_sum': ReviewStats.rating_sum + delta * rating,
+                bucket: getattr(ReviewStats, bucket) + delta
+            }
+        ))
+
+def rebuild_review_stats():
+    """
+    Recompute `review_stats` from the approved reviews in one INSERT ... SELECT.
+
+    Used to backfill the table for reviews written before it existed.
+    """
+    db.session.execute(delete(ReviewStats))
+    columns = [
+        Review.item_id,
+        func.count(Review.id),
+        func.sum(Review.rating),
+        *[func.sum(case((Review.rating == rating, 1), else_=0)) for rating in range(1, 6)]
+    ]
+    db.session.execute(insert(ReviewStats).from_select(
+        ['item_id', 'review_count', 'rating_sum', 'rating_1', 'rating_2', 'rating_3', 'rating_4', 'rating_5'],
+        select(*columns).where(Review.status == 'approved').group_by(Review.item_id)
+    ))
+    db.session.commit()
+
+def customer_token_required(f):
+    """
+    Check the bearer token of the customer a request acts for, without calling the Customers Service.
+
+    Tokens are issued by `POST /customers/login` and verified locally with the
+    shared `SECRET_KEY`; the token's subject must be the `username` of the
+    request (URL parameter or JSON body). Requests without a token are let
+    through unless `REQUIRE_CUSTOMER_TOKEN` is set.
+    """
+    @wraps(f)
+    def decorated(*args, **kwargs):
+        authorization = request.headers.get('Authorization')
+        if not authorization:
+            if app.config['REQUIRE_CUSTOMER_TOKEN']:
+                logger.warning("Request without a customer token rejected.")
+                return jsonify({'message': 'Authentication required'}), 401
+            return f(*args, **kwargs)
+
+        scheme, _, token = authorization.partition(' ')
+        try:
+            if scheme.lower() != 'bearer':
+                raise InvalidToken('Unsupported authorization scheme')
+            claims = verify_token(token, app.config['SECRET_KEY'])
+        except InvalidToken as e:
+            logger.warning("Invalid customer token: %s.", e)
+            return jsonify({'message': str(e)}), 401
+
+        username = kwargs.get('username') or (request.get_json(silent=True) or {}).get('username')
+        if claims['sub'] != username:
+            logger.warning("Token for %s used on behalf of %s.", claims['sub'], username)
+            return jsonify({'message': 'Token does not belong to this customer'}), 403
+        return f(*args, **kwargs)
+    return decorated
+
 # Submit a Review
 @app.route('/reviews', methods=['POST'])
+@customer_token_required
 def submit_review():
     """
     Submit a new review for a product.
@@ -75,34 +194,134 @@ def submit_review():
         comment=comment
     )
     db.session.add(new_review)
+    db.session.flush()
+    update_review_stats(None, approved_contribution(new_review))
     db.session.commit()
 
-    logger.info(f"Review submitted successfully: {new_review}")
+    logger.info("Review submitted successfully: %s", new_review)
     return review_schema.jsonify(new_review), 201
 
+REVIEW_STATUSES = ('pending', 'approved', 'flagged')
+
+# Sort keys accepted by GET /reviews/product/<item_id>; all are descending
+REVIEW_SORTS = {
+    'newest': [Review.review_date, Review.id],
+    'rating': [Review.rating, Review.review_date, Review.id],
+}
+
 # Get Reviews for a Product
 @app.route('/reviews/product/<int:item_id>', methods=['GET'])
 def get_reviews_for_product(item_id):
     """
-    Get all approved reviews for a specific product.
-    
+    Get a page of approved reviews for a specific product.
+
+    Pages are fetched with keyset pagination over the (item_id, status, ...)
+    indexes: the cursor holds the sort key of the last review returned, so
+    every page is a short index range scan however many reviews the product has.
+
     URL parameter:
     - item_id: ID of the item
-    
+
+    Query parameters (all optional):
+    - sort: `newest` (default) or `rating` (highest first, newest first within a rating)
+    - limit: Page size (default `REVIEWS_PAGE_SIZE`, at most `REVIEWS_MAX_PAGE_SIZE`)
+    - cursor: The `X-Next-Cursor` value of the previous page
+    - fields: Comma-separated fields to return; only those columns are selected
+
     Returns:
-    - 200: List of reviews
+    - 200: List of reviews; an `X-Next-Cursor` header is set when more reviews follow
+    - 400: Invalid query parameter
     - 404: No reviews found for the product
     """
-    logger.info(f"Fetching reviews for product ID: {item_id}")
-    reviews = Review.query.filter_by(item_id=item_id, status='approved').all()
-    if reviews:
-        logger.info(f"Found {len(reviews)} reviews for product ID: {item_id}")
-        result = reviews_schema.dump(reviews)
-        return jsonify(result), 200
+    logger.info("Fetching reviews for product ID: %s", item_id)
+    try:
+        key = REVIEW_SORTS.get(request.args.get('sort', 'newest'))
+        if key is None:
+            raise ValueError('Invalid sort')
+        limit = parse_limit(request.args.get('limit'), app.config['REVIEWS_PAGE_SIZE'], app.config['REVIEWS_MAX_PAGE_SIZE'])
+        serializer = review_serializer.only(request.args.get('fields'))
+        query = Review.query.filter_by(item_id=item_id, status='approved')
+        cursor = request.args.get('cursor')
+        if cursor:
+            # review_date is encoded as text and turned back into a datetime
+            values = coerce_cursor(decode_cursor(cursor), key)
+            query = query.filter(tuple_(*key) < tuple_(*values))
+    except (TypeError, ValueError) as e:
+        logger.warning("Invalid reviews request for product ID %s: %s.", item_id, e)
+        return jsonify({'message': 'Invalid query parameter'}), 400
+
+    # A sparse fieldset can only be pushed into the SELECT on the column path
+    fast = app.config['FAST_SERIALIZERS'] or serializer is not review_serializer
+    if fast:
+        query = query.with_entities(*serializer.columns_with(*key))
+    reviews = query.order_by(*[column.desc() for column in key]).limit(limit + 1).all()
+    next_cursor = None
+    if len(reviews) > limit:
+        reviews = reviews[:limit]
+        next_cursor = encode_cursor([getattr(reviews[-1], column.key) for column in key])
+
+    if reviews or cursor:
+        logger.info("Found %s reviews for product ID: %s", len(reviews), item_id)
+        response = json_response(serializer.dump_many(reviews)) if fast else jsonify(reviews_schema.dump(reviews))
+        if next_cursor:
+            response.headers['X-Next-Cursor'] = next_cursor
+        return response, 200
     else:
-        logger.warning(f"No reviews found for product ID: {item_id}")
+        logger.warning("No reviews found for product ID: %s", item_id)
         return jsonify({'message': 'No reviews found for this product'}), 404
 
+# Get the Rating Summary for a Product
+@app.route('/reviews/product/<int:item_id>/summary', methods=['GET'])
+def get_rating_summary(item_id):
+    """
+    Get the rating summary of a product's approved reviews.
+
+    The summary is read from the incrementally maintained `review_stats`
+    table, so no reviews are scanned.
+
+    URL parameter:
+    - item_id: ID of the item
+
+    Returns:
+    - 200: Review count, average rating (null without reviews) and a 1-5 histogram
+    """
+    logger.info("Fetching rating summary for product ID: %s", item_id)
+    stats = db.session.get(ReviewStats, item_id) or ReviewStats(item_id=item_id)
+    return jsonify(stats.to_summary()), 200
+
+# Get Rating Summaries for Many Products
+@app.route('/reviews/summary', methods=['GET'])
+def get_rating_summaries():
+    """
+    Get the rating summaries of many products in one request.
+
+    Query parameter:
+    - item_ids: Comma-separated item IDs (at most `REVIEW_SUMMARY_BATCH_LIMIT`)
+
+    Returns:
+    - 200: Summaries keyed by item ID; items without approved reviews have a zero count
+    - 400: Missing, invalid or too many item IDs
+    """
+    try:
+        item_ids = [int(value) for value in request.args.get('item_ids', '').split(',') if value.strip()]
+    except ValueError:
+        logger.warning("Rating summary request has invalid item IDs.")
+        return jsonify({'message': 'item_ids must be a comma-separated list of integers'}), 400
+
+    if not item_ids:
+        logger.warning("Rating summary request missing item IDs.")
+        return jsonify({'message': 'item_ids is required'}), 400
+    if len(item_ids) > app.config['REVIEW_SUMMARY_BATCH_LIMIT']:
+        logger.warning("Rating summary request has too many item IDs: %s", len(item_ids))
+        return jsonify({'message': f"At most {app.config['REVIEW_SUMMARY_BATCH_LIMIT']} item_ids are allowed"}), 400
+
+    found = {stats.item_id: stats for stats in ReviewStats.query.filter(ReviewStats.item_id.in_(item_ids))}
+    logger.info("Fetched rating summaries for %s products.", len(item_ids))
+    return jsonify({
+        str(item_id): (found.get(item_id) or ReviewStats(item_id=item_id)).to_summary()
+        for item_id in item_ids
+    }), 200
+
 # Update a Review
 @app.route('/reviews/<int:review_id>', methods=['PUT'])
 def update_review(review_id):
@@ -120,11 +339,12 @@ def update_review(review_id):
     - 200: Review updated successfully
     - 400: Invalid rating
     - 404: Review not found
+    - 409: The review was changed by a concurrent request
     """
-    logger.info(f"Received request to update review ID: {review_id}")
+    logger.info("Received request to update review ID: %s", review_id)
     review = Review.query.get(review_id)
     if not review:
-        logger.warning(f"Update failed: Review not found with ID: {review_id}")
+        logger.warning("Update failed: Review not found with ID: %s", review_id)
         return jsonify({'message': 'Review not found'}), 404
 
     data = request.get_json()
@@ -132,15 +352,18 @@ def update_review(review_id):
     comment = data.get('comment', review.comment)
 
     if rating < 1 or rating > 5:
-        logger.warning(f"Update failed: Invalid rating value for review ID: {review_id}")
+        logger.warning("Update failed: Invalid rating value for review ID: %s", review_id)
         return jsonify({'message': 'Rating must be between 1 and 5'}), 400
 
-    review.rating = rating
-    review.comment = comment
-    review.status = 'pending'  # Reset status after update
+    deltas = Counter()
+    if not transition_review(review, deltas, rating=rating, comment=comment, status='pending'):  # Reset status after update
+        db.session.rollback()
+        logger.warning("Update failed: Review ID %s was changed concurrently.", review_id)
+        return jsonify({'message': 'Review was changed concurrently, please retry'}), 409
 
+    apply_review_stats_deltas(deltas)
     db.session.commit()
-    logger.info(f"Review ID {review_id} updated successfully.")
+    logger.info("Review ID %s updated successfully.", review_id)
     return review_schema.jsonify(review), 200
 
 # Delete a Review
@@ -155,16 +378,27 @@ def delete_review(review_id):
     Returns:
     - 200: Review deleted successfully
     - 404: Review not found
+    - 409: The review was changed by a concurrent request
     """
-    logger.info(f"Received request to delete review ID: {review_id}")
+    logger.info("Received request to delete review ID: %s", review_id)
     review = Review.query.get(review_id)
     if not review:
-        logger.warning(f"Delete failed: Review not found with ID: {review_id}")
+        logger.warning("Delete failed: Review not found with ID: %s", review_id)
         return jsonify({'message': 'Review not found'}), 404
 
-    db.session.delete(review)
+    # Like `transition_review`, only delete the review as it was read
+    deleted = db.session.execute(
+        delete(Review)
+        .where(Review.id == review.id, Review.status == review.status, Review.rating == review.rating)
+    ).rowcount == 1
+    if not deleted:
+        db.session.rollback()
+        logger.warning("Delete failed: Review ID %s was changed concurrently.", review_id)
+        return jsonify({'message': 'Review was changed concurrently, please retry'}), 409
+
+    update_review_stats(approved_contribution(review), None)
     db.session.commit()
-    logger.info(f"Review ID {review_id} deleted successfully.")
+    logger.info("Review ID %s deleted successfully.", review_id)
     return jsonify({'message': 'Review deleted successfully'}), 200
 
 # Moderate a Review (Admin Only)
@@ -183,25 +417,142 @@ def moderate_review(review_id):
     - 200: Review moderated successfully
     - 400: Invalid action
     - 404: Review not found
+    - 409: The review was changed by a concurrent request
     """
-    logger.info(f"Received request to moderate review ID: {review_id}")
+    logger.info("Received request to moderate review ID: %s", review_id)
     review = Review.query.get(review_id)
     if not review:
-        logger.warning(f"Moderation failed: Review not found with ID: {review_id}")
+        logger.warning("Moderation failed: Review not found with ID: %s", review_id)
         return jsonify({'message': 'Review not found'}), 404
 
     data = request.get_json()
     action = data.get('action')
 
     if action not in ['approve', 'flag']:
-        logger.warning(f"Moderation failed: Invalid action for review ID: {review_id}")
+        logger.warning("Moderation failed: Invalid action for review ID: %s", review_id)
         return jsonify({'message': 'Invalid action'}), 400
 
-    review.status = 'approved' if action == 'approve' else 'flagged'
+    status = 'approved' if action == 'approve' else 'flagged'
+    deltas = Counter()
+    if not transition_review(review, deltas, status=status):
+        db.session.rollback()
+        logger.warning("Moderation failed: Review ID %s was changed concurrently.", review_id)
+        return jsonify({'message': 'Review was changed concurrently, please retry'}), 409
+
+    apply_review_stats_deltas(deltas)
+    db.session.commit()
+    logger.info("Review ID %s moderated successfully: %s", review_id, status)
+    return jsonify({'message': f'Review {status}'}), 200
+
+# List the Moderation Queue (Admin Only)
+@app.route('/reviews/moderation', methods=['GET'])
+def get_moderation_queue():
+    """
+    Get a page of reviews with a given moderation status, oldest first.
+
+    Pages are fetched with keyset pagination over the (status, review_date, id)
+    index, so the queue can be walked to the end at a constant cost per page.
+
+    Query parameters (all optional):
+    - status: 'pending' (default), 'approved' or 'flagged'
+    - limit: Page size (default `MODERATION_PAGE_SIZE`, at most `MODERATION_MAX_PAGE_SIZE`)
+    - cursor: The `X-Next-Cursor` value of the previous page
+    - fields: Comma-separated fields to return; only those columns are selected
+
+    Returns:
+    - 200: List of reviews; an `X-Next-Cursor` header is set when more reviews follow
+    - 400: Invalid query parameter
+    """
+    status = request.args.get('status', 'pending')
+    try:
+        if status not in REVIEW_STATUSES:
+            raise ValueError('Invalid status')
+        limit = parse_limit(request.args.get('limit'), app.config['MODERATION_PAGE_SIZE'], app.config['MODERATION_MAX_PAGE_SIZE'])
+        serializer = review_serializer.only(request.args.get('fields'))
+        query = Review.query.filter_by(status=status)
+        cursor = request.args.get('cursor')
+        if cursor:
+            key = [Review.review_date, Review.id]
+            values = coerce_cursor(decode_cursor(cursor), key)
+            query = query.filter(tuple_(*key) > tuple_(*values))
+    except (TypeError, ValueError) as e:
+        logger.warning("Invalid moderation queue request: %s.", e)
+        return jsonify({'message': 'Invalid query parameter'}), 400
+
+    fast = app.config['FAST_SERIALIZERS'] or serializer is not review_serializer
+    if fast:
+        query = query.with_entities(*serializer.columns_with(Review.review_date, Review.id))
+    reviews = query.order_by(Review.review_date, Review.id).limit(limit + 1).all()
+    next_cursor = None
+    if len(reviews) > limit:
+        reviews = reviews[:limit]
+        next_cursor = encode_cursor([reviews[-1].review_date, reviews[-1].id])
+
+    logger.info("Fetched %s %s reviews for moderation.", len(reviews), status)
+    response = json_response(serializer.dump_many(reviews)) if fast else jsonify(reviews_schema.dump(reviews))
+    if next_cursor:
+        response.headers['X-Next-Cursor'] = next_cursor
+    return response, 200
+
+# Moderate Many Reviews (Admin Only)
+@app.route('/reviews/moderate', methods=['POST'])
+def moderate_reviews():
+    """
+    Moderate many reviews in one transaction.
+
+    The reviews are loaded with a single query and the rating summaries are
+    adjusted once per affected item and rating rather than once per review.
+    A review changed by a concurrent request after it was loaded is left as
+    it is and reported as 'conflict'.
+
+    Request JSON should contain:
+    - decisions: List of {"review_id": int, "action": "approve" | "flag"}
+      (at most `MODERATION_BATCH_LIMIT`)
+
+    Returns:
+    - 200: Per-decision results with status 'approved', 'flagged', 'not_found' or 'conflict'
+    - 400: Missing, invalid or too many decisions
+    """
+    data = request.get_json(silent=True)
+    decisions = data.get('decisions') if isinstance(data, dict) else None
+    if not decisions or not isinstance(decisions, list):
+        logger.warning("Bulk moderation failed: Missing decisions.")
+        return jsonify({'message': 'Missing decisions'}), 400
+    if len(decisions) > app.config['MODERATION_BATCH_LIMIT']:
+        logger.warning("Bulk moderation failed: Too many decisions: %s", len(decisions))
+        return jsonify({'message': f"At most {app.config['MODERATION_BATCH_LIMIT']} decisions are allowed"}), 400
+
+    parsed = []
+    for decision in decisions:
+        try:
+            review_id = int(decision['review_id'])
+            action = decision['action']
+        except (KeyError, TypeError, ValueError):
+            logger.warning("Bulk moderation failed: Invalid decision.")
+            return jsonify({'message': 'Each decision requires a valid review_id and action'}), 400
+        if action not in ['approve', 'flag']:
+            logger.warning("Bulk moderation failed: Invalid action for review ID: %s", review_id)
+            return jsonify({'message': 'Invalid action'}), 400
+        parsed.append((review_id, action))
+
+    reviews = {review.id: review for review in Review.query.filter(Review.id.in_({review_id for review_id, _ in parsed}))}
+    deltas = Counter()
+    results = []
+    for review_id, action in parsed:
+        review = reviews.get(review_id)
+        if review is None:
+            results.append({'review_id': review_id, 'status': 'not_found'})
+            continue
+        status = 'approved' if action == 'approve' else 'flagged'
+        if not transition_review(review, deltas, status=status):
+            logger.warning("Bulk moderation skipped review ID %s: changed concurrently.", review_id)
+            status = 'conflict'
+        results.append({'review_id': review_id, 'status': status})
 
+    apply_review_stats_deltas(deltas)
     db.session.commit()
-    logger.info(f"Review ID {review_id} moderated successfully: {review.status}")
-    return jsonify({'message': f'Review {review.status}'}), 200
+    logger.info("Moderated %s of %s reviews in bulk.", len(reviews), len(parsed))
+    return jsonify({'results': results}), 200
 
 @app.route('/', methods=['GET'])
 def index():
@@ -217,5 +568,11 @@ def index():
 if __name__ == '__main__':
     with app.app_context():
         db.create_all()
+        # create_all() skips existing tables, so add indexes introduced since the database was created
+        for index in Review.__table__.indexes:
+            index.create(db.engine, checkfirst=True)
+        # Backfill rating summaries for reviews written before review_stats existed
+        if not ReviewStats.query.first() and Review.query.filter_by(status='approved').first():
+            rebuild_review_stats()
     logger.info("Starting Review Service.")
     app.run(port=5003, debug=True)
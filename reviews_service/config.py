@@ -9,3 +9,35 @@ class Config:
     SQLALCHEMY_DATABASE_URI = 'sqlite:///' + os.path.join(basedir, 'reviews.db')
     SQLALCHEMY_TRACK_MODIFICATIONS = False
     SECRET_KEY = 'your_secret_key'  # Replace with an actual secret key in production
+
+    # Reject customer requests without a token from POST /customers/login (signed with SECRET_KEY,
+    # which must match the Customers Service's); tokens that are sent are always checked
+    REQUIRE_CUSTOMER_TOKEN = False
+
+    # Maximum number of item IDs accepted by GET /reviews/summary
+    REVIEW_SUMMARY_BATCH_LIMIT = 100
+
+    # GET /reviews/product/<item_id>: default and maximum page size
+    REVIEWS_PAGE_SIZE = 50
+    REVIEWS_MAX_PAGE_SIZE = 200
+
+    # GET /reviews/moderation: default and maximum page size
+    MODERATION_PAGE_SIZE = 100
+    MODERATION_MAX_PAGE_SIZE = 1000
+
+    # Maximum number of decisions accepted by POST /reviews/moderate
+    MODERATION_BATCH_LIMIT = 1000
+
+    # Serialize list endpoints with precompiled row serializers instead of marshmallow
+    FAST_SERIALIZERS = True
+
+    # Return a Server-Timing header breaking down DB, downstream call and serialization time
+    SERVER_TIMING = True
+
+    # Audit log: file, rotation size (bytes), rotated files kept, level, and
+    # records buffered for the background writer before new ones are dropped
+    AUDIT_LOG_FILE = os.environ.get('AUDIT_LOG_FILE', 'audit.log')
+    AUDIT_LOG_MAX_BYTES = int(os.environ.get('AUDIT_LOG_MAX_BYTES', 10 * 1024 * 1024))
+    AUDIT_LOG_BACKUP_COUNT = int(os.environ.get('AUDIT_LOG_BACKUP_COUNT', 5))
+    AUDIT_LOG_LEVEL = os.environ.get('AUDIT_LOG_LEVEL', 'INFO')
+    AUDIT_LOG_QUEUE_SIZE = int(os.environ.get('AUDIT_LOG_QUEUE_SIZE', 10000))
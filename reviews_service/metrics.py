@@ -0,0 +1,146 @@
+# metrics.py
+
+import os
+import time
+
+from flask import g, has_app_context, request
+from prometheus_client import (
+    CONTENT_TYPE_LATEST, REGISTRY, CollectorRegistry, Counter, Gauge, Histogram, generate_latest, multiprocess
+)
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from sqlalchemy.pool import Pool
+
+from tracing import record_timing
+
+# Label used for requests that matched no route, so unknown URLs cannot grow the label set
+UNMATCHED_ROUTE = '<unmatched>'
+
+REQUESTS = Counter(
+    'http_requests_total', 'HTTP requests handled.', ['method', 'route', 'status']
+)
+REQUEST_LATENCY = Histogram(
+    'http_request_duration_seconds', 'Time spent handling HTTP requests.', ['method', 'route']
+)
+REQUESTS_IN_PROGRESS = Gauge(
+    'http_requests_in_progress', 'HTTP requests currently being handled.', ['method', 'route'],
+    multiprocess_mode='livesum'
+)
+DB_QUERIES = Histogram(
+    'db_queries_per_request', 'Database queries executed per HTTP request.', ['route'],
+    buckets=(0, 1, 2, 3, 5, 10, 20, 50, 100)
+)
+DB_QUERY_TIME = Histogram(
+    'db_query_time_per_request_seconds', 'Time spent in database queries per HTTP request.', ['route']
+)
+DB_POOL_CONNECTIONS = Gauge(
+    'db_pool_connections', 'Database connections held open by the connection pool.',
+    multiprocess_mode='livesum'
+)
+DB_POOL_CHECKED_OUT = Gauge(
+    'db_pool_checked_out', 'Database connections currently checked out of the pool.',
+    multiprocess_mode='livesum'
+)
+OUTBOUND_LATENCY = Histogram(
+    'outbound_request_duration_seconds', 'Time spent in calls to other services.', ['service', 'method', 'status']
+)
+
+
+def observe_outbound(service, method, status, seconds):
+    """
+    Record one call to another service; ``status`` is the HTTP status or ``error``.
+    """
+    OUTBOUND_LATENCY.labels(service, method, str(status)).observe(seconds)
+
+
+# The start time is kept on the execution context, which is discarded with it
+# when a query fails, so nothing is left behind on the pooled connection
+@event.listens_for(Engine, 'before_cursor_execute')
+def _start_query(conn, cursor, statement, parameters, context, executemany):
+    if context is not None:
+        context.metrics_query_started = time.perf_counter()
+
+
+@event.listens_for(Engine, 'after_cursor_execute')
+def _end_query(conn, cursor, statement, parameters, context, executemany):
+    started = getattr(context, 'metrics_query_started', None)
+    if started is None:
+        return
+    elapsed = time.perf_counter() - started
+    record_timing('db', elapsed)
+    # Queries outside a request (workers, startup) are not attributed to a route
+    stats = g.get('db_stats') if has_app_context() else None
+    if stats is not None:
+        stats[0] += 1
+        stats[1] += elapsed
+
+
+@event.listens_for(Pool, 'connect')
+def _pool_connect(dbapi_connection, connection_record):
+    DB_POOL_CONNECTIONS.inc()
+
+
+@event.listens_for(Pool, 'close')
+def _pool_close(dbapi_connection, connection_record):
+    DB_POOL_CONNECTIONS.dec()
+
+
+@event.listens_for(Pool, 'checkout')
+def _pool_checkout(dbapi_connection, connection_record, connection_proxy):
+    DB_POOL_CHECKED_OUT.inc()
+
+
+@event.listens_for(Pool, 'checkin')
+def _pool_checkin(dbapi_connection, connection_record):
+    DB_POOL_CHECKED_OUT.dec()
+
+
+def init_metrics(app):
+    """
+    Collect per-route request metrics and expose them at ``GET /metrics``.
+
+    Every request is counted by method, route template and status, timed,
+    and tracked while in flight; the number and total time of the database
+    queries it ran are recorded too. Connection pool usage is tracked with
+    pool events.
+
+    When ``PROMETHEUS_MULTIPROC_DIR`` is set (multi-process servers such as
+    gunicorn), values are kept in per-process files in that directory and
+    ``/metrics`` aggregates all processes.
+    """
+
+    @app.before_request
+    def start_request_metrics():
+        route = request.url_rule.rule if request.url_rule else UNMATCHED_ROUTE
+        g.metrics = (request.method, route, time.perf_counter())
+        g.db_stats = [0, 0.0]
+        REQUESTS_IN_PROGRESS.labels(request.method, route).inc()
+
+    @app.after_request
+    def record_response_status(response):
+        g.metrics_status = response.status_code
+        return response
+
+    @app.teardown_request
+    def finish_request_metrics(exc):
+        if 'metrics' not in g:
+            return
+        method, route, started = g.metrics
+        REQUESTS.labels(method, route, str(g.get('metrics_status', 500))).inc()
+        REQUEST_LATENCY.labels(method, route).observe(time.perf_counter() - started)
+        REQUESTS_IN_PROGRESS.labels(method, route).dec()
+        queries, query_time = g.db_stats
+        DB_QUERIES.labels(route).observe(queries)
+        DB_QUERY_TIME.labels(route).observe(query_time)
+
+    @app.route('/metrics', methods=['GET'])
+    def metrics():
+        """
+        Expose the collected metrics in the Prometheus text format.
+        """
+        if os.environ.get('PROMETHEUS_MULTIPROC_DIR'):
+            registry = CollectorRegistry()
+            multiprocess.MultiProcessCollector(registry)
+        else:
+            registry = REGISTRY
+        return generate_latest(registry), 200, {'Content-Type': CONTENT_TYPE_LATEST}
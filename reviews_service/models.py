@@ -14,9 +14,43 @@ class Review(db.Model):
     review_date = db.Column(db.DateTime, default=datetime.utcnow)
     status = db.Column(db.String(10), default='pending')  # 'pending', 'approved', 'flagged'
 
+    # Cover the keyset orderings of GET /reviews/product/<item_id> (newest first, or by rating)
+    __table_args__ = (
+        db.Index('ix_reviews_item_status_date', 'item_id', 'status', 'review_date', 'id'),
+        db.Index('ix_reviews_item_status_rating', 'item_id', 'status', 'rating', 'review_date', 'id'),
+        # The moderation queue: GET /reviews/moderation walks one status oldest first
+        db.Index('ix_reviews_status_date', 'status', 'review_date', 'id'),
+    )
+
     def __repr__(self):
         return f'<Review {self.id}>'
 
+class ReviewStats(db.Model):
+    __tablename__ = 'review_stats'
+
+    # Aggregates over the approved reviews of one item, maintained on every status or rating change
+    item_id = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    review_count = db.Column(db.Integer, nullable=False, default=0)
+    rating_sum = db.Column(db.Integer, nullable=False, default=0)
+    rating_1 = db.Column(db.Integer, nullable=False, default=0)
+    rating_2 = db.Column(db.Integer, nullable=False, default=0)
+    rating_3 = db.Column(db.Integer, nullable=False, default=0)
+    rating_4 = db.Column(db.Integer, nullable=False, default=0)
+    rating_5 = db.Column(db.Integer, nullable=False, default=0)
+
+    def to_summary(self):
+        # Unsaved instances (items without approved reviews) have None counters
+        review_count = self.review_count or 0
+        return {
+            'item_id': self.item_id,
+            'review_count': review_count,
+            'average_rating': round(self.rating_sum / review_count, 2) if review_count else None,
+            'histogram': {str(rating): getattr(self, f'rating_{rating}') or 0 for rating in range(1, 6)}
+        }
+
+    def __repr__(self):
+        return f'<ReviewStats item={self.item_id} count={self.review_count}>'
+
 class ReviewSchema(ma.SQLAlchemyAutoSchema):
     class Meta:
         model = Review
@@ -6,8 +6,9 @@ current_dir = os.path.dirname(os.path.abspath(__file__))
 parent_dir = os.path.abspath(os.path.join(current_dir, '..'))
 sys.path.insert(0, parent_dir)
 import pytest
-from app import app, db
+from app import app, db, rebuild_review_stats
 from models import Review
+from datetime import datetime
 
 # Setup for testing
 @pytest.fixture
@@ -118,3 +119,205 @@ def test_moderate_review(client):
     with app.app_context():
         review = Review.query.get(review_id)
         assert review.status == 'approved'
+
+
+# Test the Rating Summary Follows Moderation, Updates and Deletes
+def test_rating_summary(client):
+    with app.app_context():
+        db.session.add_all([
+            Review(item_id=1, username='user_a', rating=5, comment='Great'),
+            Review(item_id=1, username='user_b', rating=2, comment='Poor')
+        ])
+        db.session.commit()
+
+    # Pending reviews do not count
+    response = client.get('/reviews/product/1/summary')
+    assert response.status_code == 200
+    assert response.get_json()['review_count'] == 0
+    assert response.get_json()['average_rating'] is None
+
+    client.post('/reviews/moderate/1', json={'action': 'approve'})
+    client.post('/reviews/moderate/2', json={'action': 'approve'})
+    data = client.get('/reviews/product/1/summary').get_json()
+    assert data['review_count'] == 2
+    assert data['average_rating'] == 3.5
+    assert data['histogram'] == {'1': 0, '2': 1, '3': 0, '4': 0, '5': 1}
+
+    # Editing sends the review back to moderation, deleting removes it
+    client.put('/reviews/1', json={'rating': 4, 'comment': 'Good'})
+    client.delete('/reviews/2')
+    data = client.get('/reviews/product/1/summary').get_json()
+    assert data['review_count'] == 0
+    assert data['histogram']['5'] == 0 and data['histogram']['2'] == 0
+
+
+# Test Getting Rating Summaries for Many Products
+def test_rating_summaries(client):
+    with app.app_context():
+        db.session.add(Review(item_id=1, username='user_a', rating=4, comment='Good', status='approved'))
+        db.session.commit()
+        rebuild_review_stats()
+
+    response = client.get('/reviews/summary?item_ids=1,2')
+    assert response.status_code == 200
+    data = response.get_json()
+    assert data['1']['review_count'] == 1
+    assert data['1']['average_rating'] == 4
+    assert data['2']['review_count'] == 0
+
+    assert client.get('/reviews/summary?item_ids=a').status_code == 400
+    assert client.get('/reviews/summary').status_code == 400
+
+
+# Test Paginating Reviews for a Product
+def test_get_reviews_for_product_paginated(client):
+    with app.app_context():
+        db.session.add_all([
+            Review(item_id=1, username=f'user_{i}', rating=rating, comment='Review',
+                   status='approved', review_date=datetime(2024, 1, i + 1))
+            for i, rating in enumerate([3, 5, 4, 5, 1])
+        ])
+        db.session.commit()
+
+    # Newest first, two per page
+    response = client.get('/reviews/product/1?limit=2')
+    assert [r['username'] for r in response.get_json()] == ['user_4', 'user_3']
+    cursor = response.headers['X-Next-Cursor']
+    response = client.get(f'/reviews/product/1?limit=2&cursor={cursor}')
+    assert [r['username'] for r in response.get_json()] == ['user_2', 'user_1']
+    response = client.get(f"/reviews/product/1?limit=2&cursor={response.headers['X-Next-Cursor']}")
+    assert [r['username'] for r in response.get_json()] == ['user_0']
+    assert 'X-Next-Cursor' not in response.headers
+
+    # Highest rating first, newest first within a rating
+    response = client.get('/reviews/product/1?sort=rating&limit=3')
+    assert [r['username'] for r in response.get_json()] == ['user_3', 'user_1', 'user_2']
+    response = client.get(f"/reviews/product/1?sort=rating&cursor={response.headers['X-Next-Cursor']}")
+    assert [r['username'] for r in response.get_json()] == ['user_0', 'user_4']
+
+    assert client.get('/reviews/product/1?sort=oldest').status_code == 400
+    assert client.get('/reviews/product/1?cursor=bad').status_code == 400
+    # Well-formed cursors holding values of the wrong type are rejected too
+    from pagination import encode_cursor
+    assert client.get(f"/reviews/product/1?sort=rating&cursor={encode_cursor([[5], '2024-01-02T00:00:00', 2])}").status_code == 400
+
+
+# Test the Moderation Queue and Bulk Moderation
+def test_bulk_moderation(client):
+    with app.app_context():
+        db.session.add_all([
+            Review(item_id=1, username=f'user_{i}', rating=4, comment='Review', review_date=datetime(2024, 1, i + 1))
+            for i in range(3)
+        ])
+        db.session.commit()
+
+    response = client.get('/reviews/moderation?limit=2')
+    assert response.status_code == 200
+    assert [r['id'] for r in response.get_json()] == [1, 2]
+    response = client.get(f"/reviews/moderation?cursor={response.headers['X-Next-Cursor']}")
+    assert [r['id'] for r in response.get_json()] == [3]
+
+    # A cursor whose values do not match the sort key is rejected
+    from pagination import encode_cursor
+    assert client.get(f"/reviews/moderation?cursor={encode_cursor(['not a date', 1])}").status_code == 400
+    assert client.get(f"/reviews/moderation?cursor={encode_cursor([1])}").status_code == 400
+
+    response = client.post('/reviews/moderate', json={'decisions': [
+        {'review_id': 1, 'action': 'approve'},
+        {'review_id': 2, 'action': 'approve'},
+        {'review_id': 3, 'action': 'flag'},
+        {'review_id': 99, 'action': 'approve'}
+    ]})
+    assert response.status_code == 200
+    assert [r['status'] for r in response.get_json()['results']] == ['approved', 'approved', 'flagged', 'not_found']
+    assert client.get('/reviews/moderation').get_json() == []
+    assert client.get('/reviews/product/1/summary').get_json()['review_count'] == 2
+
+    # An invalid action rejects the whole batch
+    response = client.post('/reviews/moderate', json={'decisions': [
+        {'review_id': 1, 'action': 'flag'},
+        {'review_id': 2, 'action': 'delete'}
+    ]})
+    assert response.status_code == 400
+    assert client.get('/reviews/product/1/summary').get_json()['review_count'] == 2
+
+
+# Test That Interleaved Changes to a Review Count It Once
+def test_concurrent_review_changes_count_once(client):
+    from collections import Counter
+    from app import transition_review
+    with app.app_context():
+        db.session.add(Review(item_id=1, username='user_a', rating=5, comment='Great'))
+        db.session.commit()
+
+    def read_review():
+        # What a slow request read, kept apart from the session the other requests use
+        with app.app_context():
+            review = db.session.get(Review, 1)
+            db.session.expunge(review)
+            return review
+
+    # A slow request reads the pending review while another approves it
+    stale = read_review()
+    assert client.post('/reviews/moderate/1', json={'action': 'approve'}).status_code == 200
+    with app.app_context():
+        deltas = Counter()
+        assert transition_review(stale, deltas, status='approved') is False
+        assert not deltas
+        db.session.rollback()
+
+    # The same holds when the review was edited in between
+    stale = read_review()
+    assert client.put('/reviews/1', json={'rating': 2}).status_code == 200
+    with app.app_context():
+        assert transition_review(stale, deltas, status='flagged') is False
+        db.session.rollback()
+
+    assert client.get('/reviews/product/1/summary').get_json()['review_count'] == 0
+    client.post('/reviews/moderate/1', json={'action': 'approve'})
+    data = client.get('/reviews/product/1/summary').get_json()
+    assert data['review_count'] == 1
+    assert data['histogram'] == {'1': 0, '2': 1, '3': 0, '4': 0, '5': 0}
+
+
+# Test the Fast List Serializers Match Marshmallow
+def test_fast_serializers_match_marshmallow(client):
+    with app.app_context():
+        db.session.add_all([
+            Review(item_id=1, username='user_a', rating=5, comment='Très bien', status='approved',
+                   review_date=datetime(2024, 1, 1, 12, 30, 15, 250)),
+            Review(item_id=1, username='user_b', rating=2, comment=None, status='approved'),
+            Review(item_id=2, username='user_c', rating=3, comment='Pending')
+        ])
+        db.session.commit()
+
+    paths = ['/reviews/product/1', '/reviews/product/1?sort=rating&limit=1', '/reviews/moderation']
+    try:
+        app.config['FAST_SERIALIZERS'] = True
+        fast = [client.get(path) for path in paths]
+        app.config['FAST_SERIALIZERS'] = False
+        slow = [client.get(path) for path in paths]
+    finally:
+        app.config['FAST_SERIALIZERS'] = True
+    for fast_response, slow_response in zip(fast, slow):
+        assert fast_response.data == slow_response.data
+        assert fast_response.headers.get('X-Next-Cursor') == slow_response.headers.get('X-Next-Cursor')
+
+
+# Test Sparse Fieldsets on the Review Listings
+def test_review_listing_fields(client):
+    with app.app_context():
+        db.session.add_all([
+            Review(item_id=1, username='user_a', rating=5, comment='Great', status='approved'),
+            Review(item_id=1, username='user_b', rating=3, comment='Fine', status='approved')
+        ])
+        db.session.commit()
+
+    response = client.get('/reviews/product/1?sort=rating&fields=rating&limit=1')
+    assert response.get_json() == [{'rating': 5}]
+    response = client.get(f"/reviews/product/1?sort=rating&fields=rating&cursor={response.headers['X-Next-Cursor']}")
+    assert response.get_json() == [{'rating': 3}]
+    assert client.get('/reviews/moderation?status=approved&fields=id,username').get_json() == [
+        {'id': 1, 'username': 'user_a'}, {'id': 2, 'username': 'user_b'}
+    ]
+    assert client.get('/reviews/product/1?fields=secret').status_code == 400
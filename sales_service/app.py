@@ -1,24 +1,27 @@
-import logging
-from logging.handlers import RotatingFileHandler
-from flask import Flask, request, jsonify
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, datetime, timedelta
+from functools import wraps
+from flask import Flask, g, request, jsonify
+from sqlalchemy import delete, func, inspect, select, text, tuple_, update
+from sqlalchemy.exc import IntegrityError
 from config import Config
 from extensions import db, ma
-from models import Sale, sale_schema, sales_schema
+from models import IdempotencyRecord, Order, Sale, sale_schema, sales_schema
+from service_client import ServiceClient
+from cache import TTLCache
+from pagination import coerce_cursor, decode_cursor, encode_cursor, parse_limit
+from audit_logging import init_audit_logging
+from tracing import init_tracing, submit
+from metrics import init_metrics, observe_outbound
+from serializers import RowSerializer, json_response
+from tokens import InvalidToken, verify_token
+import hashlib
+import json
+import os
 import requests
-
-# Logger Configuration
-LOG_FILE = "audit.log"
-MAX_LOG_SIZE = 100000
-BACKUP_COUNT = 5
-
-handler = RotatingFileHandler(LOG_FILE, maxBytes=MAX_LOG_SIZE, backupCount=BACKUP_COUNT)
-formatter = logging.Formatter('%(asctime)s - %(levelname)s - %(message)s')
-handler.setFormatter(formatter)
-
-logger = logging.getLogger('audit_logger')
-logger.addHandler(handler)
-logger.setLevel(logging.INFO)
-logger.info("Logger initialized successfully.")
+import threading
+import time
+import uuid
 
 # Initialize Flask app
 app = Flask(__name__)
@@ -28,17 +31,141 @@ app.config.from_object(Config)
 db.init_app(app)
 ma.init_app(app)
 
+# Logger Configuration: JSON lines written by a background thread (see AUDIT_LOG_* settings)
+logger = init_audit_logging(app)
+init_metrics(app)
+init_tracing(app)
+logger.info("Logger initialized successfully.")
+
 # Constants for other services' URLs
 INVENTORY_SERVICE_URL = 'http://localhost:5001'
 CUSTOMERS_SERVICE_URL = 'http://localhost:5000'
 
+# Shared pooled clients for outbound calls to other services
+inventory_client = ServiceClient(
+    INVENTORY_SERVICE_URL,
+    connect_timeout=app.config['INVENTORY_SERVICE_CONNECT_TIMEOUT'],
+    read_timeout=app.config['INVENTORY_SERVICE_READ_TIMEOUT'],
+    pool_maxsize=app.config['INVENTORY_SERVICE_POOL_SIZE'],
+    name='inventory',
+    observer=observe_outbound
+)
+customers_client = ServiceClient(
+    CUSTOMERS_SERVICE_URL,
+    connect_timeout=app.config['CUSTOMERS_SERVICE_CONNECT_TIMEOUT'],
+    read_timeout=app.config['CUSTOMERS_SERVICE_READ_TIMEOUT'],
+    pool_maxsize=app.config['CUSTOMERS_SERVICE_POOL_SIZE'],
+    name='customers',
+    observer=observe_outbound
+)
+
+# Worker threads for issuing independent downstream lookups concurrently
+lookup_executor = ThreadPoolExecutor(
+    max_workers=app.config['LOOKUP_WORKERS'],
+    thread_name_prefix='sales-lookup'
+)
+
+# In-process cache of the goods list and item details fetched from the Inventory Service
+goods_cache = TTLCache(
+    maxsize=app.config['GOODS_CACHE_MAX_ENTRIES'],
+    ttl=app.config['GOODS_CACHE_TTL'],
+    stale_ttl=app.config['GOODS_CACHE_STALE_TTL']
+)
+
+# Column-level equivalent of sales_schema for list endpoints (see FAST_SERIALIZERS)
+sale_serializer = RowSerializer(sales_schema, Sale.__table__)
+
+# Errors raised when a downstream service is unreachable or too slow to answer
+SERVICE_UNAVAILABLE_ERRORS = (requests.exceptions.ConnectionError, requests.exceptions.Timeout)
+
+def refresh_cached_inventory(key, path):
+    """
+    Fetch a document from the Inventory Service and store it in the goods cache.
+
+    If a cached copy has an ETag the request is conditional, and a 304 answer
+    only marks the cached copy fresh again.
+
+    Returns:
+    - tuple: The inventory status code and the document, or None if it is not cacheable
+    """
+    entry = goods_cache.get(key)
+    headers = {'If-None-Match': entry.etag} if entry is not None and entry.etag else {}
+    response = inventory_client.get(path, headers=headers)
+
+    if response.status_code == 304 and entry is not None:
+        goods_cache.touch(key)
+        return 200, entry.value
+    if response.status_code == 200:
+        value = response.json()
+        etag = response.headers.get('ETag')
+        # Listings longer than one Inventory Service page are followed page by page;
+        # the first page's ETag covers the catalogue version the listing started from
+        next_cursor = response.headers.get('X-Next-Cursor')
+        while next_cursor:
+            page = inventory_client.get(path, params={'cursor': next_cursor, 'limit': app.config['GOODS_PAGE_SIZE']})
+            if page.status_code != 200:
+                return page.status_code, None
+            value.extend(page.json())
+            next_cursor = page.headers.get('X-Next-Cursor')
+        goods_cache.set(key, value, etag)
+        return 200, value
+    return response.status_code, None
+
+def background_refresh(key, path):
+    try:
+        refresh_cached_inventory(key, path)
+    except Exception:
+        logger.exception("Background refresh of cached %s failed.", path)
+    finally:
+        goods_cache.end_refresh(key)
+
+def cached_inventory_get(key, path):
+    """
+    Get a document from the Inventory Service through the in-process goods cache.
+
+    Fresh entries are served directly. Stale entries within the
+    stale-while-revalidate window are served while one background refresh
+    revalidates them. Otherwise the document is revalidated inline, and if
+    the Inventory Service is unavailable a cached copy is served when one
+    exists.
+
+    Parameters:
+    - key: Cache key of the document
+    - path: Inventory Service path to fetch
+
+    Returns:
+    - tuple: The status code, the document (None unless the status is 200) and the cache status
+    """
+    entry = goods_cache.get(key)
+    if entry is not None:
+        if goods_cache.is_fresh(entry):
+            return 200, entry.value, 'HIT'
+        if goods_cache.is_servable_stale(entry):
+            if goods_cache.begin_refresh(key):
+                submit(lookup_executor, background_refresh, key, path)
+            return 200, entry.value, 'STALE'
+
+    try:
+        status_code, value = refresh_cached_inventory(key, path)
+    except SERVICE_UNAVAILABLE_ERRORS:
+        if entry is None:
+            raise
+        logger.warning("Inventory Service is unavailable; serving cached %s.", path)
+        return 200, entry.value, 'STALE'
+    return status_code, value, 'MISS' if entry is None else 'REVALIDATED'
+
+# Only the fields shown by GET /goods are requested from the Inventory Service
+GOODS_FIELDS = 'id,name,price'
+
 @app.route('/goods', methods=['GET'])
 def display_available_goods():
     """
     Display available goods with their names and prices.
 
-    Fetches goods from the Inventory Service and filters their details 
-    to include only name, price, and ID.
+    Fetches goods from the Inventory Service, asking it for only the ID,
+    name and price of each item (`fields=`). The list is served from an
+    in-process cache (see `GOODS_CACHE_TTL`) and revalidated with the
+    Inventory Service's ETag once it goes stale.
 
     Returns:
         list: A JSON list of goods with `id`, `name`, and `price`.
@@ -46,16 +173,16 @@ def display_available_goods():
     """ 
     logger.info("Fetching available goods from Inventory Service.")
     try:
-        response = requests.get(f'{INVENTORY_SERVICE_URL}/items')
-        if response.status_code == 200:
-            items = response.json()
-            goods = [{'id': item['id'], 'name': item['name'], 'price': item['price']} for item in items]
-            logger.info("Successfully fetched available goods.")
-            return jsonify(goods), 200
+        status_code, goods, cache_status = cached_inventory_get(('goods',), f'/items?fields={GOODS_FIELDS}')
+        if status_code == 200:
+            logger.info("Successfully fetched available goods (cache %s).", cache_status)
+            response = jsonify(goods)
+            response.headers['X-Cache'] = cache_status
+            return response, 200
         else:
             logger.error("Failed to fetch goods from Inventory Service.")
             return jsonify({'message': 'Unable to fetch goods'}), 500
-    except requests.exceptions.ConnectionError:
+    except SERVICE_UNAVAILABLE_ERRORS:
         logger.error("Inventory Service is unavailable.")
         return jsonify({'message': 'Inventory Service is not available'}), 503
 
@@ -64,6 +191,8 @@ def get_goods_details(item_id):
     """
     Get detailed information about a specific good.
 
+    Item details are served from the same in-process cache as the goods list.
+
     URL parameter:
     - item_id: ID of the item
 
@@ -73,24 +202,537 @@ def get_goods_details(item_id):
     - 500: Unable to fetch item details
     - 503: Inventory Service is not available
     """
-    logger.info(f"Fetching details for item ID: {item_id}")
+    logger.info("Fetching details for item ID: %s", item_id)
     try:
-        response = requests.get(f'{INVENTORY_SERVICE_URL}/items/{item_id}')
-        if response.status_code == 200:
-            item = response.json()
-            logger.info(f"Successfully fetched details for item ID: {item_id}")
-            return jsonify(item), 200
-        elif response.status_code == 404:
-            logger.warning(f"Item ID {item_id} not found.")
+        status_code, item, cache_status = cached_inventory_get(('item', item_id), f'/items/{item_id}')
+        if status_code == 200:
+            logger.info("Successfully fetched details for item ID: %s (cache %s)", item_id, cache_status)
+            response = jsonify(item)
+            response.headers['X-Cache'] = cache_status
+            return response, 200
+        elif status_code == 404:
+            logger.warning("Item ID %s not found.", item_id)
             return jsonify({'message': 'Item not found'}), 404
         else:
-            logger.error(f"Failed to fetch details for item ID: {item_id}")
+            logger.error("Failed to fetch details for item ID: %s", item_id)
             return jsonify({'message': 'Unable to fetch item details'}), 500
-    except requests.exceptions.ConnectionError:
+    except SERVICE_UNAVAILABLE_ERRORS:
         logger.error("Inventory Service is unavailable.")
         return jsonify({'message': 'Inventory Service is not available'}), 503
 
+def customer_token_required(f):
+    """
+    Check the bearer token of the customer a request acts for, without calling the Customers Service.
+
+    Tokens are issued by `POST /customers/login` and verified locally with the
+    shared `SECRET_KEY`; the token's subject must be the `username` of the
+    request (URL parameter or JSON body). Requests without a token are let
+    through unless `REQUIRE_CUSTOMER_TOKEN` is set.
+    """
+    @wraps(f)
+    def decorated(*args, **kwargs):
+        authorization = request.headers.get('Authorization')
+        if not authorization:
+            if app.config['REQUIRE_CUSTOMER_TOKEN']:
+                logger.warning("Request without a customer token rejected.")
+                return jsonify({'message': 'Authentication required'}), 401
+            return f(*args, **kwargs)
+
+        scheme, _, token = authorization.partition(' ')
+        try:
+            if scheme.lower() != 'bearer':
+                raise InvalidToken('Unsupported authorization scheme')
+            claims = verify_token(token, app.config['SECRET_KEY'])
+        except InvalidToken as e:
+            logger.warning("Invalid customer token: %s.", e)
+            return jsonify({'message': str(e)}), 401
+
+        username = kwargs.get('username') or (request.get_json(silent=True) or {}).get('username')
+        if claims['sub'] != username:
+            logger.warning("Token for %s used on behalf of %s.", claims['sub'], username)
+            return jsonify({'message': 'Token does not belong to this customer'}), 403
+        return f(*args, **kwargs)
+    return decorated
+
+def claim_idempotency_key(key, fingerprint):
+    """
+    Claim an Idempotency-Key for the current request.
+
+    Expired records are purged first (through the `expires_at` index), then an
+    `in_progress` record is inserted; the primary key makes the insert fail if
+    another request already holds the key.
+
+    Returns:
+    - None if the key was claimed, otherwise the existing IdempotencyRecord
+    """
+    now = datetime.utcnow()
+    db.session.execute(delete(IdempotencyRecord).where(IdempotencyRecord.expires_at <= now))
+    db.session.add(IdempotencyRecord(
+        key=key,
+        request_hash=fingerprint,
+        status='in_progress',
+        created_at=now,
+        expires_at=now + timedelta(seconds=app.config['IDEMPOTENCY_KEY_TTL'])
+    ))
+    try:
+        db.session.commit()
+        return None
+    except IntegrityError:
+        db.session.rollback()
+        return db.session.get(IdempotencyRecord, key)
+
+def take_over_idempotency_key(record):
+    """
+    Claim a key whose earlier request failed or died mid-flight, keeping its attempt number.
+
+    The UPDATE only matches the record as it was read, so of several
+    concurrent retries exactly one takes the key over.
+
+    Returns:
+    - True if the current request now holds the key
+    """
+    claimed = db.session.execute(
+        update(IdempotencyRecord)
+        .where(IdempotencyRecord.key == record.key,
+               IdempotencyRecord.status == record.status,
+               IdempotencyRecord.created_at == record.created_at)
+        .values(status='in_progress', created_at=datetime.utcnow())
+    ).rowcount
+    db.session.commit()
+    return claimed == 1
+
+def settle_idempotency_key(key, body, status_code):
+    """
+    Store a final response for a key before its charge is refunded.
+
+    Should the refund fail, or the request die before the key is reopened,
+    retries replay this response instead of replaying the refunded charge
+    without paying.
+    """
+    db.session.execute(
+        update(IdempotencyRecord)
+        .where(IdempotencyRecord.key == key)
+        .values(status='completed', status_code=status_code, response_body=jsonify(body).get_data(as_text=True))
+    )
+    db.session.commit()
+
+def reopen_idempotency_key(key):
+    """
+    Make a key retryable again once its charge was refunded; the next attempt charges under new downstream keys.
+    """
+    db.session.execute(
+        update(IdempotencyRecord)
+        .where(IdempotencyRecord.key == key)
+        .values(status='in_progress', status_code=None, response_body=None, attempt=IdempotencyRecord.attempt + 1)
+    )
+    db.session.commit()
+
+def idempotency_hooks():
+    """
+    Keyword arguments for `complete_sale` from the current request's Idempotency-Key, if any.
+
+    Downstream balance changes are keyed on the client's key, suffixed with
+    the attempt number once an earlier attempt was refunded.
+    """
+    if 'idempotency_key' not in g:
+        return {}
+    key, attempt = g.idempotency_key, g.idempotency_attempt
+    return {
+        'idempotency_key': f'{key}-retry{attempt}' if attempt else key,
+        'before_refund': lambda body, status_code: settle_idempotency_key(key, body, status_code),
+        'after_refund': lambda: reopen_idempotency_key(key)
+    }
+
+def idempotent(f):
+    """
+    Make a POST endpoint safe to retry by sending an `Idempotency-Key` header.
+
+    The first request with a key is processed and its response stored; later
+    requests with the same key and body get the stored response replayed. A
+    duplicate that arrives while the first is still running gets 409 with a
+    `Retry-After` header, and reusing a key for a different request gets 422.
+    Server errors are not stored, so the request can be retried; a charge
+    made by an earlier attempt is then replayed downstream rather than
+    repeated. Requests without the header are processed normally.
+    """
+    @wraps(f)
+    def decorated(*args, **kwargs):
+        key = request.headers.get('Idempotency-Key')
+        if not key:
+            return f(*args, **kwargs)
+        if len(key) > 64:
+            return jsonify({'message': 'Idempotency-Key must be at most 64 characters'}), 400
+
+        fingerprint = hashlib.sha256(request.path.encode('utf-8') + request.get_data()).hexdigest()
+        record = claim_idempotency_key(key, fingerprint)
+        attempt = 0
+        stale = datetime.utcnow() - timedelta(seconds=app.config['IDEMPOTENCY_LOCK_TIMEOUT'])
+        if record is not None and record.request_hash == fingerprint and (
+                record.status == 'failed' or (record.status == 'in_progress' and record.created_at < stale)):
+            # An earlier request with the key failed or died mid-flight; downstream
+            # calls reuse its attempt's keys, so it is safe to process it again
+            logger.warning("Retrying Idempotency-Key %s after a %s attempt.", key,
+                           'failed' if record.status == 'failed' else 'stale')
+            attempt = record.attempt
+            if take_over_idempotency_key(record):
+                record = None
+            else:
+                record = db.session.get(IdempotencyRecord, key)
+
+        if record is not None:
+            if record.request_hash != fingerprint:
+                logger.warning("Idempotency-Key reused with a different request: %s", key)
+                return jsonify({'message': 'Idempotency-Key was already used for a different request'}), 422
+            if record.status == 'in_progress':
+                logger.warning("Request with Idempotency-Key %s is already in progress.", key)
+                response = jsonify({'message': 'A request with this Idempotency-Key is in progress'})
+                response.headers['Retry-After'] = '1'
+                return response, 409
+            logger.info("Replaying stored response for Idempotency-Key: %s", key)
+            response = app.response_class(record.response_body, status=record.status_code, mimetype='application/json')
+            response.headers['Idempotent-Replayed'] = 'true'
+            return response
+
+        g.idempotency_key, g.idempotency_attempt = key, attempt
+        in_progress = (IdempotencyRecord.key == key, IdempotencyRecord.status == 'in_progress')
+        try:
+            response = app.make_response(f(*args, **kwargs))
+        except Exception:
+            db.session.rollback()
+            db.session.execute(update(IdempotencyRecord).where(*in_progress).values(status='failed'))
+            db.session.commit()
+            raise
+
+        if response.status_code >= 500:
+            # Retryable, unless a refunded charge already settled the key
+            db.session.execute(update(IdempotencyRecord).where(*in_progress).values(status='failed'))
+        else:
+            db.session.execute(
+                update(IdempotencyRecord)
+                .where(IdempotencyRecord.key == key)
+                .values(status='completed', status_code=response.status_code,
+                        response_body=response.get_data(as_text=True))
+            )
+        db.session.commit()
+        return response
+    return decorated
+
+def post_until_answered(client, path, **kwargs):
+    """
+    Send a POST that is safe to repeat, resending it while its outcome is unknown.
+
+    Timeouts and connection errors are retried up to `PAYMENT_CALL_RETRIES`
+    times; the last one is raised to the caller.
+    """
+    for _ in range(app.config['PAYMENT_CALL_RETRIES']):
+        try:
+            return client.post(path, **kwargs)
+        except SERVICE_UNAVAILABLE_ERRORS as e:
+            logger.warning("No answer from %s for POST %s (%s); retrying.", client.name, path, type(e).__name__)
+    return client.post(path, **kwargs)
+
+def release_reservation(token):
+    """
+    Release a stock reservation after a failed charge.
+
+    Failures are logged; the reservation then expires on its own after `RESERVATION_TTL`.
+    """
+    try:
+        response = inventory_client.post(f'/reservations/{token}/release')
+    except SERVICE_UNAVAILABLE_ERRORS:
+        logger.error("Failed to release stock reservation %s: Inventory Service is unavailable.", token)
+        return
+    if response.status_code != 200:
+        logger.error("Failed to release stock reservation %s: status code %s.", token, response.status_code)
+
+def downstream_key(idempotency_key, step):
+    """
+    Idempotency-Key for one downstream step (e.g. 'deduct') of a payment attempt.
+
+    The derived key is hashed to 64 hex characters, the longest key the
+    Customers Service accepts, however long the client's key and suffixes are.
+    """
+    return hashlib.sha256(f'{idempotency_key}-{step}'.encode('utf-8')).hexdigest()
+
+def refund_customer(username, amount, idempotency_key):
+    """
+    Give a deduction back to a customer.
+
+    The refund names the deduction by its Idempotency-Key, so it is applied at
+    most once and changes nothing if the deduction never went through. A
+    failed refund is logged with the key so it can be retried by hand.
+
+    Returns:
+    - True if the refund was applied
+    """
+    try:
+        response = post_until_answered(
+            customers_client,
+            f'/customers/{username}/refund',
+            json={'amount': amount},
+            headers={'Idempotency-Key': idempotency_key}
+        )
+    except SERVICE_UNAVAILABLE_ERRORS:
+        logger.error("Failed to refund %s to customer %s (Idempotency-Key %s): Customers Service is unavailable.",
+                     amount, username, idempotency_key)
+        return False
+    if response.status_code != 200:
+        logger.error("Failed to refund %s to customer %s (Idempotency-Key %s): status code %s.",
+                     amount, username, idempotency_key, response.status_code)
+        return False
+    logger.info("Refunded %s to customer %s.", amount, username)
+    return True
+
+def charge_with_reserved_stock(username, quantities, total_price, idempotency_key=None,
+                               before_refund=None, after_refund=None):
+    """
+    Hold stock for the duration of the payment step, then make the deduction permanent.
+
+    Stock is reserved in the Inventory Service before the customer is charged,
+    so concurrent buyers of the same item cannot all pass the stock check. If
+    the charge fails the reservation is released; if the reservation can no
+    longer be committed the customer is refunded. Reservations abandoned by a
+    failed request expire on their own.
+
+    The reservation and balance changes carry keys derived from
+    `idempotency_key`, so a retried payment step reuses the reservation it
+    made, even one already committed, and never charges the customer twice.
+    The deduction and the commit are resent while their outcome is unknown
+    (see `post_until_answered`). A deduction that stays unanswered is refunded
+    and its reservation released; a commit that stays unanswered may still
+    have gone through, so nothing is undone and the error is raised for the
+    request to be retried.
+
+    Parameters:
+    - username: Username of the customer
+    - quantities: Mapping of item ID to quantity
+    - total_price: Amount to deduct from the customer's balance
+    - idempotency_key: Key identifying this payment attempt (a random one is generated by default)
+    - before_refund: Called with the failure body and status code before a charge is refunded,
+      to record the outcome durably so the attempt is not replayed
+    - after_refund: Called once a refund succeeded
+
+    Returns:
+    - None on success, otherwise the error body and status code
+    """
+    idempotency_key = idempotency_key or uuid.uuid4().hex
+
+    logger.info("Reserving stock for item IDs: %s.", list(quantities))
+    reserve_response = inventory_client.post('/items/reserve', json={
+        'items': [{'item_id': item_id, 'quantity': quantity} for item_id, quantity in quantities.items()],
+        'ttl': app.config['RESERVATION_TTL'],
+        'key': downstream_key(idempotency_key, 'reserve')
+    })
+    if reserve_response.status_code == 400:
+        logger.warning("Insufficient stock to reserve item IDs: %s.", list(quantities))
+        return {'message': 'Insufficient stock'}, 400
+    if reserve_response.status_code != 201:
+        logger.error("Failed to reserve stock for item IDs: %s.", list(quantities))
+        return {'message': 'Failed to deduct stock'}, 500
+    token = reserve_response.json()['token']
+
+    logger.info("Deducting balance for customer %s.", username)
+    deduct_key = downstream_key(idempotency_key, 'deduct')
+    try:
+        deduct_balance_response = post_until_answered(
+            customers_client,
+            f'/customers/{username}/deduct',
+            json={'amount': total_price},
+            headers={'Idempotency-Key': deduct_key}
+        )
+    except SERVICE_UNAVAILABLE_ERRORS:
+        logger.error("Deduction for customer %s has an unknown outcome; undoing it.", username)
+        release_reservation(token)
+        if refund_customer(username, total_price, deduct_key) and after_refund is not None:
+            after_refund()
+        raise
+    if deduct_balance_response.status_code != 200:
+        logger.error("Failed to deduct balance for customer %s.", username)
+        release_reservation(token)
+        return {'message': 'Failed to deduct balance'}, 500
+
+    logger.info("Committing stock reservation %s.", token)
+    commit_response = post_until_answered(inventory_client, f'/reservations/{token}/commit')
+    if commit_response.status_code != 200:
+        logger.error("Failed to commit stock reservation %s; refunding customer %s.", token, username)
+        failure = {'message': 'Failed to deduct stock'}, 500
+        if before_refund is not None:
+            before_refund(*failure)
+        if refund_customer(username, total_price, deduct_key) and after_refund is not None:
+            after_refund()
+        return failure
+
+    return None
+
+def recorded_order_sales(order_id):
+    """
+    Details of the sales an earlier attempt of an order already recorded, or None.
+    """
+    recorded = db.session.execute(select(Sale).where(Sale.order_id == order_id).order_by(Sale.id)).scalars().all()
+    if not recorded:
+        return None
+    return {
+        'total_price': sum(sale.total_price for sale in recorded),
+        'sales': sales_schema.dump(recorded)
+    }
+
+def complete_sale(username, quantities, idempotency_key=None, before_refund=None, after_refund=None, order_id=None):
+    """
+    Run the full sale pipeline for one customer and any number of items.
+
+    All items (in one batch lookup) and the customer are fetched concurrently, stock and balance are
+    checked, stock is held while the customer is charged, and every line is
+    recorded as a `Sale` in one transaction. Used both inline by the sale
+    endpoints and by the background order workers.
+
+    Parameters:
+    - username: Username of the customer
+    - quantities: Mapping of item ID to quantity
+    - idempotency_key: Key identifying this sale attempt for downstream balance changes
+    - before_refund, after_refund: Hooks around a refund (see `charge_with_reserved_stock`)
+    - order_id: ID of the queued order being completed; its sales are recorded
+      at most once, however often the order is retried
+
+    Returns:
+    - The status code, the message, and details for the caller to add to its
+      response: the `item_id` of a missing or out-of-stock item, or the
+      `total_price` and recorded `sales` on success
+    """
+    try:
+        if order_id is not None:
+            recorded = recorded_order_sales(order_id)
+            if recorded is not None:
+                logger.info("Sales for order %s were already recorded.", order_id)
+                return 200, 'Sale processed successfully', recorded
+
+        # Step 1: Fetch all items in one batch lookup, concurrently with the customer
+        logger.info("Fetching item IDs %s and customer details for username: %s.", list(quantities), username)
+        items_future = submit(
+            lookup_executor, inventory_client.get, '/items', params={'ids': ','.join(str(item_id) for item_id in quantities)}
+        )
+        customer_future = submit(lookup_executor, customers_client.get, f'/customers/{username}')
+
+        # Step 2: Check every item and its stock
+        items_response = items_future.result()
+        if items_response.status_code != 200:
+            logger.error("Failed to fetch item IDs %s.", list(quantities))
+            return 500, 'Unable to fetch item details', {}
+        found = items_response.json()
+        items = {}
+        for item_id in quantities:
+            item = found.get(str(item_id))
+            if item is None:
+                logger.warning("Item ID %s not found.", item_id)
+                return 404, 'Item not found', {'item_id': item_id}
+            if item['stock_count'] < quantities[item_id]:
+                logger.warning("Insufficient stock for item ID %s. Requested: %s, Available: %s.", item_id, quantities[item_id], item['stock_count'])
+                return 400, 'Insufficient stock', {'item_id': item_id}
+            items[item_id] = item
+
+        # Step 3: Check customer details
+        customer_response = customer_future.result()
+        if customer_response.status_code != 200:
+            logger.warning("Customer username %s not found.", username)
+            return 404, 'Customer not found', {}
+        customer = customer_response.json()
+
+        # Step 4: Check balance against the total
+        line_totals = {item_id: items[item_id]['price'] * quantity for item_id, quantity in quantities.items()}
+        total_price = sum(line_totals.values())
+        if customer['balance'] < total_price:
+            logger.warning("Insufficient balance for customer %s. Required: %s, Available: %s.", username, total_price, customer['balance'])
+            return 400, 'Insufficient balance', {}
+
+        # Step 5: Hold the stock of every item, deduct the total once and commit the stock deduction
+        failure = charge_with_reserved_stock(
+            username, quantities, total_price, idempotency_key=idempotency_key,
+            before_refund=before_refund, after_refund=after_refund
+        )
+        if failure:
+            body, status_code = failure
+            return status_code, body['message'], {}
+
+        # Step 6: Record all sales in a single transaction
+        new_sales = [
+            Sale(
+                username=username,
+                item_id=item_id,
+                quantity=quantity,
+                total_price=line_totals[item_id],
+                order_id=order_id
+            )
+            for item_id, quantity in quantities.items()
+        ]
+        db.session.add_all(new_sales)
+        try:
+            db.session.commit()
+        except IntegrityError:
+            # A concurrent attempt of the same order recorded its sales first
+            db.session.rollback()
+            logger.warning("Sales for order %s were recorded by a concurrent attempt.", order_id)
+            return 200, 'Sale processed successfully', recorded_order_sales(order_id)
+
+        logger.info("Sale processed successfully for username %s, item IDs %s.", username, list(quantities))
+        return 200, 'Sale processed successfully', {
+            'total_price': total_price,
+            'sales': sales_schema.dump(new_sales)
+        }
+
+    except SERVICE_UNAVAILABLE_ERRORS:
+        logger.error("A required service is unavailable.")
+        return 503, 'A required service is not available', {}
+
+def parse_sale_lines(lines):
+    """
+    Validate sale lines and merge repeated items so each item is fetched and deducted once.
+
+    Returns:
+    - A mapping of item ID to quantity and an error message, one of which is None
+    """
+    quantities = {}
+    for line in lines:
+        try:
+            item_id = int(line['item_id'])
+            quantity = int(line.get('quantity', 1))
+        except (KeyError, TypeError, ValueError, AttributeError):
+            return None, 'Each line requires a valid item_id and quantity'
+        if quantity <= 0:
+            return None, 'Quantity must be positive'
+        quantities[item_id] = quantities.get(item_id, 0) + quantity
+    return quantities, None
+
+def async_sale_requested():
+    """
+    Whether the current sale should be queued: async mode is enabled in the
+    configuration or the client sent ``Prefer: respond-async``.
+    """
+    return app.config['SALES_ASYNC_MODE'] or 'respond-async' in request.headers.get('Prefer', '')
+
+def enqueue_order(username, quantities):
+    """
+    Write a sale to the durable order queue and wake the order workers.
+
+    Returns:
+    - 202 response with the order ID and a `Location` header for polling its status
+    """
+    order = Order(
+        username=username,
+        lines=json.dumps([{'item_id': item_id, 'quantity': quantity} for item_id, quantity in quantities.items()])
+    )
+    db.session.add(order)
+    db.session.commit()
+
+    start_order_workers()
+    order_queue_event.set()
+
+    logger.info("Order %s queued for username %s, item IDs %s.", order.id, username, list(quantities))
+    response = jsonify({'message': 'Sale accepted', 'order_id': order.id, 'status': order.status})
+    response.headers['Location'] = f'/sales/orders/{order.id}'
+    return response, 202
+
 @app.route('/sales', methods=['POST'])
+@customer_token_required
+@idempotent
 def process_sale():
     """
     Process a sale when a customer purchases a good.
@@ -100,10 +742,17 @@ def process_sale():
     - item_id: ID of the item being purchased
     - quantity: Quantity of the item being purchased (default is 1)
 
+    Headers:
+    - Idempotency-Key: Optional; retries with the same key replay the original response
+    - Prefer: Optional; `respond-async` queues the sale instead of processing it inline
+
     Returns:
     - 200: Sale processed successfully
+    - 202: Sale queued (async mode), with the order ID to poll
     - 400: Missing required fields, insufficient stock, or insufficient balance
     - 404: Item or customer not found
+    - 409: A request with the same Idempotency-Key is still in progress
+    - 422: The Idempotency-Key was already used for a different request
     - 500: Failed to deduct balance or stock
     - 503: Inventory Service is not available
     """
@@ -117,92 +766,326 @@ def process_sale():
         logger.warning("Sale request missing required fields: username or item_id.")
         return jsonify({'message': 'Username and item_id are required'}), 400
 
-    try:
-        # Step 1: Fetch item details
-        logger.info(f"Fetching item details for item ID: {item_id}.")
-        item_response = requests.get(f'{INVENTORY_SERVICE_URL}/items/{item_id}')
-        if item_response.status_code != 200:
-            logger.warning(f"Item ID {item_id} not found.")
-            return jsonify({'message': 'Item not found'}), 404
-        item = item_response.json()
+    quantities, error = parse_sale_lines([{'item_id': item_id, 'quantity': quantity}])
+    if error:
+        logger.warning("Sale request has an invalid item_id or quantity: %s.", error)
+        return jsonify({'message': error}), 400
 
-        # Step 2: Check stock
-        if item['stock_count'] < quantity:
-            logger.warning(f"Insufficient stock for item ID {item_id}. Requested: {quantity}, Available: {item['stock_count']}.")
-            return jsonify({'message': 'Insufficient stock'}), 400
+    if async_sale_requested():
+        return enqueue_order(username, quantities)
 
-        # Step 3: Fetch customer details
-        logger.info(f"Fetching customer details for username: {username}.")
-        customer_response = requests.get(f'{CUSTOMERS_SERVICE_URL}/customers/{username}')
-        if customer_response.status_code != 200:
-            logger.warning(f"Customer username {username} not found.")
-            return jsonify({'message': 'Customer not found'}), 404
-        customer = customer_response.json()
+    status_code, message, _ = complete_sale(username, quantities, **idempotency_hooks())
+    if status_code == 503:
+        # The single-item endpoint has always reported any unavailable service this way
+        message = 'Inventory Service is not available'
+    return jsonify({'message': message}), status_code
 
-        # Step 4: Check balance
-        total_price = item['price'] * quantity
-        if customer['balance'] < total_price:
-            logger.warning(f"Insufficient balance for customer {username}. Required: {total_price}, Available: {customer['balance']}.")
-            return jsonify({'message': 'Insufficient balance'}), 400
-
-        # Step 5: Deduct balance and stock
-        logger.info(f"Deducting balance for customer {username}.")
-        deduct_balance_response = requests.post(
-            f'{CUSTOMERS_SERVICE_URL}/customers/{username}/deduct',
-            json={'amount': total_price}
-        )
-        if deduct_balance_response.status_code != 200:
-            logger.error(f"Failed to deduct balance for customer {username}.")
-            return jsonify({'message': 'Failed to deduct balance'}), 500
-
-        logger.info(f"Deducting stock for item ID: {item_id}.")
-        deduct_stock_response = requests.post(
-            f'{INVENTORY_SERVICE_URL}/items/{item_id}/deduct',
-            json={'quantity': quantity}
-        )
-        if deduct_stock_response.status_code != 200:
-            logger.error(f"Failed to deduct stock for item ID: {item_id}.")
-            return jsonify({'message': 'Failed to deduct stock'}), 500
-
-        # Step 6: Record sale
-        new_sale = Sale(
-            username=username,
-            item_id=item_id,
-            quantity=quantity,
-            total_price=total_price
+@app.route('/sales/batch', methods=['POST'])
+@customer_token_required
+@idempotent
+def process_cart_sale():
+    """
+    Process a multi-item cart checkout for a single customer.
+
+    All items and the customer are fetched once, stock for all lines is
+    reserved in one all-or-nothing inventory call, the total is deducted from
+    the customer's balance in a single call and every line is recorded as a
+    `Sale` in one transaction.
+
+    Request JSON should contain:
+    - username: Username of the customer
+    - items: List of lines, each with `item_id` and `quantity` (default is 1)
+
+    Headers:
+    - Idempotency-Key: Optional; retries with the same key replay the original response
+    - Prefer: Optional; `respond-async` queues the sale instead of processing it inline
+
+    Returns:
+    - 200: Cart processed successfully, with the recorded sales and total price
+    - 202: Cart queued (async mode), with the order ID to poll
+    - 400: Missing or invalid fields, insufficient stock, or insufficient balance
+    - 404: Item or customer not found
+    - 500: Failed to deduct balance or stock
+    - 503: A required service is not available
+    """
+    logger.info("Processing a cart sale request.")
+    data = request.get_json()
+    username = data.get('username')
+    lines = data.get('items')
+
+    if not username or not lines or not isinstance(lines, list):
+        logger.warning("Cart sale request missing required fields: username or items.")
+        return jsonify({'message': 'Username and items are required'}), 400
+
+    if len(lines) > app.config['MAX_CART_LINES']:
+        logger.warning("Cart sale request has too many lines: %s.", len(lines))
+        return jsonify({'message': f"A cart may contain at most {app.config['MAX_CART_LINES']} lines"}), 400
+
+    quantities, error = parse_sale_lines(lines)
+    if error:
+        logger.warning("Cart sale request has an invalid line: %s.", error)
+        return jsonify({'message': error}), 400
+
+    if async_sale_requested():
+        return enqueue_order(username, quantities)
+
+    status_code, message, details = complete_sale(username, quantities, **idempotency_hooks())
+    return jsonify({'message': message, **details}), status_code
+
+@app.route('/sales/orders/<int:order_id>', methods=['GET'])
+def get_order_status(order_id):
+    """
+    Get the status of a queued sale.
+
+    URL parameter:
+    - order_id: ID returned when the sale was accepted
+
+    Returns:
+    - 200: Order status (`queued`, `processing`, `completed` or `failed`) and,
+      once finished, the status code and body of the sale
+    - 404: Order not found
+    """
+    order = db.session.get(Order, order_id)
+    if not order:
+        logger.warning("Order ID %s not found.", order_id)
+        return jsonify({'message': 'Order not found'}), 404
+
+    logger.info("Fetched status for order ID %s: %s.", order_id, order.status)
+    return jsonify({
+        'order_id': order.id,
+        'username': order.username,
+        'items': json.loads(order.lines),
+        'status': order.status,
+        'attempts': order.attempts,
+        'status_code': order.status_code,
+        'result': json.loads(order.result) if order.result else None,
+        'created_at': order.created_at.isoformat(),
+        'updated_at': order.updated_at.isoformat()
+    }), 200
+
+# Order workers: background threads that drain the durable order queue
+order_queue_event = threading.Event()
+order_workers_pid = None
+order_workers_lock = threading.Lock()
+last_stale_order_check = float('-inf')
+
+def claim_next_order():
+    """
+    Atomically move the oldest due order from `queued` to `processing`.
+
+    The claim is a conditional UPDATE, so workers in several processes never
+    pick up the same order.
+
+    Returns:
+    - The claimed order's row, or None if the queue is empty
+    """
+    now = datetime.utcnow()
+    next_order = (
+        select(Order.id)
+        .where(Order.status == 'queued', Order.next_attempt_at <= now)
+        .order_by(Order.next_attempt_at, Order.id)
+        .limit(1)
+        .scalar_subquery()
+    )
+    claimed = db.session.execute(
+        update(Order)
+        .where(Order.id == next_order, Order.status == 'queued')
+        .values(status='processing', attempts=Order.attempts + 1, updated_at=now)
+        .returning(Order.id, Order.username, Order.lines, Order.attempts)
+        .execution_options(synchronize_session=False)
+    ).first()
+    db.session.commit()
+    return claimed
+
+def settle_order(order_id, body, status_code):
+    """
+    Mark an order failed before its charge is refunded, so it is never requeued and replayed without paying.
+    """
+    db.session.execute(
+        update(Order)
+        .where(Order.id == order_id)
+        .values(status='failed', status_code=status_code, result=json.dumps(body), updated_at=datetime.utcnow())
+    )
+    db.session.commit()
+
+def process_next_order():
+    """
+    Claim and complete one queued order.
+
+    Orders that fail because a downstream service is unavailable are requeued
+    with exponential backoff until `ORDER_MAX_ATTEMPTS` is reached. The stock
+    reservation and balance changes use keys derived from the order ID, and
+    sales are recorded under it, so a retried or requeued order never charges
+    the customer twice, holds its stock again or records its sales twice.
+
+    Returns:
+    - True if an order was processed, False if the queue was empty
+    """
+    order = claim_next_order()
+    if order is None:
+        return False
+
+    quantities = {line['item_id']: line['quantity'] for line in json.loads(order.lines)}
+    try:
+        status_code, message, details = complete_sale(
+            order.username, quantities, idempotency_key=f'order-{order.id}',
+            before_refund=lambda body, status_code: settle_order(order.id, body, status_code),
+            order_id=order.id
         )
-        db.session.add(new_sale)
-        db.session.commit()
+        body = {'message': message, **details}
+    except Exception:
+        logger.exception("Unexpected error while processing order %s.", order.id)
+        db.session.rollback()
+        body, status_code = {'message': 'Internal server error'}, 500
 
-        logger.info(f"Sale processed successfully for username {username}, item ID {item_id}.")
-        return jsonify({'message': 'Sale processed successfully'}), 200
+    now = datetime.utcnow()
+    values = {'status_code': status_code, 'result': json.dumps(body), 'updated_at': now}
+    if status_code == 503 and order.attempts < app.config['ORDER_MAX_ATTEMPTS']:
+        values['status'] = 'queued'
+        values['next_attempt_at'] = now + timedelta(seconds=min(2 ** order.attempts, 60))
+        logger.warning("Order %s requeued after attempt %s: a required service is unavailable.", order.id, order.attempts)
+    else:
+        values['status'] = 'completed' if status_code == 200 else 'failed'
+        logger.info("Order %s %s with status code %s.", order.id, values['status'], status_code)
 
-    except requests.exceptions.ConnectionError:
-        logger.error("A required service is unavailable.")
-        return jsonify({'message': 'Inventory Service is not available'}), 503
+    db.session.execute(update(Order).where(Order.id == order.id).values(**values))
+    db.session.commit()
+    return True
+
+def requeue_stale_orders():
+    """
+    Requeue orders left in `processing` by a worker that died mid-flight.
+
+    Runs at most once per `ORDER_PROCESSING_TIMEOUT` per process.
+    """
+    global last_stale_order_check
+    if time.monotonic() - last_stale_order_check < app.config['ORDER_PROCESSING_TIMEOUT']:
+        return
+    last_stale_order_check = time.monotonic()
+
+    cutoff = datetime.utcnow() - timedelta(seconds=app.config['ORDER_PROCESSING_TIMEOUT'])
+    requeued = db.session.execute(
+        update(Order)
+        .where(Order.status == 'processing', Order.updated_at < cutoff)
+        .values(status='queued', next_attempt_at=datetime.utcnow())
+    ).rowcount
+    db.session.commit()
+    if requeued:
+        logger.warning("Requeued %s stale orders.", requeued)
+
+def order_worker_loop():
+    """
+    Drain the order queue, sleeping until woken by a new order or the poll interval elapses.
+    """
+    while True:
+        try:
+            with app.app_context():
+                if process_next_order():
+                    continue
+                requeue_stale_orders()
+        except Exception:
+            logger.exception("Order worker failed to process the queue.")
+        order_queue_event.wait(timeout=app.config['ORDER_POLL_INTERVAL'])
+        order_queue_event.clear()
+
+def start_order_workers():
+    """
+    Start this process's order worker threads if they are not running yet.
+    """
+    global order_workers_pid
+    with order_workers_lock:
+        if order_workers_pid == os.getpid():
+            return
+        order_workers_pid = os.getpid()
+        for index in range(app.config['ORDER_WORKERS']):
+            threading.Thread(target=order_worker_loop, name=f'sales-order-worker-{index}', daemon=True).start()
+
+def until_condition(value):
+    """
+    Inclusive upper bound on the sale date; a date without a time covers that whole day.
+
+    Raises:
+    - ValueError: If the value is not an ISO 8601 date or datetime
+    """
+    try:
+        day = date.fromisoformat(value)
+    except ValueError:
+        return Sale.sale_date <= datetime.fromisoformat(value)
+    return Sale.sale_date < datetime.combine(day, datetime.min.time()) + timedelta(days=1)
 
 @app.route('/sales/history/<username>', methods=['GET'])
+@customer_token_required
 def get_purchase_history(username):
     """
-    Get the purchase history for a specific customer.
+    Get the purchase history for a specific customer, newest first.
+
+    Pages are fetched with keyset pagination over the `(username, sale_date)`
+    index, so each page costs the same however many sales the customer has.
 
     URL parameter:
     - username: Username of the customer
 
+    Query parameters (all optional):
+    - limit: Page size (default `HISTORY_PAGE_SIZE`, at most `HISTORY_MAX_PAGE_SIZE`)
+    - cursor: The `X-Next-Cursor` value of the previous page
+    - since, until: ISO 8601 date or datetime bounds on the sale date (inclusive)
+    - fields: Comma-separated fields to return; only those columns are selected
+
     Returns:
-    - 200: List of purchase history
+    - 200: List of purchase history; the first page carries `X-Total-Count` and
+      `X-Total-Spent` headers for the whole (filtered) history, and an
+      `X-Next-Cursor` header is set when more sales follow
+    - 400: Invalid query parameter
     - 404: No purchase history found for the user
     """
-    logger.info(f"Fetching purchase history for username: {username}.")
-    sales = Sale.query.filter_by(username=username).all()
-    if sales:
-        logger.info(f"Found {len(sales)} sales for username {username}.")
-        result = sales_schema.dump(sales)
-        return jsonify(result), 200
-    else:
-        logger.warning(f"No purchase history found for username {username}.")
+    logger.info("Fetching purchase history for username: %s.", username)
+    conditions = [Sale.username == username]
+    try:
+        limit = parse_limit(request.args.get('limit'), app.config['HISTORY_PAGE_SIZE'], app.config['HISTORY_MAX_PAGE_SIZE'])
+        serializer = sale_serializer.only(request.args.get('fields'))
+        if request.args.get('since'):
+            conditions.append(Sale.sale_date >= datetime.fromisoformat(request.args['since']))
+        if request.args.get('until'):
+            conditions.append(until_condition(request.args['until']))
+        cursor = request.args.get('cursor')
+        after = None
+        if cursor:
+            after = tuple_(Sale.sale_date, Sale.id) < tuple_(*coerce_cursor(decode_cursor(cursor), [Sale.sale_date, Sale.id]))
+    except (TypeError, ValueError) as e:
+        logger.warning("Invalid purchase history request for username %s: %s.", username, e)
+        return jsonify({'message': 'Invalid query parameter'}), 400
+
+    query = Sale.query.filter(*conditions)
+    if after is not None:
+        query = query.filter(after)
+    # A sparse fieldset can only be pushed into the SELECT on the column path
+    fast = app.config['FAST_SERIALIZERS'] or serializer is not sale_serializer
+    if fast:
+        query = query.with_entities(*serializer.columns_with(Sale.sale_date, Sale.id))
+    sales = query.order_by(Sale.sale_date.desc(), Sale.id.desc()).limit(limit + 1).all()
+
+    if not sales and not cursor:
+        logger.warning("No purchase history found for username %s.", username)
         return jsonify({'message': 'No purchase history found for this user'}), 404
 
+    next_cursor = None
+    if len(sales) > limit:
+        sales = sales[:limit]
+        next_cursor = encode_cursor([sales[-1].sale_date.isoformat(), sales[-1].id])
+
+    logger.info("Found %s sales for username %s.", len(sales), username)
+    response = json_response(serializer.dump_many(sales)) if fast else jsonify(sales_schema.dump(sales))
+    if next_cursor:
+        response.headers['X-Next-Cursor'] = next_cursor
+    if not cursor:
+        # Aggregates are computed in SQL on the first page only, without loading rows
+        total_count, total_spent = db.session.execute(
+            select(func.count(Sale.id), func.coalesce(func.sum(Sale.total_price), 0)).where(*conditions)
+        ).one()
+        response.headers['X-Total-Count'] = str(total_count)
+        response.headers['X-Total-Spent'] = str(total_spent)
+    return response, 200
+
 @app.route('/', methods=['GET'])
 def index():
     """
@@ -217,5 +1100,12 @@ def index():
 if __name__ == '__main__':
     with app.app_context():
         db.create_all()
+        # create_all() skips existing tables, so add columns and indexes introduced since the database was created
+        if 'order_id' not in {column['name'] for column in inspect(db.engine).get_columns('sales')}:
+            with db.engine.begin() as connection:
+                connection.execute(text('ALTER TABLE sales ADD COLUMN order_id INTEGER'))
+        for index in Sale.__table__.indexes:
+            index.create(db.engine, checkfirst=True)
     logger.info("Starting Sales Service.")
+    start_order_workers()
     app.run(port=5002, debug=True)
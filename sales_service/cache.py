@@ -0,0 +1,102 @@
+# cache.py
+
+import threading
+import time
+from collections import OrderedDict
+
+
+class CacheEntry:
+    """
+    A cached value together with the validator it was served with.
+    """
+
+    __slots__ = ('value', 'etag', 'fetched_at')
+
+    def __init__(self, value, etag=None):
+        self.value = value
+        self.etag = etag
+        self.fetched_at = time.monotonic()
+
+    @property
+    def age(self):
+        return time.monotonic() - self.fetched_at
+
+
+class TTLCache:
+    """
+    Thread-safe in-process cache with a time-to-live and LRU eviction.
+
+    Entries younger than ``ttl`` are fresh. Entries older than that but
+    within ``ttl + stale_ttl`` may still be served while a single background
+    refresh revalidates them (stale-while-revalidate). Older entries are kept
+    until evicted so their ETag can be used for a conditional request.
+
+    Parameters:
+        - maxsize (int): Maximum number of entries; the least recently used entry is evicted first.
+        - ttl (float): Seconds an entry is considered fresh.
+        - stale_ttl (float): Additional seconds a stale entry may be served while it is refreshed.
+    """
+
+    def __init__(self, maxsize, ttl, stale_ttl=0):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.stale_ttl = stale_ttl
+        self._entries = OrderedDict()
+        self._refreshing = set()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        """
+        Return the entry for ``key`` (fresh or not) and mark it as recently used, or None.
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+            return entry
+
+    def set(self, key, value, etag=None):
+        entry = CacheEntry(value, etag)
+        with self._lock:
+            self._entries[key] = entry
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+        return entry
+
+    def touch(self, key):
+        """
+        Mark an entry as fresh again after the origin confirmed it is unchanged.
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                entry.fetched_at = time.monotonic()
+            return entry
+
+    def is_fresh(self, entry):
+        return entry.age < self.ttl
+
+    def is_servable_stale(self, entry):
+        return entry.age < self.ttl + self.stale_ttl
+
+    def begin_refresh(self, key):
+        """
+        Claim the background refresh of ``key``; returns False if one is already running.
+        """
+        with self._lock:
+            if key in self._refreshing:
+                return False
+            self._refreshing.add(key)
+            return True
+
+    def end_refresh(self, key):
+        with self._lock:
+            self._refreshing.discard(key)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
@@ -9,3 +9,68 @@ class Config:
     SQLALCHEMY_DATABASE_URI = 'sqlite:///' + os.path.join(basedir, 'sales.db')
     SQLALCHEMY_TRACK_MODIFICATIONS = False
     SECRET_KEY = 'your_secret_key'  # Replace with an actual secret key in production
+
+    # Reject customer requests without a token from POST /customers/login (signed with SECRET_KEY,
+    # which must match the Customers Service's); tokens that are sent are always checked
+    REQUIRE_CUSTOMER_TOKEN = False
+
+    # Outbound HTTP clients (timeouts in seconds, pool size in connections)
+    INVENTORY_SERVICE_CONNECT_TIMEOUT = 2.0
+    INVENTORY_SERVICE_READ_TIMEOUT = 5.0
+    INVENTORY_SERVICE_POOL_SIZE = 20
+    CUSTOMERS_SERVICE_CONNECT_TIMEOUT = 2.0
+    CUSTOMERS_SERVICE_READ_TIMEOUT = 5.0
+    CUSTOMERS_SERVICE_POOL_SIZE = 20
+
+    # Threads used to fan out independent downstream lookups during a sale
+    LOOKUP_WORKERS = 16
+
+    # Maximum number of lines accepted by a single cart checkout
+    MAX_CART_LINES = 100
+
+    # Seconds inventory holds reserved stock while the customer is charged
+    RESERVATION_TTL = 30
+
+    # Times a balance deduction, refund or stock commit is resent when its outcome is unknown
+    # (timeout or connection error); all three are safe to repeat
+    PAYMENT_CALL_RETRIES = 2
+
+    # Idempotency-Key handling for POST /sales: how long responses are replayed, and after how
+    # many seconds an in-progress request is presumed dead and its key may be reclaimed
+    IDEMPOTENCY_KEY_TTL = 86400
+    IDEMPOTENCY_LOCK_TIMEOUT = 60
+
+    # Asynchronous order pipeline: queue every sale instead of processing it inline (clients can also
+    # opt in per request with 'Prefer: respond-async'), worker threads per process, retry and polling limits
+    SALES_ASYNC_MODE = False
+    ORDER_WORKERS = 4
+    ORDER_MAX_ATTEMPTS = 5
+    ORDER_POLL_INTERVAL = 1.0
+    ORDER_PROCESSING_TIMEOUT = 300
+
+    # In-process cache for /goods and /goods/<id>: seconds an entry is fresh, extra seconds a stale
+    # entry may be served while it is revalidated in the background, and maximum number of entries
+    GOODS_CACHE_TTL = 10
+    GOODS_CACHE_STALE_TTL = 60
+    GOODS_CACHE_MAX_ENTRIES = 5000
+
+    # Page size requested when /goods follows the Inventory Service's X-Next-Cursor
+    GOODS_PAGE_SIZE = 1000
+
+    # GET /sales/history/<username>: default and maximum page size
+    HISTORY_PAGE_SIZE = 50
+    HISTORY_MAX_PAGE_SIZE = 500
+
+    # Serialize list endpoints with precompiled row serializers instead of marshmallow
+    FAST_SERIALIZERS = True
+
+    # Return a Server-Timing header breaking down DB, downstream call and serialization time
+    SERVER_TIMING = True
+
+    # Audit log: file, rotation size (bytes), rotated files kept, level, and
+    # records buffered for the background writer before new ones are dropped
+    AUDIT_LOG_FILE = os.environ.get('AUDIT_LOG_FILE', 'audit.log')
+    AUDIT_LOG_MAX_BYTES = int(os.environ.get('AUDIT_LOG_MAX_BYTES', 10 * 1024 * 1024))
+    AUDIT_LOG_BACKUP_COUNT = int(os.environ.get('AUDIT_LOG_BACKUP_COUNT', 5))
+    AUDIT_LOG_LEVEL = os.environ.get('AUDIT_LOG_LEVEL', 'INFO')
+    AUDIT_LOG_QUEUE_SIZE = int(os.environ.get('AUDIT_LOG_QUEUE_SIZE', 10000))
@@ -5,6 +5,10 @@ from datetime import datetime
 
 class Sale(db.Model):
     __tablename__ = 'sales'
+    __table_args__ = (
+        db.Index('ix_sales_username_sale_date', 'username', 'sale_date', 'id'),  # Purchase history pages
+        db.Index('ix_sales_order_id_item_id', 'order_id', 'item_id', unique=True),  # One row per order line
+    )
 
     id = db.Column(db.Integer, primary_key=True)
     username = db.Column(db.String(50), nullable=False)
@@ -12,10 +16,46 @@ class Sale(db.Model):
     quantity = db.Column(db.Integer, nullable=False)
     total_price = db.Column(db.Float, nullable=False)
     sale_date = db.Column(db.DateTime, default=datetime.utcnow)
+    order_id = db.Column(db.Integer)  # Queued order that recorded the sale, None for inline sales
 
     def __repr__(self):
         return f'<Sale {self.id}>'
 
+class IdempotencyRecord(db.Model):
+    __tablename__ = 'idempotency_records'
+
+    key = db.Column(db.String(64), primary_key=True)
+    request_hash = db.Column(db.String(64), nullable=False)  # SHA-256 of the path and request body
+    status = db.Column(db.String(12), nullable=False, default='in_progress')  # 'in_progress', 'completed', 'failed'
+    attempt = db.Column(db.Integer, nullable=False, default=0)  # Bumped when a charge is refunded
+    status_code = db.Column(db.Integer)
+    response_body = db.Column(db.Text)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
+    expires_at = db.Column(db.DateTime, nullable=False, index=True)
+
+    def __repr__(self):
+        return f'<IdempotencyRecord {self.key} {self.status}>'
+
+class Order(db.Model):
+    __tablename__ = 'orders'
+    __table_args__ = (
+        db.Index('ix_orders_status_next_attempt_at', 'status', 'next_attempt_at'),  # Queue polling
+    )
+
+    id = db.Column(db.Integer, primary_key=True)
+    username = db.Column(db.String(50), nullable=False)
+    lines = db.Column(db.Text, nullable=False)  # JSON list of {item_id, quantity}
+    status = db.Column(db.String(12), nullable=False, default='queued')  # 'queued', 'processing', 'completed', 'failed'
+    attempts = db.Column(db.Integer, nullable=False, default=0)
+    status_code = db.Column(db.Integer)
+    result = db.Column(db.Text)  # JSON body of the finished sale
+    created_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
+    next_attempt_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
+
+    def __repr__(self):
+        return f'<Order {self.id} {self.status}>'
+
 class SaleSchema(ma.SQLAlchemyAutoSchema):
     class Meta:
         model = Sale
@@ -8,13 +8,20 @@ current_dir = os.path.dirname(os.path.abspath(__file__))
 parent_dir = os.path.abspath(os.path.join(current_dir, '..'))
 sys.path.insert(0, parent_dir)
 
-from app import app, db
+from app import app, db, goods_cache
+
+
+def downstream_key(key):
+    import hashlib
+    return hashlib.sha256(key.encode('utf-8')).hexdigest()
 
 
 @pytest.fixture
 def client():
     app.config['TESTING'] = True
     app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///:memory:'  # Use in-memory database
+    app.config['ORDER_WORKERS'] = 0  # Tests drain the order queue explicitly
+    goods_cache.clear()
     with app.test_client() as client:
         with app.app_context():
             db.drop_all()  # Reset database
@@ -29,8 +36,8 @@ def test_index(client):
 
 
 def test_display_available_goods(client, requests_mock):
-    # Mock the Inventory Service response
-    requests_mock.get('http://localhost:5001/items', json=[
+    # Mock the Inventory Service response; only the displayed fields are requested
+    requests_mock.get('http://localhost:5001/items?fields=id,name,price', json=[
         {'id': 1, 'name': 'Laptop', 'price': 1200.0},
         {'id': 2, 'name': 'Smartphone', 'price': 799.99}
     ])
@@ -44,15 +51,28 @@ def test_display_available_goods(client, requests_mock):
     assert data[1]['price'] == 799.99
 
 
+def test_display_available_goods_follows_next_cursor(client, requests_mock):
+    pages = requests_mock.get('http://localhost:5001/items?fields=id,name,price', [
+        {'json': [{'id': 1, 'name': 'Laptop', 'price': 1200.0}], 'headers': {'X-Next-Cursor': 'WzFd', 'ETag': '"c1"'}},
+        {'json': [{'id': 2, 'name': 'Smartphone', 'price': 799.99}]}
+    ])
+
+    response = client.get('/goods')
+    assert response.status_code == 200
+    assert [good['id'] for good in response.get_json()] == [1, 2]
+    assert pages.call_count == 2
+    assert pages.last_request.qs['cursor'] == ['wzfd']
+
+
 def test_process_sale_success(client, requests_mock):
     # Mock Inventory Service
-    requests_mock.get('http://localhost:5001/items/1', json={
+    requests_mock.get('http://localhost:5001/items?ids=1', json={'1': {
         'id': 1,
         'name': 'Laptop',
         'price': 12.99,
         'stock_count': 5,
         'description': 'A high-end gaming laptop'
-    })
+    }})
     # Mock Customers Service
     requests_mock.get('http://localhost:5000/customers/john_doe', json={
         'username': 'john_doe',
@@ -60,8 +80,9 @@ def test_process_sale_success(client, requests_mock):
     })
     # Mock Deduct Balance
     requests_mock.post('http://localhost:5000/customers/john_doe/deduct', status_code=200)
-    # Mock Deduct Stock
-    requests_mock.post('http://localhost:5001/items/1/deduct', status_code=200)
+    # Mock Stock Reservation
+    requests_mock.post('http://localhost:5001/items/reserve', status_code=201, json={'token': 'abc'})
+    requests_mock.post('http://localhost:5001/reservations/abc/commit', status_code=200)
 
     # Process Sale
     response = client.post('/sales', json={
@@ -71,7 +92,20 @@ def test_process_sale_success(client, requests_mock):
     })
     print(response.get_json())  # Debugging: Display API response
     assert response.status_code == 200
-    assert response.get_json()['message'] == 'Sale processed successfully'
+    assert response.get_json() == {'message': 'Sale processed successfully'}
+
+
+def test_process_sale_keeps_single_item_responses(client, requests_mock):
+    import requests
+    requests_mock.get('http://localhost:5001/items?ids=1', json={'1': None})
+    response = client.post('/sales', json={'username': 'john_doe', 'item_id': 1})
+    assert response.status_code == 404
+    assert response.get_json() == {'message': 'Item not found'}
+
+    requests_mock.get('http://localhost:5001/items?ids=1', exc=requests.exceptions.ConnectionError)
+    response = client.post('/sales', json={'username': 'john_doe', 'item_id': 1})
+    assert response.status_code == 503
+    assert response.get_json() == {'message': 'Inventory Service is not available'}
 
 
 def test_get_purchase_history(client):
@@ -90,12 +124,12 @@ def test_get_purchase_history(client):
 
 
 def test_insufficient_balance(client, requests_mock):
-    requests_mock.get('http://localhost:5001/items/1', json={
+    requests_mock.get('http://localhost:5001/items?ids=1', json={'1': {
         'id': 1,
         'name': 'Laptop',
         'price': 1200.0,
         'stock_count': 5
-    })
+    }})
     requests_mock.get('http://localhost:5000/customers/john_doe', json={
         'username': 'john_doe',
         'balance': 100.0  # Insufficient balance
@@ -109,3 +143,623 @@ def test_insufficient_balance(client, requests_mock):
     print(response.get_json())  # Debugging: Display API response
     assert response.status_code == 400
     assert response.get_json()['message'] == 'Insufficient balance'
+
+
+def test_display_available_goods_timeout(client, requests_mock):
+    import requests
+    requests_mock.get('http://localhost:5001/items', exc=requests.exceptions.ReadTimeout)
+
+    response = client.get('/goods')
+    assert response.status_code == 503
+    assert response.get_json()['message'] == 'Inventory Service is not available'
+
+
+def test_service_client_applies_timeouts_and_pool_size(requests_mock):
+    from app import inventory_client
+    requests_mock.get('http://localhost:5001/items', json=[])
+
+    inventory_client.get('/items')
+    assert requests_mock.last_request.timeout == (
+        app.config['INVENTORY_SERVICE_CONNECT_TIMEOUT'],
+        app.config['INVENTORY_SERVICE_READ_TIMEOUT']
+    )
+    # A caller-supplied timeout takes precedence
+    inventory_client.get('/items', timeout=1.5)
+    assert requests_mock.last_request.timeout == 1.5
+
+    adapter = inventory_client.session.adapters['http://']
+    assert adapter.poolmanager.connection_pool_kw['maxsize'] == app.config['INVENTORY_SERVICE_POOL_SIZE']
+
+
+def test_process_sale_item_not_found(client, requests_mock):
+    requests_mock.get('http://localhost:5001/items?ids=99', json={'99': None})
+    requests_mock.get('http://localhost:5000/customers/john_doe', json={
+        'username': 'john_doe',
+        'balance': 1500.0
+    })
+
+    response = client.post('/sales', json={
+        'username': 'john_doe',
+        'item_id': 99,
+        'quantity': 1
+    })
+    assert response.status_code == 404
+    assert response.get_json()['message'] == 'Item not found'
+
+
+def test_process_sale_customer_not_found(client, requests_mock):
+    requests_mock.get('http://localhost:5001/items?ids=1', json={'1': {
+        'id': 1,
+        'name': 'Laptop',
+        'price': 12.99,
+        'stock_count': 5
+    }})
+    requests_mock.get('http://localhost:5000/customers/ghost', status_code=404, json={'message': 'Customer not found'})
+
+    response = client.post('/sales', json={
+        'username': 'ghost',
+        'item_id': 1,
+        'quantity': 1
+    })
+    assert response.status_code == 404
+    assert response.get_json()['message'] == 'Customer not found'
+
+
+def test_process_cart_sale_success(client, requests_mock):
+    requests_mock.get('http://localhost:5001/items?ids=1,2', json={
+        '1': {'id': 1, 'name': 'Laptop', 'price': 10.0, 'stock_count': 5},
+        '2': {'id': 2, 'name': 'Mouse', 'price': 2.5, 'stock_count': 5}
+    })
+    requests_mock.get('http://localhost:5000/customers/john_doe', json={'username': 'john_doe', 'balance': 100.0})
+    deduct_balance = requests_mock.post('http://localhost:5000/customers/john_doe/deduct', status_code=200)
+    reserve_stock = requests_mock.post('http://localhost:5001/items/reserve', status_code=201, json={'token': 'abc'})
+    commit_stock = requests_mock.post('http://localhost:5001/reservations/abc/commit', status_code=200)
+
+    response = client.post('/sales/batch', json={
+        'username': 'john_doe',
+        'items': [
+            {'item_id': 1, 'quantity': 2},
+            {'item_id': 2, 'quantity': 1},
+            {'item_id': 1}
+        ]
+    })
+    assert response.status_code == 200
+    data = response.get_json()
+    assert data['total_price'] == 32.5
+    assert len(data['sales']) == 2
+    assert deduct_balance.call_count == 1
+    assert deduct_balance.last_request.json() == {'amount': 32.5}
+    assert deduct_balance.last_request.headers['Idempotency-Key']
+    assert reserve_stock.call_count == 1
+    assert reserve_stock.last_request.json()['items'] == [
+        {'item_id': 1, 'quantity': 3},
+        {'item_id': 2, 'quantity': 1}
+    ]
+    assert commit_stock.call_count == 1
+
+    response = client.get('/sales/history/john_doe')
+    assert len(response.get_json()) == 2
+
+
+def test_process_cart_sale_insufficient_stock(client, requests_mock):
+    requests_mock.get('http://localhost:5001/items?ids=1', json={'1': {'id': 1, 'name': 'Laptop', 'price': 10.0, 'stock_count': 1}})
+    requests_mock.get('http://localhost:5000/customers/john_doe', json={'username': 'john_doe', 'balance': 100.0})
+
+    response = client.post('/sales/batch', json={
+        'username': 'john_doe',
+        'items': [{'item_id': 1, 'quantity': 3}]
+    })
+    assert response.status_code == 400
+    assert response.get_json() == {'message': 'Insufficient stock', 'item_id': 1}
+
+
+def test_process_cart_sale_invalid_line(client):
+    response = client.post('/sales/batch', json={
+        'username': 'john_doe',
+        'items': [{'quantity': 3}]
+    })
+    assert response.status_code == 400
+
+
+def test_process_sale_releases_reservation_when_charge_fails(client, requests_mock):
+    requests_mock.get('http://localhost:5001/items?ids=1', json={'1': {'id': 1, 'name': 'Laptop', 'price': 10.0, 'stock_count': 5}})
+    requests_mock.get('http://localhost:5000/customers/john_doe', json={'username': 'john_doe', 'balance': 100.0})
+    requests_mock.post('http://localhost:5001/items/reserve', status_code=201, json={'token': 'abc'})
+    requests_mock.post('http://localhost:5000/customers/john_doe/deduct', status_code=400)
+    release = requests_mock.post('http://localhost:5001/reservations/abc/release', status_code=200)
+
+    response = client.post('/sales', json={'username': 'john_doe', 'item_id': 1, 'quantity': 1})
+    assert response.status_code == 500
+    assert response.get_json()['message'] == 'Failed to deduct balance'
+    assert release.call_count == 1
+
+
+def test_process_sale_logs_failed_refund(client, requests_mock, caplog):
+    import requests
+    requests_mock.get('http://localhost:5001/items?ids=1', json={'1': {'id': 1, 'name': 'Laptop', 'price': 10.0, 'stock_count': 5}})
+    requests_mock.get('http://localhost:5000/customers/john_doe', json={'username': 'john_doe', 'balance': 100.0})
+    requests_mock.post('http://localhost:5001/items/reserve', status_code=201, json={'token': 'abc'})
+    requests_mock.post('http://localhost:5000/customers/john_doe/deduct', status_code=200)
+    requests_mock.post('http://localhost:5001/reservations/abc/commit', status_code=409)
+    refund = requests_mock.post('http://localhost:5000/customers/john_doe/refund', exc=requests.exceptions.ConnectTimeout)
+
+    response = client.post('/sales', json={'username': 'john_doe', 'item_id': 1, 'quantity': 1})
+    assert response.status_code == 500
+    assert response.get_json()['message'] == 'Failed to deduct stock'
+    assert refund.call_count == 1 + app.config['PAYMENT_CALL_RETRIES']
+    assert any(record.levelname == 'ERROR' and 'Failed to refund' in record.getMessage() for record in caplog.records)
+
+
+def test_process_sale_retries_timed_out_commit(client, requests_mock):
+    import requests
+    requests_mock.get('http://localhost:5001/items?ids=1', json={'1': {'id': 1, 'name': 'Laptop', 'price': 10.0, 'stock_count': 5}})
+    requests_mock.get('http://localhost:5000/customers/john_doe', json={'username': 'john_doe', 'balance': 100.0})
+    requests_mock.post('http://localhost:5001/items/reserve', status_code=201, json={'token': 'abc'})
+    requests_mock.post('http://localhost:5000/customers/john_doe/deduct', status_code=200)
+    commit = requests_mock.post('http://localhost:5001/reservations/abc/commit', [
+        {'exc': requests.exceptions.ReadTimeout},
+        {'status_code': 200, 'json': {'message': 'Reservation already committed'}}
+    ])
+    release = requests_mock.post('http://localhost:5001/reservations/abc/release', status_code=200)
+    refund = requests_mock.post('http://localhost:5000/customers/john_doe/refund', status_code=200)
+
+    response = client.post('/sales', json={'username': 'john_doe', 'item_id': 1, 'quantity': 1})
+    assert response.status_code == 200
+    assert commit.call_count == 2
+    assert release.call_count == 0
+    assert refund.call_count == 0
+
+
+def test_process_sale_unanswered_commit_is_not_undone(client, requests_mock):
+    import requests
+    requests_mock.get('http://localhost:5001/items?ids=1', json={'1': {'id': 1, 'name': 'Laptop', 'price': 10.0, 'stock_count': 5}})
+    requests_mock.get('http://localhost:5000/customers/john_doe', json={'username': 'john_doe', 'balance': 100.0})
+    requests_mock.post('http://localhost:5001/items/reserve', status_code=201, json={'token': 'abc'})
+    requests_mock.post('http://localhost:5000/customers/john_doe/deduct', status_code=200)
+    commit = requests_mock.post('http://localhost:5001/reservations/abc/commit', exc=requests.exceptions.ReadTimeout)
+    release = requests_mock.post('http://localhost:5001/reservations/abc/release', status_code=200)
+    refund = requests_mock.post('http://localhost:5000/customers/john_doe/refund', status_code=200)
+
+    # The commit may have gone through, so neither the stock nor the charge is given back
+    response = client.post('/sales', json={'username': 'john_doe', 'item_id': 1, 'quantity': 1})
+    assert response.status_code == 503
+    assert commit.call_count == 1 + app.config['PAYMENT_CALL_RETRIES']
+    assert release.call_count == 0
+    assert refund.call_count == 0
+
+    with app.app_context():
+        from models import Sale
+        assert Sale.query.count() == 0
+
+
+def test_process_sale_retry_after_commit_timeout_deducts_stock_once(client, requests_mock):
+    import requests
+    stock = {1: 5}
+    reservations = {}
+
+    def reserve(request, context):
+        # Inventory holds stock once per reservation key
+        key = request.json()['key']
+        if key not in reservations:
+            for line in request.json()['items']:
+                stock[line['item_id']] -= line['quantity']
+            reservations[key] = f'token{len(reservations)}'
+        context.status_code = 201
+        return {'token': reservations[key]}
+
+    requests_mock.get('http://localhost:5001/items?ids=1', json={'1': {'id': 1, 'name': 'Laptop', 'price': 10.0, 'stock_count': 5}})
+    requests_mock.get('http://localhost:5000/customers/john_doe', json={'username': 'john_doe', 'balance': 100.0})
+    reserve_stock = requests_mock.post('http://localhost:5001/items/reserve', json=reserve)
+    deduct_balance = requests_mock.post('http://localhost:5000/customers/john_doe/deduct', status_code=200)
+    # The first commit goes through but none of its answers arrive
+    retries = app.config['PAYMENT_CALL_RETRIES']
+    commit = requests_mock.post('http://localhost:5001/reservations/token0/commit',
+                                [{'exc': requests.exceptions.ReadTimeout}] * (1 + retries) + [{'status_code': 200}])
+
+    headers = {'Idempotency-Key': 'checkout-6'}
+    sale = {'username': 'john_doe', 'item_id': 1, 'quantity': 1}
+    first = client.post('/sales', json=sale, headers=headers)
+    assert first.status_code == 503
+
+    second = client.post('/sales', json=sale, headers=headers)
+    assert second.status_code == 200
+    assert stock[1] == 4
+    assert reserve_stock.call_count == 2
+    assert reserve_stock.request_history[0].json()['key'] == reserve_stock.request_history[1].json()['key']
+    assert commit.call_count == 2 + retries
+    assert len({request.headers['Idempotency-Key'] for request in deduct_balance.request_history}) == 1
+
+    with app.app_context():
+        from models import Sale
+        assert Sale.query.count() == 1
+
+
+def test_process_sale_unanswered_deduct_is_undone(client, requests_mock):
+    import requests
+    requests_mock.get('http://localhost:5001/items?ids=1', json={'1': {'id': 1, 'name': 'Laptop', 'price': 10.0, 'stock_count': 5}})
+    requests_mock.get('http://localhost:5000/customers/john_doe', json={'username': 'john_doe', 'balance': 100.0})
+    requests_mock.post('http://localhost:5001/items/reserve', status_code=201, json={'token': 'abc'})
+    deduct_balance = requests_mock.post('http://localhost:5000/customers/john_doe/deduct', exc=requests.exceptions.ReadTimeout)
+    commit = requests_mock.post('http://localhost:5001/reservations/abc/commit', status_code=200)
+    release = requests_mock.post('http://localhost:5001/reservations/abc/release', status_code=200)
+    refund = requests_mock.post('http://localhost:5000/customers/john_doe/refund', status_code=200)
+
+    response = client.post('/sales', json={'username': 'john_doe', 'item_id': 1, 'quantity': 1},
+                           headers={'Idempotency-Key': 'checkout-5'})
+    assert response.status_code == 503
+    assert deduct_balance.call_count == 1 + app.config['PAYMENT_CALL_RETRIES']
+    assert commit.call_count == 0
+    assert release.call_count == 1
+    # The refund names the deduction, so it only gives back money that was really taken
+    assert refund.call_count == 1
+    assert refund.last_request.headers['Idempotency-Key'] == downstream_key('checkout-5-deduct')
+    assert refund.last_request.json() == {'amount': 10.0}
+
+
+def test_process_sale_reservation_rejected(client, requests_mock):
+    requests_mock.get('http://localhost:5001/items?ids=1', json={'1': {'id': 1, 'name': 'Laptop', 'price': 10.0, 'stock_count': 5}})
+    requests_mock.get('http://localhost:5000/customers/john_doe', json={'username': 'john_doe', 'balance': 100.0})
+    requests_mock.post('http://localhost:5001/items/reserve', status_code=400, json={'message': 'Stock reservation failed'})
+    deduct_balance = requests_mock.post('http://localhost:5000/customers/john_doe/deduct', status_code=200)
+
+    response = client.post('/sales', json={'username': 'john_doe', 'item_id': 1, 'quantity': 1})
+    assert response.status_code == 400
+    assert response.get_json()['message'] == 'Insufficient stock'
+    assert deduct_balance.call_count == 0
+
+
+def test_process_sale_idempotency_key_replays_response(client, requests_mock):
+    requests_mock.get('http://localhost:5001/items?ids=1', json={'1': {'id': 1, 'name': 'Laptop', 'price': 10.0, 'stock_count': 5}})
+    requests_mock.get('http://localhost:5000/customers/john_doe', json={'username': 'john_doe', 'balance': 100.0})
+    reserve_stock = requests_mock.post('http://localhost:5001/items/reserve', status_code=201, json={'token': 'abc'})
+    deduct_balance = requests_mock.post('http://localhost:5000/customers/john_doe/deduct', status_code=200)
+    requests_mock.post('http://localhost:5001/reservations/abc/commit', status_code=200)
+
+    headers = {'Idempotency-Key': 'checkout-1'}
+    sale = {'username': 'john_doe', 'item_id': 1, 'quantity': 1}
+    first = client.post('/sales', json=sale, headers=headers)
+    second = client.post('/sales', json=sale, headers=headers)
+
+    assert first.status_code == 200
+    assert second.status_code == 200
+    assert second.get_json() == first.get_json()
+    assert second.headers['Idempotent-Replayed'] == 'true'
+    assert reserve_stock.call_count == 1
+    assert deduct_balance.call_count == 1
+    assert deduct_balance.last_request.headers['Idempotency-Key'] == downstream_key('checkout-1-deduct')
+
+    with app.app_context():
+        from models import Sale
+        assert Sale.query.count() == 1
+
+    # The same key with a different body is rejected
+    response = client.post('/sales', json={'username': 'john_doe', 'item_id': 1, 'quantity': 2}, headers=headers)
+    assert response.status_code == 422
+
+
+def test_process_sale_retry_after_refund_charges_again(client, requests_mock):
+    requests_mock.get('http://localhost:5001/items?ids=1', json={'1': {'id': 1, 'name': 'Laptop', 'price': 10.0, 'stock_count': 5}})
+    requests_mock.get('http://localhost:5000/customers/john_doe', json={'username': 'john_doe', 'balance': 100.0})
+    requests_mock.post('http://localhost:5001/items/reserve', status_code=201, json={'token': 'abc'})
+    deduct_balance = requests_mock.post('http://localhost:5000/customers/john_doe/deduct', status_code=200)
+    requests_mock.post('http://localhost:5001/reservations/abc/commit', [{'status_code': 409}, {'status_code': 200}])
+    refund = requests_mock.post('http://localhost:5000/customers/john_doe/refund', status_code=200)
+
+    headers = {'Idempotency-Key': 'checkout-3'}
+    sale = {'username': 'john_doe', 'item_id': 1, 'quantity': 1}
+    first = client.post('/sales', json=sale, headers=headers)
+    assert first.status_code == 500
+    assert refund.last_request.headers['Idempotency-Key'] == downstream_key('checkout-3-deduct')
+
+    # The first charge was refunded, so the retry must really charge the customer again
+    second = client.post('/sales', json=sale, headers=headers)
+    assert second.status_code == 200
+    assert deduct_balance.call_count == 2
+    assert deduct_balance.last_request.headers['Idempotency-Key'] == downstream_key('checkout-3-retry1-deduct')
+
+    with app.app_context():
+        from models import Sale
+        assert Sale.query.count() == 1
+
+
+def test_process_sale_failed_refund_is_not_retried(client, requests_mock):
+    requests_mock.get('http://localhost:5001/items?ids=1', json={'1': {'id': 1, 'name': 'Laptop', 'price': 10.0, 'stock_count': 5}})
+    requests_mock.get('http://localhost:5000/customers/john_doe', json={'username': 'john_doe', 'balance': 100.0})
+    requests_mock.post('http://localhost:5001/items/reserve', status_code=201, json={'token': 'abc'})
+    deduct_balance = requests_mock.post('http://localhost:5000/customers/john_doe/deduct', status_code=200)
+    commit = requests_mock.post('http://localhost:5001/reservations/abc/commit', [{'status_code': 409}, {'status_code': 200}])
+    requests_mock.post('http://localhost:5000/customers/john_doe/refund', status_code=500)
+
+    headers = {'Idempotency-Key': 'checkout-4'}
+    sale = {'username': 'john_doe', 'item_id': 1, 'quantity': 1}
+    first = client.post('/sales', json=sale, headers=headers)
+    second = client.post('/sales', json=sale, headers=headers)
+
+    # The customer still holds the charge, so the key must not be processed again
+    assert first.status_code == second.status_code == 500
+    assert second.headers['Idempotent-Replayed'] == 'true'
+    assert deduct_balance.call_count == 1
+    assert commit.call_count == 1
+
+
+def test_process_sale_idempotency_key_in_progress(client):
+    from datetime import datetime, timedelta
+    from models import IdempotencyRecord
+    import hashlib
+    import json
+
+    body = json.dumps({'username': 'john_doe', 'item_id': 1}).encode('utf-8')
+    with app.app_context():
+        db.session.add(IdempotencyRecord(
+            key='checkout-2',
+            request_hash=hashlib.sha256(b'/sales' + body).hexdigest(),
+            status='in_progress',
+            created_at=datetime.utcnow(),
+            expires_at=datetime.utcnow() + timedelta(hours=1)
+        ))
+        db.session.commit()
+
+    response = client.post('/sales', data=body, content_type='application/json',
+                           headers={'Idempotency-Key': 'checkout-2'})
+    assert response.status_code == 409
+    assert response.headers['Retry-After'] == '1'
+
+
+def test_process_sale_async(client, requests_mock):
+    from app import process_next_order
+    requests_mock.get('http://localhost:5001/items?ids=1', json={'1': {'id': 1, 'name': 'Laptop', 'price': 10.0, 'stock_count': 5}})
+    requests_mock.get('http://localhost:5000/customers/john_doe', json={'username': 'john_doe', 'balance': 100.0})
+    requests_mock.post('http://localhost:5001/items/reserve', status_code=201, json={'token': 'abc'})
+    deduct_balance = requests_mock.post('http://localhost:5000/customers/john_doe/deduct', status_code=200)
+    requests_mock.post('http://localhost:5001/reservations/abc/commit', status_code=200)
+
+    response = client.post('/sales', json={'username': 'john_doe', 'item_id': 1, 'quantity': 2},
+                           headers={'Prefer': 'respond-async'})
+    assert response.status_code == 202
+    order_id = response.get_json()['order_id']
+    assert response.headers['Location'] == f'/sales/orders/{order_id}'
+    assert client.get(f'/sales/orders/{order_id}').get_json()['status'] == 'queued'
+
+    with app.app_context():
+        assert process_next_order() is True
+        assert process_next_order() is False
+
+    data = client.get(f'/sales/orders/{order_id}').get_json()
+    assert data['status'] == 'completed'
+    assert data['status_code'] == 200
+    assert data['result']['total_price'] == 20.0
+    assert deduct_balance.last_request.headers['Idempotency-Key'] == downstream_key(f'order-{order_id}-deduct')
+
+
+def test_requeued_order_records_sales_once(client, requests_mock):
+    from app import process_next_order
+    from models import Order, Sale
+    requests_mock.get('http://localhost:5001/items?ids=1', json={'1': {'id': 1, 'name': 'Laptop', 'price': 10.0, 'stock_count': 5}})
+    requests_mock.get('http://localhost:5000/customers/john_doe', json={'username': 'john_doe', 'balance': 100.0})
+    reserve_stock = requests_mock.post('http://localhost:5001/items/reserve', status_code=201, json={'token': 'abc'})
+    requests_mock.post('http://localhost:5000/customers/john_doe/deduct', status_code=200)
+    requests_mock.post('http://localhost:5001/reservations/abc/commit', status_code=200)
+
+    response = client.post('/sales', json={'username': 'john_doe', 'item_id': 1, 'quantity': 2},
+                           headers={'Prefer': 'respond-async'})
+    order_id = response.get_json()['order_id']
+
+    with app.app_context():
+        assert process_next_order() is True
+        # The worker died after recording the sales but before finishing the order, which was requeued
+        Order.query.filter_by(id=order_id).update({'status': 'queued'})
+        db.session.commit()
+        assert process_next_order() is True
+        assert Sale.query.filter_by(order_id=order_id).count() == 1
+
+    data = client.get(f'/sales/orders/{order_id}').get_json()
+    assert data['status'] == 'completed'
+    assert data['result']['total_price'] == 20.0
+    assert reserve_stock.call_count == 1
+    assert reserve_stock.last_request.json()['key'] == downstream_key(f'order-{order_id}-reserve')
+
+
+def test_process_sale_async_requeues_when_service_unavailable(client, requests_mock):
+    import requests
+    from app import process_next_order
+    requests_mock.get('http://localhost:5001/items?ids=1', exc=requests.exceptions.ConnectTimeout)
+    requests_mock.get('http://localhost:5000/customers/john_doe', json={'username': 'john_doe', 'balance': 100.0})
+
+    response = client.post('/sales', json={'username': 'john_doe', 'item_id': 1},
+                           headers={'Prefer': 'respond-async'})
+    order_id = response.get_json()['order_id']
+
+    with app.app_context():
+        assert process_next_order() is True
+
+    data = client.get(f'/sales/orders/{order_id}').get_json()
+    assert data['status'] == 'queued'
+    assert data['attempts'] == 1
+    assert data['status_code'] == 503
+
+
+def test_get_order_status_not_found(client):
+    response = client.get('/sales/orders/42')
+    assert response.status_code == 404
+
+
+def test_display_available_goods_is_cached(client, requests_mock):
+    inventory = requests_mock.get('http://localhost:5001/items', json=[
+        {'id': 1, 'name': 'Laptop', 'price': 1200.0}
+    ], headers={'ETag': '"v1"'})
+
+    first = client.get('/goods')
+    second = client.get('/goods')
+    assert first.headers['X-Cache'] == 'MISS'
+    assert second.headers['X-Cache'] == 'HIT'
+    assert second.get_json() == first.get_json()
+    assert inventory.call_count == 1
+
+
+def test_display_available_goods_revalidates_with_etag(client, requests_mock, monkeypatch):
+    requests_mock.get('http://localhost:5001/items', json=[
+        {'id': 1, 'name': 'Laptop', 'price': 1200.0}
+    ], headers={'ETag': '"v1"'})
+    client.get('/goods')
+
+    # Expire the entry past the stale window so it is revalidated inline
+    monkeypatch.setattr(goods_cache, 'ttl', 0)
+    monkeypatch.setattr(goods_cache, 'stale_ttl', 0)
+    revalidation = requests_mock.get('http://localhost:5001/items', status_code=304)
+
+    response = client.get('/goods')
+    assert response.status_code == 200
+    assert response.headers['X-Cache'] == 'REVALIDATED'
+    assert response.get_json() == [{'id': 1, 'name': 'Laptop', 'price': 1200.0}]
+    assert revalidation.last_request.headers['If-None-Match'] == '"v1"'
+
+
+def test_get_goods_details_serves_stale_copy_when_inventory_is_down(client, requests_mock, monkeypatch):
+    import requests
+    requests_mock.get('http://localhost:5001/items/1', json={'id': 1, 'name': 'Laptop', 'price': 1200.0})
+    client.get('/goods/1')
+
+    monkeypatch.setattr(goods_cache, 'ttl', 0)
+    monkeypatch.setattr(goods_cache, 'stale_ttl', 0)
+    requests_mock.get('http://localhost:5001/items/1', exc=requests.exceptions.ConnectionError)
+
+    response = client.get('/goods/1')
+    assert response.status_code == 200
+    assert response.headers['X-Cache'] == 'STALE'
+    assert response.get_json()['name'] == 'Laptop'
+
+
+def test_get_purchase_history_pagination(client):
+    from datetime import datetime, timedelta
+    from models import Sale
+    with app.app_context():
+        start = datetime(2024, 1, 1)
+        for day in range(5):
+            db.session.add(Sale(username='john_doe', item_id=day + 1, quantity=1,
+                                total_price=10.0, sale_date=start + timedelta(days=day)))
+        db.session.add(Sale(username='jane_doe', item_id=9, quantity=1, total_price=99.0, sale_date=start))
+        db.session.commit()
+
+    response = client.get('/sales/history/john_doe?limit=2')
+    assert response.status_code == 200
+    assert [sale['item_id'] for sale in response.get_json()] == [5, 4]
+    assert response.headers['X-Total-Count'] == '5'
+    assert float(response.headers['X-Total-Spent']) == 50.0
+    cursor = response.headers['X-Next-Cursor']
+
+    response = client.get(f'/sales/history/john_doe?limit=2&cursor={cursor}')
+    assert [sale['item_id'] for sale in response.get_json()] == [3, 2]
+    assert 'X-Total-Count' not in response.headers
+
+    response = client.get('/sales/history/john_doe?since=2024-01-02&until=2024-01-03')
+    assert [sale['item_id'] for sale in response.get_json()] == [3, 2]
+    assert response.headers['X-Total-Count'] == '2'
+
+    assert client.get('/sales/history/john_doe?since=yesterday').status_code == 400
+
+
+def test_get_purchase_history_until_date_covers_whole_day(client):
+    from datetime import datetime
+    from models import Sale
+    with app.app_context():
+        db.session.add_all([
+            Sale(username='john_doe', item_id=1, quantity=1, total_price=10.0, sale_date=datetime(2024, 1, 3, 0, 0)),
+            Sale(username='john_doe', item_id=2, quantity=1, total_price=10.0, sale_date=datetime(2024, 1, 3, 18, 30)),
+            Sale(username='john_doe', item_id=3, quantity=1, total_price=10.0, sale_date=datetime(2024, 1, 4, 0, 0)),
+        ])
+        db.session.commit()
+
+    response = client.get('/sales/history/john_doe?until=2024-01-03')
+    assert [sale['item_id'] for sale in response.get_json()] == [2, 1]
+
+    # With a time part the bound is exact
+    response = client.get('/sales/history/john_doe?until=2024-01-03T12:00:00')
+    assert [sale['item_id'] for sale in response.get_json()] == [1]
+
+
+def test_purchase_history_fast_serializer_matches_marshmallow(client):
+    from datetime import datetime
+    from models import Sale
+    with app.app_context():
+        db.session.add_all([
+            Sale(username='john_doe', item_id=1, quantity=2, total_price=19.5, sale_date=datetime(2024, 1, 1, 9, 0, 0, 123)),
+            Sale(username='john_doe', item_id=2, quantity=1, total_price=3.0)
+        ])
+        db.session.commit()
+
+    try:
+        app.config['FAST_SERIALIZERS'] = True
+        fast = client.get('/sales/history/john_doe?limit=1')
+        app.config['FAST_SERIALIZERS'] = False
+        slow = client.get('/sales/history/john_doe?limit=1')
+    finally:
+        app.config['FAST_SERIALIZERS'] = True
+    assert fast.data == slow.data
+    assert fast.headers['X-Next-Cursor'] == slow.headers['X-Next-Cursor']
+
+
+def test_purchase_history_fields(client):
+    from models import Sale
+    with app.app_context():
+        db.session.add(Sale(username='john_doe', item_id=1, quantity=2, total_price=19.5))
+        db.session.commit()
+
+    response = client.get('/sales/history/john_doe?fields=item_id,total_price')
+    assert response.get_json() == [{'item_id': 1, 'total_price': 19.5}]
+    assert client.get('/sales/history/john_doe?fields=secret').status_code == 400
+
+
+def test_metrics_endpoint(client, requests_mock):
+    requests_mock.get('http://localhost:5001/items?fields=id,name,price', json=[])
+    assert client.get('/goods').status_code == 200
+
+    response = client.get('/metrics')
+    assert response.status_code == 200
+    body = response.get_data(as_text=True)
+    assert 'http_requests_total{method="GET",route="/goods",status="200"}' in body
+    assert 'db_queries_per_request_count{route="/goods"}' in body
+    assert 'outbound_request_duration_seconds_count{method="GET",service="inventory",status="200"}' in body
+
+
+def test_process_sale_propagates_request_id_and_server_timing(client, requests_mock):
+    requests_mock.get('http://localhost:5001/items?ids=1', json={'1': {
+        'id': 1, 'name': 'Laptop', 'price': 12.99, 'stock_count': 5
+    }})
+    requests_mock.get('http://localhost:5000/customers/john_doe', json={'username': 'john_doe', 'balance': 1500.0})
+    requests_mock.post('http://localhost:5000/customers/john_doe/deduct', status_code=200)
+    requests_mock.post('http://localhost:5001/items/reserve', status_code=201, json={'token': 'abc'})
+    requests_mock.post('http://localhost:5001/reservations/abc/commit', status_code=200)
+
+    response = client.post('/sales', json={'username': 'john_doe', 'item_id': 1, 'quantity': 1},
+                           headers={'X-Request-ID': 'trace-123'})
+    assert response.status_code == 200
+    assert response.headers['X-Request-ID'] == 'trace-123'
+    # Every downstream call, including those made from the lookup executor, carries the ID
+    assert len(requests_mock.request_history) == 5
+    assert all(call.headers['X-Request-ID'] == 'trace-123' for call in requests_mock.request_history)
+
+    timings = dict(entry.split(';dur=') for entry in response.headers['Server-Timing'].split(', '))
+    assert {'db', 'inventory', 'customers', 'serialize', 'total'} <= set(timings)
+    assert float(timings['total']) >= float(timings['db'])
+
+
+def test_customer_token_is_verified_locally(client):
+    from tokens import issue_token
+    from models import Sale
+    with app.app_context():
+        db.session.add(Sale(username='john_doe', item_id=1, quantity=1, total_price=10.0))
+        db.session.commit()
+    token, _ = issue_token('john_doe', app.config['SECRET_KEY'], 60)
+
+    response = client.get('/sales/history/john_doe', headers={'Authorization': f'Bearer {token}'})
+    assert response.status_code == 200
+    response = client.get('/sales/history/jane_doe', headers={'Authorization': f'Bearer {token}'})
+    assert response.status_code == 403
+    response = client.get('/sales/history/john_doe', headers={'Authorization': f'Bearer {token[:-2]}'})
+    assert response.status_code == 401
+
+    app.config['REQUIRE_CUSTOMER_TOKEN'] = True
+    try:
+        assert client.get('/sales/history/john_doe').status_code == 401
+    finally:
+        app.config['REQUIRE_CUSTOMER_TOKEN'] = False